@@ -0,0 +1,160 @@
+# 檔名: code/alighting_inference.py
+# 功能: 不完整旅次的下車站推估。
+# 說明: data_loader 會將沒有下車時間或下車站名的電子票證旅次標記為「旅次是否完整 = False」，
+#       OD 分析因此直接捨棄這些旅次。這裡在 data_loader 內為「沒有有效下車站名」的旅次補上推估的下車站名
+#       (有刷下車站、只缺下車時間的旅次保留原本的站名)：
+#         1. 下一次上車：同一卡號當天的下一次上車站 (當天最後一趟則用當天第一次上車站，即「回家」)，
+#            且該站必須出現在同一路線同一方向的站序中，並且不等於本次上車站；
+#         2. 歷史樣態：同一卡號在同一路線、同一上車站的完整旅次中最常下車的站。
+#       資料依 (卡號, 上車時間) 排序一次後，以單次 shift 取得下一次上車站，整個流程都是向量化運算。
+#       推估結果只補下車站名，下車時間與「旅次是否完整」維持原值；另以「下車站來源」欄位標記每筆資料的來源。
+import pandas as pd
+import numpy as np
+
+from placeholders import INVALID_STOP_NAMES, has_stop
+
+# 「下車站來源」欄位的值
+SOURCE_TAPPED = '刷卡'
+SOURCE_NON_ETICKET = '非電子票證'
+SOURCE_NEXT_BOARDING = '推估:下一次上車'
+SOURCE_FIRST_BOARDING = '推估:當日首次上車'
+SOURCE_HISTORY = '推估:歷史樣態'
+SOURCE_UNKNOWN = '無法推估'
+INFERRED_SOURCES = [SOURCE_NEXT_BOARDING, SOURCE_FIRST_BOARDING, SOURCE_HISTORY]
+
+# =============================================================================
+#  推估規則 (全部以整數代碼運算)
+# =============================================================================
+
+def _route_stop_table(route_dir, board_stop, alight_stop, observed, n_route_dirs, n_stops):
+    """ 由已知的上下車紀錄建立 (路線方向 × 站) 的布林表，用來確認推估的站是否在該路線、方向上。 """
+    table = np.zeros((n_route_dirs, n_stops), dtype=bool)
+    table[route_dir, board_stop] = True
+    table[route_dir[observed], alight_stop[observed]] = True
+    return table
+
+
+def _next_boarding_candidates(cards, days, board_stop):
+    """
+    以單次 shift 取得同一卡號、同一天的下一次上車站；當天最後一趟則改用當天第一次上車站。
+    (輸入需已依卡號與上車時間排序)
+
+    Returns:
+        tuple: (候選站代碼陣列, 是否為當日首次上車站的 bool 陣列)
+    """
+    n = len(cards)
+    same_as_next = np.zeros(n, dtype=bool)
+    same_as_next[:-1] = (cards[1:] == cards[:-1]) & (days[1:] == days[:-1])
+    next_stop = np.empty(n, dtype=np.int64)
+    next_stop[:-1] = board_stop[1:]
+
+    # 每個 (卡號, 日期) 群組的第一筆位置，以累積最大值向後延伸
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = ~same_as_next[:-1]
+    start_pos = np.maximum.accumulate(np.where(group_start, np.arange(n), 0))
+
+    is_last = ~same_as_next
+    return np.where(is_last, board_stop[start_pos], next_stop), is_last
+
+
+def _history_candidates(cards, routes, board_stop, alight_stop, observed, n_routes, n_stops):
+    """
+    取得每張卡號在同一 (路線, 上車站) 的完整旅次中最常下車的站 (同票數時取站名排序最小者)。
+    observed 至少要有一筆為 True。
+
+    Returns:
+        np.ndarray: 每筆資料的候選站代碼，沒有歷史紀錄時為 -1。
+    """
+    keys = (cards * n_routes + routes) * n_stops + board_stop
+    pair_keys, counts = np.unique(keys[observed] * n_stops + alight_stop[observed], return_counts=True)
+    pair_trip_keys, pair_stops = pair_keys // n_stops, pair_keys % n_stops
+    order = np.lexsort((pair_stops, -counts, pair_trip_keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_trip_keys[order][1:] != pair_trip_keys[order][:-1]
+    mode_keys, mode_stops = pair_trip_keys[order][first], pair_stops[order][first]
+
+    pos = np.minimum(np.searchsorted(mode_keys, keys), len(mode_keys) - 1)
+    return np.where(mode_keys[pos] == keys, mode_stops[pos], -1)
+
+# =============================================================================
+#  主函式
+# =============================================================================
+
+def infer_alighting_stops(df):
+    """
+    為沒有有效下車站名的電子票證旅次推估下車站名，並新增「下車站來源」欄位。
+    有刷下車站但缺少下車時間的旅次仍為不完整旅次，但保留刷卡的站名 (來源為「刷卡」)。
+
+    Args:
+        df (pd.DataFrame): clean_and_enrich_data 處理中的資料，需含 卡號, 路線, 往返程, 上車時間,
+                           上車站名, 下車站名, 持卡身分, 旅次是否完整。
+
+    Returns:
+        pd.DataFrame: 補上推估下車站名與「下車站來源」欄位的資料 (列的順序維持不變)。
+    """
+    is_eticket = (df['持卡身分'] != '非電子票證').to_numpy()
+    tapped = is_eticket & has_stop(df['下車站名']).to_numpy()
+    observed = is_eticket & df['旅次是否完整'].to_numpy(dtype=bool)
+    source = np.where(is_eticket, SOURCE_UNKNOWN, SOURCE_NON_ETICKET).astype(object)
+    source[tapped] = SOURCE_TAPPED
+
+    missing = is_eticket & ~tapped
+    if missing.any():
+        # 站名、路線、卡號轉為整數代碼 (站名依名稱排序，使同票數時取站名最小者)
+        n_rows = len(df)
+        stop_codes, stop_names = pd.factorize(pd.concat([df['上車站名'], df['下車站名']], ignore_index=True)
+                                              .astype(str), sort=True)
+        board_stop, alight_stop = stop_codes[:n_rows].astype(np.int64), stop_codes[n_rows:].astype(np.int64)
+        invalid_stop = pd.Index(stop_names).str.lower().isin(INVALID_STOP_NAMES)
+        route_codes, route_names = pd.factorize(df['路線'].astype(str))
+        route_dir = df.groupby([df['路線'].astype(str), df['往返程'].astype(str)], sort=False, dropna=False).ngroup().to_numpy()
+        cards = pd.factorize(df['卡號'])[0].astype(np.int64)
+        days = df['上車時間'].to_numpy(dtype='datetime64[D]')
+
+        order = np.lexsort((df['上車時間'].to_numpy(), cards))
+        cards_o, board_o, route_dir_o = cards[order], board_stop[order], route_dir[order]
+        missing_o, observed_o = missing[order], observed[order]
+        eticket_o = is_eticket[order]
+        route_stops = _route_stop_table(route_dir_o[eticket_o], board_o[eticket_o], alight_stop[order][eticket_o],
+                                        observed_o[eticket_o], route_dir.max() + 1, len(stop_names))
+
+        # 1. 下一次上車 (或當日首次上車) 站
+        candidates, is_last = _next_boarding_candidates(cards_o, days[order], board_o)
+        valid = (missing_o & ~invalid_stop[candidates] & (candidates != board_o)
+                 & route_stops[route_dir_o, candidates])
+        inferred = np.where(valid, candidates, -1)
+        inferred_source = np.where(valid, np.where(is_last, SOURCE_FIRST_BOARDING, SOURCE_NEXT_BOARDING), None)
+
+        # 2. 歷史樣態 (只用於下一次上車規則無法推估的旅次)
+        remaining = missing_o & ~valid
+        if remaining.any() and observed_o.any():
+            history = _history_candidates(cards_o, route_codes[order].astype(np.int64), board_o,
+                                          alight_stop[order], observed_o, len(route_names), len(stop_names))
+            use_history = remaining & (history >= 0)
+            inferred = np.where(use_history, history, inferred)
+            inferred_source = np.where(use_history, SOURCE_HISTORY, inferred_source)
+
+        # 寫回原本的列順序
+        filled = inferred >= 0
+        original_rows = order[filled]
+        df.iloc[original_rows, df.columns.get_loc('下車站名')] = np.asarray(stop_names, dtype=object)[inferred[filled]]
+        source[original_rows] = inferred_source[filled]
+
+    df['下車站來源'] = source
+    counts = pd.Series(source).value_counts()
+    n_inferred = int(counts.reindex(INFERRED_SOURCES).fillna(0).sum())
+    print(f"    - 缺少下車站的旅次 {int(missing.sum())} 筆中，推估出下車站 {n_inferred} 筆：")
+    for name in INFERRED_SOURCES:
+        print(f"        {name}: {int(counts.get(name, 0))} 筆")
+    return df
+
+
+def has_alighting_stop(df):
+    """
+    OD 分析可使用的旅次：完整旅次，加上下車站為推估值的旅次。
+    舊版統一資料沒有「下車站來源」欄位時，只使用完整旅次。
+    """
+    complete = df['旅次是否完整'] == True
+    if '下車站來源' not in df.columns:
+        return complete
+    return complete | df['下車站來源'].isin(INFERRED_SOURCES)
@@ -1,5 +1,19 @@
 # 導入 pandas 函式庫，並使用 pd 作為簡稱，這是慣例
 import pandas as pd
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from feature_store import load_store, list_months, card_trip_counts
+from distinct_counters import distinct_riders_by, relative_error
 
 # --- 新增的程式碼 ---
 # 設定 Pandas 的顯示選項，讓它可以顯示所有的欄位
@@ -73,6 +87,47 @@ def analyze_csv_format(file_path):
     print("\n\n")
 
 
+def analyze_card_usage(store_dir=config.BUS_FEATURE_STORE_DIR, min_trips=50):
+    """
+    分析卡號的使用情況 (總人數與高頻乘客人數)。
+
+    不再逐筆讀取統一資料檔，而是直接由 feature_store.py 維護的卡號統計量合併而來，
+    因此只需讀取各月份分割區即可得到全期的搭乘次數。
+
+    Args:
+        store_dir (str): 卡號特徵儲存區的路徑。
+        min_trips (int): 判定為高頻乘客的搭乘次數門檻 (大於此值)。
+    """
+    print(f"正在讀取特徵儲存區: {store_dir}...")
+    stats, _ = load_store(store_dir)
+    if stats is None:
+        print("錯誤：特徵儲存區為空，請先執行 feature_store.py。")
+        return
+
+    # --- 核心分析 ---
+    print(f"已合併 {len(list_months(store_dir))} 個月份，正在分析卡號資料...")
+    # 1. 每個卡號的搭乘次數 (各月份的旅次數相加)
+    trip_counts_by_card = card_trip_counts(stats)
+
+    # 2. 總人數即為唯一卡號的數量
+    total_people = len(trip_counts_by_card)
+
+    # 3. 篩選出搭乘次數超過門檻的卡號
+    num_frequent_travelers = int((trip_counts_by_card > min_trips).sum())
+
+    print("\n--- 分析結果 ---")
+    print(f"總唯一卡號數 (總人數): {total_people} 人")
+    print(f"搭乘次數超過 {min_trips} 次的人數: {num_frequent_travelers} 人")
+
+    # 4. 各路線與各持卡身分的不重複乘客數 (由 HLL 聯集估計，不需保留卡號集合)
+    for dimension in ['路線', '持卡身分']:
+        riders = distinct_riders_by(store_dir, dimension)
+        if riders is not None:
+            print(f"\n各{dimension}的不重複乘客數 (HLL 估計，誤差約 ±{relative_error() * 100:.1f}%):")
+            print(riders.head(20).to_string())
+    print("--------------------")
+
+
 # --- 主程式執行區 ---
 if __name__ == "__main__":
     # 定義你的檔案名稱列表
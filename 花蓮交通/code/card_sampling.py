@@ -0,0 +1,103 @@
+# 檔名: code/card_sampling.py
+# 功能: 測試模式的卡號雜湊抽樣。
+# 說明: 舊版測試模式以 nrows 只讀取每個檔案的前幾列，樣本集中在檔案開頭 (通常是月初)，
+#       而且同一張卡的旅次被截斷，分群、定期票等「以卡號為單位」的分析都會失真。
+#       這裡改為以卡號的雜湊值決定是否保留：雜湊值落在前 TEST_MODE_CARD_FRACTION 的卡號，
+#       其所有檔案、所有月份、所有運具的旅次都會保留，沒有被選到的卡號則完全不保留。
+#       沒有卡號的資料 (非電子票證) 以整列內容的雜湊值抽取相同比例。
+#       雜湊使用固定的種子 (TEST_MODE_SEED)，每次執行都會選到同一批卡號；讀檔時以 chunksize 串流，
+#       每塊只保留被抽中的列，記憶體用量與抽樣後的資料量成正比。
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from placeholders import has_card
+
+
+def _hash_key(seed):
+    """ pandas 雜湊函式需要 16 個字元的金鑰，由種子產生。 """
+    return f'{seed:016d}'[-16:]
+
+
+def sample_mask(df, card_col='卡號', fraction=None, seed=None):
+    """
+    判斷每一列是否屬於測試模式的樣本。
+
+    Args:
+        df (pd.DataFrame): 原始資料 (一個檔案或一個 chunk)。
+        card_col (str): 卡號欄位名稱；資料中沒有此欄位時，全部以整列內容抽樣。
+        fraction (float): 保留的卡號比例，預設為 config.TEST_MODE_CARD_FRACTION。
+        seed (int): 雜湊種子，預設為 config.TEST_MODE_SEED。
+
+    Returns:
+        np.ndarray: bool 陣列，True 表示保留。
+    """
+    fraction = config.TEST_MODE_CARD_FRACTION if fraction is None else fraction
+    seed = config.TEST_MODE_SEED if seed is None else seed
+    if fraction >= 1:
+        return np.ones(len(df), dtype=bool)
+    if fraction <= 0:
+        return np.zeros(len(df), dtype=bool)
+    hash_key = _hash_key(seed)
+    # 雜湊值均勻分布在 [0, 2^64)，小於門檻的比例即為 fraction (以整數運算避免浮點數溢位)
+    threshold = np.uint64(min(int(fraction * 2**64), 2**64 - 1))
+
+    # 不代表實際卡片的卡號 (佔位值) 改以整列內容抽樣
+    card_rows = np.zeros(len(df), dtype=bool)
+    if card_col in df.columns:
+        cards = df[card_col].astype(str).str.strip()
+        card_rows = has_card(df[card_col]).to_numpy()
+
+    keep = np.zeros(len(df), dtype=bool)
+    if card_rows.any():
+        card_hashes = pd.util.hash_array(cards.to_numpy(dtype=object)[card_rows], hash_key=hash_key)
+        keep[card_rows] = card_hashes < threshold
+    if (~card_rows).any():
+        row_hashes = pd.util.hash_pandas_object(df[~card_rows], index=False, hash_key=hash_key).to_numpy()
+        keep[~card_rows] = row_hashes < threshold
+    return keep
+
+
+def sample_frame(df, card_col='卡號', fraction=None, seed=None):
+    """ 只保留測試模式樣本中的列。 """
+    return df[sample_mask(df, card_col, fraction, seed)]
+
+
+def read_csv_sampled(file_path, card_col='卡號', chunk_size=500000, **read_csv_kwargs):
+    """
+    以 chunksize 串流讀取 CSV，每塊只保留測試模式樣本中的列 (不會將整個檔案載入記憶體)。
+    卡號欄位一律以字串讀取，確保不同 chunk、不同檔案的同一張卡得到相同的雜湊值。
+
+    Args:
+        file_path (str): CSV 檔案路徑。
+        card_col (str): 卡號欄位名稱。
+        chunk_size (int): 每次讀取的資料筆數。
+        **read_csv_kwargs: 其他傳給 pd.read_csv 的參數 (例如 skiprows、header、dtype)。
+
+    Returns:
+        pd.DataFrame: 抽樣後的資料。
+    """
+    read_csv_kwargs['dtype'] = {**(read_csv_kwargs.get('dtype') or {}), card_col: str}
+    parts = []
+    with pd.read_csv(file_path, chunksize=chunk_size, **read_csv_kwargs) as reader:
+        for chunk in reader:
+            parts.append(sample_frame(chunk, card_col))
+    if not parts:
+        return pd.read_csv(file_path, nrows=0, **read_csv_kwargs)
+    return pd.concat(parts, ignore_index=True)
+
+
+def describe_sampling():
+    """ 測試模式的說明文字 (供各 data_loader 列印)。 """
+    return (f"依卡號雜湊保留 {config.TEST_MODE_CARD_FRACTION:.2%} 的卡號之所有旅次 "
+            f"(種子 {config.TEST_MODE_SEED}；非電子票證資料以整列雜湊抽取相同比例)。")
@@ -1,10 +1,10 @@
-# 檔名: cluster_analysis.py (V12 - 根據 data_loader_市區公車.py V2 進行重構)
+# 檔名: cluster_analysis.py (V13 - 改由 feature_store.py 的卡號統計量建立特徵)
 # =============================================================================
 # 雲林公車乘客 K-Means 分群完整流程 (自動化版本)
 #
 # 本腳本涵蓋以下步驟：
-# 1. 環境設定與資料載入 (從 config.py 讀取設定)
-# 2. 特徵工程 (使用已預處理好的欄位)
+# 1. 環境設定與資料載入 (從 config.py 讀取設定，由特徵儲存區載入)
+# 2. 特徵工程 (由可合併的卡號統計量推導)
 # 3. 根據總乘車次數篩選乘客 (從 config.py 讀取門檻)
 # 4. 特徵準備
 # 5. (固定執行) 使用 PCA 進行降維
@@ -23,7 +23,6 @@ from sklearn.compose import ColumnTransformer
 from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 from sklearn.decomposition import PCA
-from scipy.stats import entropy
 import os
 import sys
 
@@ -36,6 +35,9 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+from feature_store import sync_store, load_store, list_months, compute_card_features
+from placeholders import has_card
+
 # 設定圖表使用的中文字體
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
 plt.rcParams['axes.unicode_minus'] = False
@@ -47,81 +49,42 @@ os.makedirs(output_dir, exist_ok=True)
 print(f"分析結果與圖表將儲存於 '{output_dir}/' 資料夾。")
 
 
-# --- 步驟 1: 資料載入與預處理 ---
+# --- 步驟 1: 由特徵儲存區載入卡號統計量 ---
 
-def load_and_preprocess_data(filepath):
+def load_and_preprocess_data(filepath, store_dir=config.CLUSTER_FEATURE_STORE_DIR):
     """
-    V2版修改：大幅簡化預處理流程。
-    - 移除 unify_ticket_type 函式，因為 data_loader 已處理。
-    - 移除時間轉換與旅次時長計算，因為 data_loader 已提供 '旅次時長(分)'。
-    - 直接使用 data_loader 產生的欄位。
+    V13版修改：不再逐筆讀取所有旅次，改由 feature_store.py 維護的月份分割區載入。
+    - 儲存區由 data_loader 在輸出統一資料檔時更新，這裡只確認儲存區不早於統一資料檔，不會重新掃描。
+    - 回傳合併所有月份後的 (stats, values) 充分統計量。
     """
-    print(f"步驟 1: 正在載入已預處理的資料 from '{filepath}'...")
-    try:
-        # data_loader 已處理大部分 Dtype，此處僅需讀取
-        df = pd.read_csv(filepath, dtype={'路線': str, '卡號': str})
-    except FileNotFoundError:
-        print(f"錯誤：找不到檔案 '{filepath}'。請檢查 config.py 中的 CLUSTER_INPUT_FILE 設定，並確認 data_loader_市區公車.py 已執行。")
+    print(f"步驟 1: 正在由特徵儲存區 '{store_dir}' 載入卡號統計量...")
+    sync_store(filepath, store_dir)
+    stats, values = load_store(store_dir)
+    if stats is None:
+        print("錯誤：特徵儲存區為空。請檢查 config.py 中的 CLUSTER_INPUT_FILE 設定，並確認 data_loader_市區公車.py 已執行。")
         return None
-    
-    # data_loader 已處理時間格式，此處僅需再次確認
-    df['上車時間'] = pd.to_datetime(df['上車時間'], errors='coerce')
-    
-    # data_loader 已提供 '旅次是否完整' 欄位
-    df = df[df['旅次是否完整'] == True].copy()
-    
-    # 移除 '無卡號' 的記錄，因為無法對其進行使用者分群
-    df = df[df['卡號'] != '無卡號'].copy()
 
-    print("持卡身分預覽：")
-    print(df['持卡身分'].value_counts())
-    print(f"資料載入完成，共計 {len(df)} 筆有效的持卡人旅次紀錄。")
-    return df
+    # 移除卡號佔位值 ('非電子票證'、'無卡號' 等) 的記錄，因為無法對其進行使用者分群
+    stats = stats[has_card(stats['卡號'])]
+    values = values[has_card(values['卡號'])]
+
+    print("持卡身分預覽 (完整旅次)：")
+    identity = values[(values['欄位'] == '持卡身分') & (values['旅次是否完整'].astype(str) == 'True')]
+    print(identity.groupby('值')['次數'].sum().sort_values(ascending=False))
+    print(f"資料載入完成，共計 {stats['卡號'].nunique()} 張卡號、涵蓋 {len(list_months(store_dir))} 個月份。")
+    return stats, values
 
-# --- 步驟 2: 特徵工程 (與原版相同，但依賴的欄位已由 data_loader 產生) ---
-def create_user_features(df):
+# --- 步驟 2: 特徵工程 (由可合併的統計量推導) ---
+def create_user_features(store_data):
     """
     以每個 '卡號' 為單位，建立使用者行為特徵。
-    V2版修改：
-    - 直接使用 '上車星期', '上車小時' 等已存在的欄位。
-    - 使用 '旅次時長(分)' 取代手動計算的 '旅次時長'。
-    - 使用 '持卡身分' 取代 '票種分類'。
+    V13版修改：
+    - 特徵由儲存區中的計數、總和與各值計數表推導，計算量只與卡號數量有關。
+    - 只使用完整旅次，特徵定義與 V12 相同。
     """
     print("\n步驟 2: 正在進行特徵工程...")
-    
-    # --- 時間相關特徵 ---
-    df['是否平日'] = df['日期類型'] == '平日'
-    df['是否尖峰'] = df['上車小時'].isin([7, 8, 17, 18]) # 上下班尖峰
-    df['是否深夜清晨'] = df['上車小時'].isin([22, 23, 0, 1, 2, 3, 4, 5])
-    
-    # --- 空間相關特徵 ---
-    df['OD對'] = df['上車站名'] + ' -> ' + df['下車站名']
-    
-    # --- 以卡號進行分組，計算各項特徵 ---
-    safe_mode = lambda x: x.mode().iloc[0] if not x.mode().empty else None
-
-    def calculate_entropy(series):
-        counts = series.value_counts()
-        probabilities = counts / counts.sum()
-        return entropy(probabilities, base=2)
-
-    user_features = df.groupby('卡號').agg(
-        總乘車次數=('卡號', 'count'),
-        平均旅次時長=('旅次時長(分)', 'mean'), # 使用新欄位
-        平日乘車比例=('是否平日', lambda x: x.sum() / x.count()),
-        尖峰時段乘車比例=('是否尖峰', lambda x: x.sum() / x.count()),
-        深夜清晨乘車次數=('是否深夜清晨', 'sum'),
-        旅次起終點熵=('OD對', calculate_entropy),
-        搭乘路線數=('路線', 'nunique'),
-        最常上車站點=('上車站名', safe_mode),
-        最常下車站點=('下車站名', safe_mode),
-        主要活動路線=('路線', safe_mode),
-        主要持卡身分=('持卡身分', safe_mode), # 使用 '持卡身分'
-        主要票種類型=('票種類型', safe_mode)  # 新增欄位，用於後續 Tpass 分析
-    ).reset_index()
-    
-    user_features.replace([np.inf, -np.inf], 0, inplace=True)
-    user_features.fillna(0, inplace=True)
+    stats, values = store_data
+    user_features = compute_card_features(stats, values, complete_only=True)
 
     print(f"特徵工程完成，共建立 {len(user_features)} 位獨立乘客的特徵資料。")
     print("特徵預覽：")
@@ -275,10 +238,10 @@ def integrate_tpass_data(clustered_users_df):
 # --- 主執行流程 (與原版相同) ---
 if __name__ == '__main__':
     # 從 config 讀取檔案路徑
-    raw_df = load_and_preprocess_data(filepath=config.CLUSTER_INPUT_FILE)
+    store_data = load_and_preprocess_data(filepath=config.CLUSTER_INPUT_FILE)
     
-    if raw_df is not None:
-        user_features_df = create_user_features(raw_df)
+    if store_data is not None:
+        user_features_df = create_user_features(store_data)
         
         initial_passenger_count = len(user_features_df)
         print(f"\n進行篩選前，共有 {initial_passenger_count} 位獨立乘客。")
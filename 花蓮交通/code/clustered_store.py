@@ -0,0 +1,330 @@
+# 檔名: code/clustered_store.py
+# 功能: 依月份分割、分割內排序的叢集化儲存，並以列群組 (row group) 的最小/最大值跳過不需要的資料。
+# 說明: 「1121 路七月上午」或「斗六站平日」這類查詢原本都要掃描整份統一資料檔。
+#       這裡將統一資料依月份分成多個分割區，每個分割區內依叢集鍵排序
+#       (公車: 路線, 上車時間；台鐵: 起點, 進站時間)，再切成固定筆數的列群組，
+#       並記錄每個列群組在各統計欄位上的最小值與最大值 (row_groups.csv)。
+#       查詢時先以月份與最小/最大值判斷哪些列群組「可能」有符合的資料，只讀取這些列群組，
+#       最後再對讀出的資料做精確篩選。因為資料依叢集鍵排序，同一條路線 (或同一個起站) 的資料
+#       集中在少數幾個連續的列群組中，大部分列群組都可以直接略過。
+#       依起點排序的列群組幾乎涵蓋所有迄點，以迄點篩選無法略過任何列群組；
+#       台鐵因此另外輸出一份依 (迄點, 出站時間) 排序的儲存區 (TRA_ARRIVAL_LAYOUT) 供到站查詢使用。
+#       統計值依欄位型態儲存與比較：數值欄位以數值比較，文字與時間欄位 (ISO 格式) 以字串比較。
+#
+#       有安裝 pyarrow 時每個分割區存成一個 Parquet 檔 (列群組即 Parquet 的 row group，
+#       檔案本身也帶有欄位統計，DuckDB / Dask 讀取時同樣可以略過)；
+#       沒有 pyarrow 時改為每個列群組一個 CSV 檔，由 row_groups.csv 做相同的判斷。
+#
+# 儲存格式 (store_dir 底下):
+#   layout.csv                  : 欄位, 型態 (text / datetime / numeric), 叢集鍵順序 (非叢集鍵為空白)
+#   row_groups.csv              : 月份, 檔案, 列群組, 列數, <統計欄位>_min, <統計欄位>_max ...
+#   月份=<YYYY-MM>/part.parquet  : 該月份的資料 (Parquet，多個列群組)
+#   月份=<YYYY-MM>/rg-<NNNNN>.csv: 該月份的第 N 個列群組 (沒有 pyarrow 時)
+import pandas as pd
+import numpy as np
+import os
+import glob
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+# 各運具的叢集鍵與要記錄最小/最大值的欄位
+BUS_LAYOUT = {
+    'sort': ['路線', '上車時間'],
+    'stats': ['路線', '上車時間', '上車站名', '下車站名', '日期類型'],
+}
+TRA_LAYOUT = {
+    'sort': ['起點', '進站時間'],
+    'stats': ['起點', '進站時間', '迄點', '日期類型'],
+}
+TRA_ARRIVAL_LAYOUT = {
+    'sort': ['迄點', '出站時間'],
+    'stats': ['迄點', '出站時間', '起點', '日期類型'],
+}
+
+PARTITION_COLUMN = '月份'
+LAYOUT_FILENAME = 'layout.csv'
+ROW_GROUPS_FILENAME = 'row_groups.csv'
+# 列群組統計中時間欄位的字串格式 (ISO 格式的字串順序與時間順序相同，可直接比較)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# =============================================================================
+#  寫入
+# =============================================================================
+
+def _column_kind(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return 'numeric'
+    return 'text'
+
+
+def _stats_text(series, kind):
+    """ 將統計欄位轉為可比較的字串 (時間為 ISO 格式字串，缺值維持 NaN)。 """
+    if kind == 'datetime':
+        return series.dt.strftime(TIME_FORMAT)
+    return series.astype(str).where(series.notna())
+
+
+def _row_group_stats(df, layout, kinds, row_group_size):
+    """ 計算每個列群組在各統計欄位上的最小值與最大值 (數值欄位保留數值，其餘轉為可比較的字串)。 """
+    group_ids = np.arange(len(df)) // row_group_size
+    stats = pd.DataFrame({'列數': np.bincount(group_ids)}).rename_axis('列群組').reset_index()
+    for col in layout['stats']:
+        values = df[col] if kinds[col] == 'numeric' else _stats_text(df[col], kinds[col])
+        grouped = values.groupby(group_ids)
+        stats[f'{col}_min'] = grouped.min().reindex(stats['列群組']).to_numpy()
+        stats[f'{col}_max'] = grouped.max().reindex(stats['列群組']).to_numpy()
+    return stats
+
+
+def _write_partition(df, store_dir, month, layout, kinds, row_group_size, use_parquet):
+    """ 將單一月份的資料排序後寫入，回傳該月份的列群組統計。 """
+    df = df.sort_values(layout['sort'], kind='stable', ignore_index=True)
+    part_dir = os.path.join(store_dir, f'{PARTITION_COLUMN}={month}')
+    os.makedirs(part_dir, exist_ok=True)
+    stats = _row_group_stats(df, layout, kinds, row_group_size)
+    if use_parquet:
+        df.to_parquet(os.path.join(part_dir, 'part.parquet'), engine='pyarrow', index=False,
+                      row_group_size=row_group_size)
+        stats.insert(0, '檔案', os.path.join(f'{PARTITION_COLUMN}={month}', 'part.parquet'))
+    else:
+        files = []
+        for group in stats['列群組']:
+            filename = os.path.join(f'{PARTITION_COLUMN}={month}', f'rg-{group:05d}.csv')
+            df.iloc[group * row_group_size:(group + 1) * row_group_size].to_csv(
+                os.path.join(store_dir, filename), index=False, encoding='utf-8-sig')
+            files.append(filename)
+        stats.insert(0, '檔案', files)
+    stats.insert(0, PARTITION_COLUMN, month)
+    return stats
+
+
+def write_clustered_store(df, store_dir, layout, row_group_size=None):
+    """
+    將統一資料寫成依月份分割、依叢集鍵排序的儲存區 (會取代儲存區中的舊分割區)。
+
+    Args:
+        df (pd.DataFrame or dask.dataframe.DataFrame): 含「月份」欄位 (YYYY-MM) 的統一資料。
+            Dask DataFrame 會先依月份重新分配 (shuffle)，再逐一分割區排序寫入，一次只需一個月份的記憶體。
+        store_dir (str): 儲存資料夾。
+        layout (dict): BUS_LAYOUT 或 TRA_LAYOUT。
+        row_group_size (int): 每個列群組的筆數，預設為 config.CLUSTERED_ROW_GROUP_SIZE。
+    """
+    row_group_size = row_group_size or config.CLUSTERED_ROW_GROUP_SIZE
+    use_parquet = _has_pyarrow()
+    if not use_parquet:
+        print("提示：未安裝 pyarrow，叢集化儲存改以 CSV 列群組檔案寫入 (pip install pyarrow 可改用 Parquet)。")
+
+    os.makedirs(store_dir, exist_ok=True)
+    for old_file in glob.glob(os.path.join(store_dir, f'{PARTITION_COLUMN}=*', '*')):
+        os.remove(old_file)
+
+    if isinstance(df, pd.DataFrame):
+        partitions = [df]
+    else:
+        shuffled = df.shuffle(on=PARTITION_COLUMN)
+        partitions = (shuffled.get_partition(i).compute() for i in range(shuffled.npartitions))
+
+    kinds, all_stats = None, []
+    for part in partitions:
+        # 統計欄位一律以字串比較；文字欄位先轉為 str，避免同一欄混有數字與字串時無法排序
+        text_cols = [col for col in layout['stats'] if _column_kind(part[col]) == 'text']
+        part = part.assign(**{col: part[col].astype(str).where(part[col].notna()) for col in text_cols})
+        if kinds is None:
+            kinds = {col: _column_kind(part[col]) for col in part.columns}
+        for month, month_df in part.groupby(PARTITION_COLUMN, sort=True):
+            all_stats.append(_write_partition(month_df, store_dir, month, layout, kinds, row_group_size, use_parquet))
+
+    if not all_stats:
+        print("警告：沒有任何資料可以寫入叢集化儲存區。")
+        return
+    row_groups = pd.concat(all_stats, ignore_index=True).sort_values([PARTITION_COLUMN, '列群組'], ignore_index=True)
+    row_groups.to_csv(os.path.join(store_dir, ROW_GROUPS_FILENAME), index=False, encoding='utf-8-sig')
+    order = {col: i + 1 for i, col in enumerate(layout['sort'])}
+    pd.DataFrame({'欄位': list(kinds), '型態': list(kinds.values()),
+                  '叢集鍵順序': [order.get(col) for col in kinds]}).to_csv(
+        os.path.join(store_dir, LAYOUT_FILENAME), index=False, encoding='utf-8-sig')
+    print(f"叢集化儲存區已建立: {store_dir} ({row_groups[PARTITION_COLUMN].nunique()} 個月份、"
+          f"{len(row_groups)} 個列群組，格式: {'Parquet' if use_parquet else 'CSV'})")
+
+# =============================================================================
+#  讀取
+# =============================================================================
+
+def _as_values(condition):
+    """ 將篩選條件統一為 ('in', 值清單) 或 ('range', 下限, 上限)。 """
+    if isinstance(condition, tuple):
+        return ('range',) + condition
+    if isinstance(condition, (list, set, np.ndarray, pd.Series, pd.Index)):
+        return ('in', list(condition))
+    return ('in', [condition])
+
+
+def _bound_value(value, kind):
+    """ 將查詢條件轉為與統計值相同型態的值 (數值欄位無法轉換時為 NaN，不符合任何列群組)。 """
+    if value is None:
+        return None
+    if kind == 'datetime':
+        return pd.Timestamp(value).strftime(TIME_FORMAT)
+    if kind == 'numeric':
+        return pd.to_numeric(value, errors='coerce')
+    return str(value)
+
+
+def select_row_groups(row_groups, kinds, filters=None, months=None):
+    """
+    依月份與各列群組的最小/最大值，找出可能含有符合資料的列群組。
+
+    Args:
+        row_groups (pd.DataFrame): row_groups.csv 的內容。
+        kinds (dict): {欄位: 型態}。
+        filters (dict): {欄位: 條件}；條件為單一值或值的清單 (等於其中之一)，
+            或 (下限, 上限) 的 tuple (含端點，None 表示不限)。沒有統計值的欄位不參與判斷。
+        months (list): 要讀取的月份 (YYYY-MM)，預設為全部。
+
+    Returns:
+        pd.Series: bool，True 表示需要讀取該列群組。
+    """
+    keep = pd.Series(True, index=row_groups.index)
+    if months is not None:
+        keep &= row_groups[PARTITION_COLUMN].isin([str(m) for m in months])
+    for col, condition in (filters or {}).items():
+        if f'{col}_min' not in row_groups.columns:
+            continue
+        low, high = row_groups[f'{col}_min'], row_groups[f'{col}_max']
+        spec = _as_values(condition)
+        if spec[0] == 'range':
+            lo, hi = _bound_value(spec[1], kinds[col]), _bound_value(spec[2], kinds[col])
+            if lo is not None:
+                keep &= high >= lo
+            if hi is not None:
+                keep &= low <= hi
+        else:
+            hit = pd.Series(False, index=row_groups.index)
+            for value in spec[1]:
+                value = _bound_value(value, kinds[col])
+                hit |= (low <= value) & (high >= value)
+            keep &= hit
+    return keep
+
+
+def _apply_filters(df, filters, kinds):
+    """ 對讀出的資料做精確篩選 (列群組判斷只保證「可能有」符合的資料)。 """
+    mask = pd.Series(True, index=df.index)
+    for col, condition in (filters or {}).items():
+        spec = _as_values(condition)
+        values = df[col]
+        if spec[0] == 'range':
+            convert = {'datetime': pd.Timestamp, 'text': str, 'numeric': pd.to_numeric}.get(kinds.get(col), lambda v: v)
+            if spec[1] is not None:
+                mask &= values >= convert(spec[1])
+            if spec[2] is not None:
+                mask &= values <= convert(spec[2])
+        elif kinds.get(col) == 'datetime':
+            mask &= values.isin(pd.to_datetime(spec[1]))
+        elif kinds.get(col) == 'text':
+            mask &= values.astype(str).isin([str(v) for v in spec[1]]) & values.notna()
+        else:
+            mask &= values.isin(pd.to_numeric(pd.Series(spec[1]), errors='coerce'))
+    return df[mask]
+
+
+def load_layout(store_dir):
+    """
+    讀取儲存區的欄位型態與列群組統計。
+
+    Returns:
+        tuple or None: (kinds, row_groups)；找不到儲存區時回傳 None。
+    """
+    layout_path = os.path.join(store_dir, LAYOUT_FILENAME)
+    row_groups_path = os.path.join(store_dir, ROW_GROUPS_FILENAME)
+    if not (os.path.exists(layout_path) and os.path.exists(row_groups_path)):
+        return None
+    layout = pd.read_csv(layout_path)
+    kinds = dict(zip(layout['欄位'], layout['型態']))
+    row_groups = pd.read_csv(row_groups_path, dtype=str)
+    row_groups['列群組'] = row_groups['列群組'].astype(int)
+    row_groups['列數'] = row_groups['列數'].astype(int)
+    # 數值欄位的統計值還原為數值，避免以字串比較 (例如 '9' > '10') 而誤判
+    for col, kind in kinds.items():
+        if kind == 'numeric' and f'{col}_min' in row_groups.columns:
+            row_groups[f'{col}_min'] = pd.to_numeric(row_groups[f'{col}_min'])
+            row_groups[f'{col}_max'] = pd.to_numeric(row_groups[f'{col}_max'])
+    return kinds, row_groups
+
+
+def _read_groups(store_dir, selected, kinds, columns):
+    """ 讀取被選中的列群組 (Parquet 以檔案為單位一次讀取多個 row group)。 """
+    parts = []
+    for filename, groups in selected.groupby('檔案', sort=False)['列群組']:
+        path = os.path.join(store_dir, filename)
+        if filename.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            parts.append(pq.ParquetFile(path).read_row_groups(list(groups), columns=columns).to_pandas())
+        else:
+            text_cols = [col for col in columns if kinds.get(col) == 'text']
+            time_cols = [col for col in columns if kinds.get(col) == 'datetime']
+            parts.append(pd.read_csv(path, usecols=columns, dtype={col: str for col in text_cols},
+                                     parse_dates=time_cols))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
+
+
+def read_clustered(store_dir, filters=None, columns=None, months=None, verbose=True):
+    """
+    只讀取可能符合條件的列群組，再精確篩選。
+
+    Args:
+        store_dir (str): write_clustered_store 建立的儲存資料夾。
+        filters (dict): 見 select_row_groups；例如
+            {'路線': '1121', '上車時間': ('2024-07-01', '2024-07-31 23:59:59')} 或 {'起點': '斗六', '日期類型': '平日'}。
+        columns (list): 要回傳的欄位，預設為全部。
+        months (list): 要讀取的月份 (YYYY-MM)。
+
+    Returns:
+        pd.DataFrame or None: 符合條件的資料；找不到儲存區時回傳 None。
+    """
+    loaded = load_layout(store_dir)
+    if loaded is None:
+        return None
+    kinds, row_groups = loaded
+    columns = columns or list(kinds)
+    read_columns = list(dict.fromkeys(columns + list(filters or {})))
+
+    keep = select_row_groups(row_groups, kinds, filters, months)
+    selected = row_groups[keep]
+    if verbose:
+        print(f"叢集化儲存區 '{os.path.basename(store_dir)}'：讀取 {len(selected)} / {len(row_groups)} 個列群組 "
+              f"({selected['列數'].sum()} / {row_groups['列數'].sum()} 筆)。")
+    df = _read_groups(store_dir, selected, kinds, read_columns)
+    return _apply_filters(df, filters, kinds)[columns].reset_index(drop=True)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    for store_dir in [config.BUS_CLUSTERED_STORE_DIR, config.HIGHWAY_BUS_CLUSTERED_STORE_DIR,
+                      config.TRA_CLUSTERED_STORE_DIR, config.TRA_ARRIVAL_CLUSTERED_STORE_DIR]:
+        loaded = load_layout(store_dir)
+        if loaded is None:
+            print(f"找不到叢集化儲存區 '{store_dir}'，請先執行對應的 data_loader。")
+            continue
+        kinds, row_groups = loaded
+        print(f"\n--- {store_dir} ---")
+        print(row_groups.groupby(PARTITION_COLUMN).agg(列群組數=('列群組', 'size'), 筆數=('列數', 'sum')).to_string())
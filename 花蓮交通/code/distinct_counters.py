@@ -0,0 +1,228 @@
+# 檔名: code/distinct_counters.py
+# 功能: 以 HyperLogLog (HLL) 估計相異卡號數 (不重複乘客數)。
+# 說明: 「有多少不同的人搭過這條路線 / 這個站 / 這種身分」原本需要把所有卡號放進集合後取 nunique，
+#       卡號數達數百萬時需要數 GB 記憶體。HLL 只保留 2^precision 個 1 byte 的暫存器 (預設 4 KB)，
+#       且兩個 HLL 逐格取最大值即等於「聯集」的 HLL，因此可以：
+#         1. 在 feature_store 建立每個月份的分割區時 (write_store / update_store)，一併建立 (維度, 值, 月份) 的 HLL；
+#         2. 查詢時對任意多個切片 (例如多條路線、多個月份) 取聯集後估計相異卡號數。
+#       相對誤差約為 1.04 / sqrt(2^precision)，precision = 12 時約 ±1.6%。
+#
+# 儲存格式 (與 feature_store 的分割區放在同一個資料夾):
+#   card_hll_<YYYY-MM>.csv : 維度, 值, 暫存器 (暫存器以十六進位字串儲存)
+import pandas as pd
+import numpy as np
+import os
+import glob
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from placeholders import has_card
+
+# 建立 HLL 的維度：{維度名稱: 來源欄位}；'全部' 為每個月份的總相異卡號數，
+# '車站' 同時計入上車站與下車站 (在該站上車或下車的乘客)
+DIMENSIONS = {
+    '全部': [],
+    '路線': ['路線'],
+    '車站': ['上車站名', '下車站名'],
+    '持卡身分': ['持卡身分'],
+}
+ALL_VALUE = '全部'
+
+# =============================================================================
+#  雜湊與暫存器
+# =============================================================================
+
+def _bit_length(values):
+    """ 向量化計算 uint64 陣列每個元素的位元長度 (以二分法逐步右移，避免浮點數 log2 的誤差)。 """
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = (values >> np.uint64(shift)) > 0
+        length += big * shift
+        values = np.where(big, values >> np.uint64(shift), values)
+    return length + (values > 0)
+
+
+def _register_updates(cards, precision):
+    """
+    將卡號雜湊為 64 位元整數：前 precision 位元決定暫存器編號，
+    其餘位元中第一個 1 的位置 (由高位算起) 為該卡號在暫存器中的值。
+
+    Returns:
+        tuple: (暫存器編號陣列, 值陣列)
+    """
+    hashes = pd.util.hash_array(np.asarray(cards, dtype=object))
+    tail_bits = 64 - precision
+    index = (hashes >> np.uint64(tail_bits)).astype(np.int64)
+    tail = hashes & np.uint64((1 << tail_bits) - 1)
+    rank = (tail_bits - _bit_length(tail) + 1).astype(np.uint8)
+    return index, rank
+
+
+def build_hll(df, precision=None):
+    """
+    將一批旅次資料建立成各維度、各值的 HLL。
+
+    Args:
+        df (pd.DataFrame): 含卡號與 DIMENSIONS 來源欄位的旅次資料 (同一月份)。
+        precision (int): 暫存器數為 2^precision，預設為 config.HLL_PRECISION。
+
+    Returns:
+        dict: {(維度, 值): 暫存器陣列 (np.uint8)}
+    """
+    precision = precision or config.HLL_PRECISION
+    m = 1 << precision
+    cards = df['卡號'].astype(str)
+    valid = has_card(df['卡號']).to_numpy()
+    index, rank = _register_updates(cards.to_numpy()[valid], precision)
+
+    sketches = {}
+    for dimension, columns in DIMENSIONS.items():
+        if columns:
+            keys = pd.concat([df.loc[valid, col].astype(str) for col in columns], ignore_index=True).to_numpy()
+            repeat = len(columns)
+        else:
+            keys = np.full(int(valid.sum()), ALL_VALUE, dtype=object)
+            repeat = 1
+        keep = keys != 'nan'
+        codes, uniques = pd.factorize(keys[keep])
+        if len(uniques) == 0:
+            continue
+        # 每個 (值, 暫存器) 只保留最大值，再一次寫入二維暫存器表
+        flat = codes.astype(np.int64) * m + np.tile(index, repeat)[keep]
+        best = pd.Series(np.tile(rank, repeat)[keep]).groupby(flat).max()
+        registers = np.zeros((len(uniques), m), dtype=np.uint8)
+        registers.flat[best.index.to_numpy()] = best.to_numpy()
+        for value, row in zip(uniques, registers):
+            sketches[(dimension, value)] = row
+    return sketches
+
+
+def merge_hll(*sketch_dicts):
+    """ 合併多組 HLL：相同 (維度, 值) 的暫存器逐格取最大值 (等同取卡號集合的聯集)。 """
+    merged = {}
+    for sketches in sketch_dicts:
+        for key, registers in sketches.items():
+            merged[key] = np.maximum(merged[key], registers) if key in merged else registers.copy()
+    return merged
+
+
+def estimate(registers):
+    """
+    由暫存器估計相異數 (Flajolet et al. 2007；估計值偏小且有空暫存器時改用 linear counting)。
+    64 位元雜湊下不需要大範圍修正。
+    """
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * m and zeros > 0:
+        return m * np.log(m / zeros)
+    return raw
+
+
+def relative_error(precision=None):
+    """ HLL 估計值的標準誤 (相對值)。 """
+    return 1.04 / np.sqrt(1 << (precision or config.HLL_PRECISION))
+
+# =============================================================================
+#  儲存區的讀寫
+# =============================================================================
+
+def hll_path(store_dir, month):
+    return os.path.join(store_dir, f'card_hll_{month}.csv')
+
+
+def save_hll(store_dir, month, sketches):
+    """ 將單一月份的 HLL 寫入儲存區 (會覆蓋同月份的舊檔)。 """
+    os.makedirs(store_dir, exist_ok=True)
+    rows = [(dimension, value, registers.tobytes().hex()) for (dimension, value), registers in sketches.items()]
+    pd.DataFrame(rows, columns=['維度', '值', '暫存器']).to_csv(hll_path(store_dir, month), index=False,
+                                                               encoding='utf-8-sig')
+
+
+def list_hll_months(store_dir):
+    """ 列出儲存區中已有 HLL 的月份 (YYYY-MM)。 """
+    files = glob.glob(os.path.join(store_dir, 'card_hll_*.csv'))
+    return sorted(os.path.basename(f)[len('card_hll_'):-len('.csv')] for f in files)
+
+
+def load_hll(store_dir, months=None):
+    """
+    讀取指定月份的 HLL。
+
+    Returns:
+        dict: {月份: {(維度, 值): 暫存器陣列}}；沒有任何 HLL 檔案時回傳空 dict。
+    """
+    available = list_hll_months(store_dir)
+    if months is not None:
+        available = [m for m in available if m in set(months)]
+    result = {}
+    for month in available:
+        table = pd.read_csv(hll_path(store_dir, month), dtype=str, keep_default_na=False)
+        result[month] = {(dimension, value): np.frombuffer(bytes.fromhex(hex_registers), dtype=np.uint8)
+                         for dimension, value, hex_registers in table[['維度', '值', '暫存器']].itertuples(index=False)}
+    return result
+
+# =============================================================================
+#  查詢
+# =============================================================================
+
+def distinct_riders(store_dir, slices=None, months=None):
+    """
+    估計任意切片聯集的相異卡號數。
+
+    Args:
+        store_dir (str): 特徵儲存區資料夾。
+        slices (list, optional): [(維度, 值), ...]，例如 [('路線', '1'), ('車站', '花蓮火車站')]；
+                                 預設為全部乘客。
+        months (list, optional): 要納入的月份 (YYYY-MM)，預設為全部。
+
+    Returns:
+        int or None: 估計的相異卡號數；儲存區沒有 HLL 時回傳 None。
+    """
+    by_month = load_hll(store_dir, months)
+    if not by_month:
+        print(f"警告：'{store_dir}' 中沒有 HLL 檔案，請重新執行 data_loader 以重建特徵儲存區。")
+        return None
+    slices = slices or [('全部', ALL_VALUE)]
+    selected = [sketches[key] for sketches in by_month.values() for key in slices if key in sketches]
+    if not selected:
+        return 0
+    return int(round(estimate(np.maximum.reduce(selected))))
+
+
+def distinct_riders_by(store_dir, dimension, months=None):
+    """
+    估計某一維度每個值的相異卡號數 (跨月份取聯集，同一張卡在多個月份只算一次)。
+
+    Returns:
+        pd.Series or None: 索引為該維度的值，依相異卡號數由大到小排序。
+    """
+    by_month = load_hll(store_dir, months)
+    if not by_month:
+        print(f"警告：'{store_dir}' 中沒有 HLL 檔案，請重新執行 data_loader 以重建特徵儲存區。")
+        return None
+    merged = merge_hll(*[{key: reg for key, reg in sketches.items() if key[0] == dimension}
+                         for sketches in by_month.values()])
+    counts = pd.Series({value: int(round(estimate(reg))) for (_, value), reg in merged.items()},
+                       name='相異卡號數(估計)', dtype=np.int64)
+    return counts.rename_axis(dimension).sort_values(ascending=False)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    for store in [config.BUS_FEATURE_STORE_DIR, config.HIGHWAY_BUS_FEATURE_STORE_DIR]:
+        total = distinct_riders(store)
+        if total is None:
+            continue
+        print(f"\n--- {store} ---")
+        print(f"全期相異卡號數 (估計，誤差約 ±{relative_error() * 100:.1f}%): {total}")
+        print(distinct_riders_by(store, '路線').head(20).to_string())
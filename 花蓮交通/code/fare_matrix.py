@@ -0,0 +1,87 @@
+# 檔名: code/fare_matrix.py
+# 功能: 票價方案試算的陣列運算核心 (不依賴 config 與事實表)。
+# 說明: 以「卡號月份 × 運具」的消費矩陣、產品涵蓋矩陣與方案價格矩陣，一次算出每個卡號月份
+#       在各方案下最划算的選擇。花蓮的 fare_simulator 與雲林的 199_399_analyze 共用此模組；
+#       這裡只匯入 numpy/pandas，雲林腳本將 code/ 加入 sys.path 時不會載入花蓮的 config 或
+#       與雲林同名的模組 (od_utils 等)。
+import pandas as pd
+import numpy as np
+
+# 「不購買任何產品」在選擇結果中的名稱
+NO_PRODUCT = '不購買'
+
+
+def _product_coverage(products, modes):
+    """ 建立 (產品 × 運具) 的涵蓋矩陣；消費矩陣中沒有的運具不影響計算。 """
+    names = list(products)
+    coverage = np.array([[mode in products[name]['modes'] for mode in modes] for name in names], dtype=bool)
+    return names, coverage.reshape(len(names), len(modes))
+
+
+def _policy_prices(policies, products, product_names):
+    """
+    建立 (方案 × 產品) 的價格矩陣，方案中未提供的產品價格為 ∞。
+    方案以產品清單表示時 (或售價為 None) 使用產品的牌價 products[name]['price']。
+    """
+    prices = np.full((len(policies), len(product_names)), np.inf)
+    for q, offer in enumerate(policies.values()):
+        offer = offer if isinstance(offer, dict) else dict.fromkeys(offer)
+        for name, price in offer.items():
+            if name not in product_names:
+                raise ValueError(f"方案中的產品 '{name}' 未定義於產品清單。")
+            prices[q, product_names.index(name)] = products[name]['price'] if price is None else price
+    return prices
+
+
+def simulate_policies(spend_matrix, products, policies, chunk_size=200000):
+    """
+    一次試算多個票價方案。
+
+    Args:
+        spend_matrix (pd.DataFrame): 索引為 (月份, 卡號)、欄位為運具的消費矩陣。
+        products (dict): {產品名稱: {'price': 牌價, 'modes': [涵蓋運具]}}。
+        policies (dict): {方案名稱: [產品名稱, ...] (以牌價提供) 或 {產品名稱: 售價}}。
+        chunk_size (int): 每次處理的卡號月份數 (控制 方案 × 卡號月份 × 產品 陣列的記憶體用量)。
+
+    Returns:
+        tuple: (summary, monthly, choices)
+            summary : 每個方案一列，含原始收入、模擬收入、收入變化、轉換人次與各產品的選擇人次。
+            monthly : (方案 × 月份) 的模擬收入。
+            choices : 每個卡號月份在各方案下的最划算選擇。
+    """
+    modes = list(spend_matrix.columns)
+    product_names, coverage = _product_coverage(products, modes)
+    prices = _policy_prices(policies, products, product_names)
+
+    spend = spend_matrix.to_numpy(dtype=np.float64)
+    n_rows, n_policies = len(spend), len(policies)
+    best_cost = np.empty((n_policies, n_rows))
+    choice = np.empty((n_policies, n_rows), dtype=np.int16)
+
+    for start in range(0, n_rows, chunk_size):
+        block = spend[start:start + chunk_size]
+        uncovered = block @ (~coverage).T.astype(np.float64)                  # (卡號月份, 產品)
+        product_cost = prices[:, None, :] + uncovered[None, :, :]              # (方案, 卡號月份, 產品)
+        no_product = np.broadcast_to(block.sum(axis=1)[None, :, None], (n_policies, len(block), 1))
+        all_cost = np.concatenate([no_product, product_cost], axis=2)
+        block_choice = all_cost.argmin(axis=2)
+        choice[:, start:start + len(block)] = block_choice
+        best_cost[:, start:start + len(block)] = np.take_along_axis(all_cost, block_choice[:, :, None], axis=2)[:, :, 0]
+
+    option_names = np.array([NO_PRODUCT] + product_names, dtype=object)
+    baseline = spend.sum()
+    summary = pd.DataFrame({
+        '原始收入': baseline,
+        '模擬收入': best_cost.sum(axis=1),
+        '轉換人次': (choice > 0).sum(axis=1),
+    }, index=pd.Index(list(policies), name='方案'))
+    summary['收入變化'] = summary['模擬收入'] - summary['原始收入']
+    summary['收入變化率'] = summary['收入變化'] / baseline if baseline else 0.0
+    for k, name in enumerate(product_names, start=1):
+        summary[f'選擇_{name}'] = (choice == k).sum(axis=1)
+
+    months = spend_matrix.index.get_level_values('月份')
+    monthly = pd.DataFrame(best_cost.T, index=months, columns=summary.index).groupby(level=0).sum().T
+
+    choices = pd.DataFrame(option_names[choice.T], index=spend_matrix.index, columns=summary.index)
+    return summary, monthly, choices
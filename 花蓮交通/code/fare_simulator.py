@@ -0,0 +1,107 @@
+# 檔名: code/fare_simulator.py
+# 功能: 定期票產品的票價方案試算模擬器。
+# 說明: 以「卡號 × 月份」的各運具消費矩陣為輸入，對每一個卡號月份計算在各候選方案下
+#       最划算的選擇 (不購買 / 199 / 399 / 區域票 ...)，並彙總各方案的收入變化與轉換人次。
+#       所有方案一次以陣列運算完成：
+#         未涵蓋消費 U = S · (1 - A)ᵀ        (S: 卡號月份 × 運具, A: 產品 × 運具 的涵蓋矩陣)
+#         產品花費   C[q, i, k] = P[q, k] + U[i, k]   (P: 方案 × 產品 的價格，未提供的產品為 ∞)
+#         最低花費   min(不購買的原價, minₖ C[q, i, k])
+#       試算新方案只需在 config.FARE_POLICIES 加入一組價格，不必再手動修改分析腳本。
+#       陣列運算本身位於 code/fare_matrix.py，雲林市區公車的月票試算也共用同一份實作。
+import pandas as pd
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from feature_store import sync_store, load_card_month_facts
+from placeholders import has_card
+import fare_matrix
+
+# =============================================================================
+#  輸入矩陣
+# =============================================================================
+
+def build_spend_matrix(facts_by_mode, value_col='非定期票消費扣款'):
+    """
+    將各運具的「卡號 × 月份」事實表合併為消費矩陣 (排除 '非電子票證' 等卡號佔位值，
+    否則整個月份的現金收入會被當成同一張卡，試算出不存在的購票選擇)。
+
+    Args:
+        facts_by_mode (dict): {運具名稱: 事實表}，事實表由 feature_store.card_month_facts 產生。
+        value_col (str): 作為原始花費的金額欄位 (預設為排除定期票後的消費)。
+
+    Returns:
+        pd.DataFrame: 索引為 (月份, 卡號)、欄位為運具，只保留有消費的卡號月份。
+    """
+    columns = [facts[has_card(facts['卡號'])].set_index(['月份', '卡號'])[value_col].rename(mode)
+               for mode, facts in facts_by_mode.items() if facts is not None]
+    if not columns:
+        return None
+    matrix = pd.concat(columns, axis=1).fillna(0)
+    return matrix[matrix.sum(axis=1) > 0].sort_index()
+
+
+# =============================================================================
+#  模擬
+# =============================================================================
+
+def simulate_policies(spend_matrix, products=None, policies=None, chunk_size=200000):
+    """
+    一次試算多個票價方案 (陣列運算見 fare_matrix.simulate_policies)。
+
+    Args:
+        spend_matrix (pd.DataFrame): build_spend_matrix 的回傳值。
+        products (dict, optional): {產品名稱: {'price': 牌價, 'modes': [涵蓋運具]}}，預設為 config.FARE_PRODUCTS。
+        policies (dict, optional): {方案名稱: [產品名稱, ...] (以牌價提供) 或 {產品名稱: 售價}}，
+            預設為 config.FARE_POLICIES。
+        chunk_size (int): 每次處理的卡號月份數 (控制 方案 × 卡號月份 × 產品 陣列的記憶體用量)。
+
+    Returns:
+        tuple: (summary, monthly, choices)，欄位說明見 fare_matrix.simulate_policies。
+    """
+    return fare_matrix.simulate_policies(spend_matrix, products or config.FARE_PRODUCTS,
+                                         policies or config.FARE_POLICIES, chunk_size)
+
+# =============================================================================
+#  主流程
+# =============================================================================
+
+def run_fare_simulation(output_dir=None):
+    """ 合併市區公車與公路客運的事實表，試算 config.FARE_POLICIES 中的所有方案並輸出結果。 """
+    output_dir = output_dir or os.path.join(config.OUTPUT_BASE_DIR, '6_票價方案試算')
+    sources = {
+        '市區公車': (config.BUS_UNIFIED_DATA_FILE, config.BUS_FEATURE_STORE_DIR),
+        '公路客運': (config.HIGHWAY_BUS_UNIFIED_DATA_FILE, config.HIGHWAY_BUS_FEATURE_STORE_DIR),
+    }
+    facts_by_mode = {}
+    for mode, (unified_file, store_dir) in sources.items():
+        sync_store(unified_file, store_dir)
+        facts_by_mode[mode] = load_card_month_facts(store_dir)
+
+    spend_matrix = build_spend_matrix(facts_by_mode)
+    if spend_matrix is None or spend_matrix.empty:
+        print("警告：沒有可用的卡號月份消費資料，無法進行票價方案試算。")
+        return None
+
+    summary, monthly, choices = simulate_policies(spend_matrix)
+    print(f"\n--- [票價方案試算] 共 {len(spend_matrix)} 個卡號月份、{len(summary)} 個方案 ---")
+    print(summary.to_string())
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary.to_csv(os.path.join(output_dir, 'fare_policy_summary.csv'), encoding='utf-8-sig')
+    monthly.to_csv(os.path.join(output_dir, 'fare_policy_monthly_revenue.csv'), encoding='utf-8-sig')
+    choices.to_csv(os.path.join(output_dir, 'fare_policy_card_choices.csv'), encoding='utf-8-sig')
+    print(f"試算結果已儲存至: {output_dir}")
+    return summary
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_fare_simulation()
@@ -0,0 +1,117 @@
+# 檔名: code/fare_tiers.py
+# 功能: 月消費級距 (票價方案) 分析引擎。
+# 說明: 原本 analyze_定期票.py 是逐月篩選「卡號 × 月份」消費表，再逐一計算超過門檻的人數。
+#       這裡改以 feature_store.py 維護的「卡號 × 月份」事實表為輸入，給定任意級距邊界
+#       (例如 TPASS 的 199 / 399 / 1200 元)，以一次 pd.cut 加 crosstab 產生
+#       「月份 × 級距」人數表與各級距的卡號清單。試算不同票價方案時只需更換邊界，
+#       不必重新執行整個分析腳本。
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from feature_store import sync_store, load_card_month_facts
+
+# =============================================================================
+#  級距分級
+# =============================================================================
+
+def tier_labels(boundaries, right=False, unit=' 元'):
+    """
+    依邊界產生級距標籤。
+
+    Args:
+        boundaries (list): 由小到大的級距邊界。
+        right (bool): False 時區間為「含下界、不含上界」(例如 '>= 199 元')；
+                      True 時為「不含下界、含上界」(例如 '> 399 元')。
+    """
+    boundaries = sorted(boundaries)
+    low, high = ('<=', '>') if right else ('<', '>=')
+    labels = [f'{low} {boundaries[0]}{unit}']
+    labels += [f'{a} - {b}{unit}' for a, b in zip(boundaries[:-1], boundaries[1:])]
+    labels.append(f'{high} {boundaries[-1]}{unit}')
+    return labels
+
+
+def assign_tiers(values, boundaries, labels=None, right=False):
+    """ 以 pd.cut 將金額分到各級距，回傳 Categorical 的 Series。 """
+    boundaries = sorted(boundaries)
+    bins = [-np.inf] + boundaries + [np.inf]
+    labels = labels or tier_labels(boundaries, right=right)
+    return pd.cut(values, bins=bins, labels=labels, right=right)
+
+
+def tier_counts(facts, boundaries, value_col='消費扣款', labels=None, right=False):
+    """
+    計算「月份 × 級距」的卡號數 (事實表中每張卡號每月只有一列，因此列數即人數)。
+
+    Returns:
+        pd.DataFrame: 索引為月份、欄位為各級距 (包含人數為 0 的級距)。
+    """
+    tiers = assign_tiers(facts[value_col], boundaries, labels=labels, right=right).rename('消費級距')
+    return pd.crosstab(facts['月份'], tiers, dropna=False)
+
+
+def tier_card_lists(facts, boundaries, value_col='消費扣款', labels=None, right=False):
+    """
+    取得每個月份、每個級距的卡號清單。
+
+    Returns:
+        pd.DataFrame: 欄位為 月份, 消費級距, 卡號, 金額欄位，依月份與級距排序。
+    """
+    card_lists = facts[['月份', '卡號', value_col]].copy()
+    card_lists.insert(1, '消費級距', assign_tiers(facts[value_col], boundaries, labels=labels, right=right))
+    return card_lists.sort_values(['月份', '消費級距', value_col], ascending=[True, True, False])
+
+# =============================================================================
+#  主流程
+# =============================================================================
+
+def run_fare_tier_analysis(unified_file, store_dir, output_dir, boundaries=None, value_col='非定期票消費扣款'):
+    """
+    更新特徵儲存區後，依級距邊界輸出「月份 × 級距」人數表與卡號清單。
+
+    Args:
+        unified_file (str): data_loader 產生的統一資料檔。
+        store_dir (str): 特徵儲存區資料夾。
+        output_dir (str): 結果輸出資料夾。
+        boundaries (list, optional): 級距邊界，預設使用 config.FARE_TIER_BOUNDARIES。
+        value_col (str): 用來分級的金額欄位 (預設為排除定期票後的月消費)。
+    """
+    boundaries = boundaries or config.FARE_TIER_BOUNDARIES
+    sync_store(unified_file, store_dir)
+    facts = load_card_month_facts(store_dir)
+    if facts is None:
+        print("警告：特徵儲存區為空，無法進行票價級距分析。")
+        return None
+
+    facts = facts[facts[value_col] > 0]
+    counts = tier_counts(facts, boundaries, value_col=value_col)
+    print(f"\n--- [票價級距分析] 各月份 {value_col} 級距人數 (邊界: {boundaries}) ---")
+    print(counts)
+
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = '_'.join(str(b) for b in sorted(boundaries))
+    counts_path = os.path.join(output_dir, f'fare_tier_counts_{suffix}.csv')
+    counts.to_csv(counts_path, encoding='utf-8-sig')
+    lists_path = os.path.join(output_dir, f'fare_tier_card_lists_{suffix}.csv')
+    tier_card_lists(facts, boundaries, value_col=value_col).to_csv(lists_path, index=False, encoding='utf-8-sig')
+    print(f"級距人數表已儲存至: {counts_path}")
+    print(f"各級距卡號清單已儲存至: {lists_path}")
+    return counts
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_fare_tier_analysis(config.BUS_UNIFIED_DATA_FILE, config.BUS_FEATURE_STORE_DIR,
+                           os.path.join(config.BUS_OUTPUT_DIR, 'tpass_analysis'))
+    run_fare_tier_analysis(config.HIGHWAY_BUS_UNIFIED_DATA_FILE, config.HIGHWAY_BUS_FEATURE_STORE_DIR,
+                           os.path.join(config.HIGHWAY_BUS_OUTPUT_DIR, 'tpass_analysis'))
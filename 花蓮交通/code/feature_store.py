@@ -0,0 +1,409 @@
+# 檔名: code/feature_store.py
+# 功能: 以「卡號 × 月份」為單位，維護可合併 (mergeable) 的乘客特徵充分統計量。
+# 說明: 每個月份存成一個獨立的分割區，內容只包含「計數」、「總和」與「各值的計數表」，
+#       因此新增一個月份時只需處理該月的資料，再與既有分割區相加即可得到全期特徵。
+#       data_loader 寫出統一資料檔後即以 write_store 逐月重建儲存區；分析腳本只以 sync_store 比對修改時間，
+#       不會重新掃描統一資料檔。
+#       cluster_analysis.py、analyze_定期票.py 與 analyze_data.py 皆由此讀取卡號層級的統計。
+#
+# 儲存格式 (每個月份兩個檔案，另加一個跨月份的事實表):
+#   card_stats_<YYYY-MM>.csv  : 卡號, 旅次是否完整, 旅次數, 旅次時長總和, 有效時長次數, 平日次數, 尖峰次數, 深夜清晨次數, 消費扣款
+#                               (旅次時長總和與有效時長次數只計入時長大於 0 的旅次；早於有效時長次數加入前建立的分割區
+#                                讀取時以旅次數代替，需重新執行 data_loader 重建)
+#   card_values_<YYYY-MM>.csv : 卡號, 旅次是否完整, 欄位, 值, 次數, 消費扣款
+#   card_month_facts.csv      : 月份, 卡號, 旅次數, 消費扣款, 活躍日數, 非定期票旅次數, 非定期票消費扣款
+#                               (由上面兩種分割區彙整而成的「卡號 × 月份」事實表，供票價級距分析使用)
+#                               早於「上車日期」計數表加入前建立的分割區沒有活躍日數，需重新執行 data_loader 重建。
+#   card_hll_<YYYY-MM>.csv    : 各路線、車站、持卡身分的相異卡號 HyperLogLog (見 distinct_counters.py)
+import pandas as pd
+import numpy as np
+import os
+import glob
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from od_utils import encode_od, decode_od
+from distinct_counters import build_hll, merge_hll, save_hll, load_hll, hll_path
+from placeholders import has_card
+
+# =============================================================================
+#  統計量定義
+# =============================================================================
+# 分割區內的鍵值欄位 (月份由檔名決定)
+KEY_COLUMNS = ['卡號', '旅次是否完整']
+
+# 可直接相加的數值統計欄位
+STAT_COLUMNS = ['旅次數', '旅次時長總和', '有效時長次數', '平日次數', '尖峰次數', '深夜清晨次數', '消費扣款']
+
+# 需要保留「各值計數表」的欄位 (用於眾數、相異數與熵；上車日期用於計算活躍日數)
+VALUE_FIELDS = ['路線', '上車站名', '下車站名', '持卡身分', '票種類型', '上車日期']
+
+# 「卡號 × 月份」事實表的檔名，以及事實表中另外拆出的票種
+FACTS_FILENAME = 'card_month_facts.csv'
+PASS_TICKET_TYPE = '定期票'
+
+# 尖峰與深夜清晨時段的定義 (與 cluster_analysis.py 原本的定義相同)
+PEAK_HOURS = [7, 8, 17, 18]
+LATE_NIGHT_HOURS = [22, 23, 0, 1, 2, 3, 4, 5]
+
+# 從統一資料中讀取的欄位
+SOURCE_COLUMNS = ['路線', '卡號', '持卡身分', '票種類型', '上車時間', '上車站名', '下車站名',
+                  '消費扣款', '旅次是否完整', '上車小時', '日期類型', '旅次時長(分)']
+
+# =============================================================================
+#  分割區的建立與合併
+# =============================================================================
+
+def build_partition(df):
+    """
+    將一批旅次資料 (可為任意大小的片段) 彙整成「卡號層級」的統計量。
+
+    Args:
+        df (pd.DataFrame): 含 SOURCE_COLUMNS 欄位的旅次資料。
+
+    Returns:
+        tuple: (stats, values) 兩個 DataFrame，可直接與其他分割區合併。
+    """
+    # 旅次時長為 0 的是非電子票證或不完整旅次的填補值，平均旅次時長的分子與分母都只計入時長大於 0 的旅次
+    durations = pd.to_numeric(df['旅次時長(分)'], errors='coerce').fillna(0)
+    has_duration = durations > 0
+    df = df.assign(
+        旅次數=1,
+        平日次數=(df['日期類型'] == '平日').astype(int),
+        尖峰次數=df['上車小時'].isin(PEAK_HOURS).astype(int),
+        深夜清晨次數=df['上車小時'].isin(LATE_NIGHT_HOURS).astype(int),
+        旅次時長總和=durations.where(has_duration, 0),
+        有效時長次數=has_duration.astype(int),
+        消費扣款=pd.to_numeric(df['消費扣款'], errors='coerce').fillna(0),
+        上車日期=pd.to_datetime(df['上車時間'], errors='coerce').dt.strftime('%Y-%m-%d'),
+    )
+    stats = df.groupby(KEY_COLUMNS, sort=False)[STAT_COLUMNS].sum().reset_index()
+
+    value_tables = []
+    for field in VALUE_FIELDS:
+        table = df.groupby(KEY_COLUMNS + [field], sort=False).agg(
+            次數=('旅次數', 'sum'), 消費扣款=('消費扣款', 'sum')
+        ).reset_index().rename(columns={field: '值'})
+        table.insert(2, '欄位', field)
+        value_tables.append(table)
+
+    # OD 計數表：以整數 OD 鍵值分組，只為「出現過的組合」產生標籤，避免逐筆字串相加
+    od_keys, stations = encode_od(df['上車站名'], df['下車站名'])
+    od_table = df.assign(OD鍵值=od_keys)[od_keys >= 0].groupby(KEY_COLUMNS + ['OD鍵值'], sort=False).agg(
+        次數=('旅次數', 'sum'), 消費扣款=('消費扣款', 'sum')
+    ).reset_index()
+    od_table['值'] = decode_od(od_table['OD鍵值'], stations)
+    od_table['欄位'] = 'OD'
+    value_tables.append(od_table[KEY_COLUMNS + ['欄位', '值', '次數', '消費扣款']])
+
+    values = pd.concat(value_tables, ignore_index=True)
+    return stats, values
+
+
+def merge_partitions(stats_list, values_list, keep_month=False):
+    """
+    合併多個分割區的統計量。因為所有欄位皆為計數或總和，直接相加即可。
+
+    Args:
+        stats_list (list): 多個 stats DataFrame。
+        values_list (list): 多個 values DataFrame。
+        keep_month (bool): 是否保留 '月份' 欄位 (保留時只合併同一月份的資料)。
+
+    Returns:
+        tuple: 合併後的 (stats, values)。
+    """
+    keys = (['月份'] if keep_month else []) + KEY_COLUMNS
+    stats = pd.concat(stats_list, ignore_index=True)
+    values = pd.concat(values_list, ignore_index=True)
+    stats = stats.groupby(keys, sort=False)[STAT_COLUMNS].sum().reset_index()
+    values = values.groupby(keys + ['欄位', '值'], sort=False)[['次數', '消費扣款']].sum().reset_index()
+    return stats, values
+
+# =============================================================================
+#  儲存區的讀寫
+# =============================================================================
+
+def _partition_paths(store_dir, month):
+    return (os.path.join(store_dir, f'card_stats_{month}.csv'),
+            os.path.join(store_dir, f'card_values_{month}.csv'))
+
+
+def list_months(store_dir):
+    """ 列出儲存區中已存在的月份分割區 (YYYY-MM)。 """
+    files = glob.glob(os.path.join(store_dir, 'card_stats_*.csv'))
+    return sorted(os.path.basename(f)[len('card_stats_'):-len('.csv')] for f in files)
+
+
+def save_partition(store_dir, month, stats, values):
+    """ 將單一月份的統計量寫入儲存區 (會覆蓋同月份的舊檔)。 """
+    os.makedirs(store_dir, exist_ok=True)
+    stats_path, values_path = _partition_paths(store_dir, month)
+    stats.to_csv(stats_path, index=False, encoding='utf-8-sig')
+    values.to_csv(values_path, index=False, encoding='utf-8-sig')
+
+
+def remove_months(store_dir, months):
+    """ 刪除指定月份的分割區與 HLL 檔案。 """
+    for month in months:
+        for path in _partition_paths(store_dir, month) + (hll_path(store_dir, month),):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def append_month(df_month, store_dir, month, replace=False, save_facts=True):
+    """
+    將「單一月份」的旅次資料加入儲存區。
+    處理時間只與該月資料量成正比，既有月份的分割區完全不需重算。
+
+    Args:
+        df_month (pd.DataFrame): 該月份的旅次資料。
+        store_dir (str): 儲存區資料夾。
+        month (str): 月份 (YYYY-MM)。
+        replace (bool): True 時以新資料取代該月份的分割區；False 時若該月份已存在，
+                        新資料會與舊分割區相加 (適用於同月資料分批到達的情況)。
+        save_facts (bool): 是否隨即重建「卡號 × 月份」事實表 (一次寫入多個月份時可最後再重建)。
+    """
+    stats, values = build_partition(df_month)
+    hll = build_hll(df_month)
+    if not replace and month in list_months(store_dir):
+        old_stats, old_values = load_store(store_dir, months=[month])
+        stats, values = merge_partitions([old_stats, stats], [old_values, values])
+        hll = merge_hll(load_hll(store_dir, months=[month]).get(month, {}), hll)
+    save_partition(store_dir, month, stats, values)
+    save_hll(store_dir, month, hll)
+    print(f"  - 月份 {month} 已寫入特徵儲存區，共 {stats['卡號'].nunique()} 張卡號。")
+    if save_facts:
+        save_card_month_facts(store_dir)
+
+
+def write_store(df, store_dir):
+    """
+    由 data_loader 呼叫：以剛輸出的統一資料逐月重建儲存區 (不需再讀回統一資料檔)。
+    資料中的月份以 append_month 取代舊分割區，資料中已不存在的月份 (例如測試模式或原始資料變更後) 一併刪除，
+    因此儲存區永遠與統一資料檔一致。
+    """
+    print(f"正在更新特徵儲存區: {store_dir}")
+    months = pd.to_datetime(df['上車時間'], errors='coerce').dt.strftime('%Y-%m')
+    for month, df_month in df[SOURCE_COLUMNS].groupby(months):
+        append_month(df_month, store_dir, month, replace=True, save_facts=False)
+    remove_months(store_dir, sorted(set(list_months(store_dir)) - set(months.dropna())))
+    save_card_month_facts(store_dir)
+
+
+def load_store(store_dir, months=None, keep_month=False):
+    """
+    讀取儲存區並合併指定月份的統計量。
+
+    Args:
+        store_dir (str): 儲存區資料夾。
+        months (list, optional): 要讀取的月份 (YYYY-MM)，預設為全部。
+        keep_month (bool): 是否保留月份維度 (例如要做逐月分析時)。
+
+    Returns:
+        tuple: (stats, values)；若儲存區為空則回傳 (None, None)。
+    """
+    available = list_months(store_dir)
+    if months is not None:
+        available = [m for m in available if m in set(months)]
+    if not available:
+        print(f"警告：特徵儲存區 '{store_dir}' 中沒有可用的月份分割區。")
+        return None, None
+
+    stats_list, values_list = [], []
+    for month in available:
+        stats_path, values_path = _partition_paths(store_dir, month)
+        stats = pd.read_csv(stats_path, dtype={'卡號': str})
+        if '有效時長次數' not in stats.columns:
+            print(f"警告：月份 {month} 的分割區沒有有效時長次數，平均旅次時長改以旅次數計算；請重新執行 data_loader 重建儲存區。")
+            stats['有效時長次數'] = stats['旅次數']
+        values = pd.read_csv(values_path, dtype={'卡號': str, '值': str})
+        stats['月份'] = month
+        values['月份'] = month
+        stats_list.append(stats)
+        values_list.append(values)
+    return merge_partitions(stats_list, values_list, keep_month=keep_month)
+
+
+def update_store(unified_file, store_dir, rebuild=False, chunk_size=500000):
+    """
+    由統一資料檔補齊儲存區中缺少的月份。
+    資料以分塊方式讀取，每塊先各自彙整成部分統計量，最後再依月份合併，
+    記憶體用量只與卡號數量有關，而與旅次筆數無關。
+
+    Args:
+        unified_file (str): data_loader 產生的統一資料檔路徑。
+        store_dir (str): 儲存區資料夾。
+        rebuild (bool): 是否重建所有月份 (預設只處理儲存區中尚未存在的月份)。
+        chunk_size (int): 每次讀取的資料筆數。
+    """
+    print(f"正在更新特徵儲存區: {store_dir}")
+    existing = set() if rebuild else set(list_months(store_dir))
+    found = set()
+    partial, partial_hll = {}, {}
+    try:
+        reader = pd.read_csv(unified_file, usecols=SOURCE_COLUMNS, chunksize=chunk_size,
+                             dtype={'路線': str, '卡號': str}, low_memory=False)
+        for chunk in reader:
+            chunk['月份'] = pd.to_datetime(chunk['上車時間'], errors='coerce').dt.strftime('%Y-%m')
+            found.update(chunk['月份'].dropna().unique())
+            chunk = chunk[chunk['月份'].notna() & ~chunk['月份'].isin(existing)]
+            for month, month_df in chunk.groupby('月份'):
+                partial.setdefault(month, []).append(build_partition(month_df))
+                partial_hll[month] = merge_hll(partial_hll.get(month, {}), build_hll(month_df))
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案 '{unified_file}'。請先執行對應的 data_loader。")
+        return
+
+    if rebuild:
+        # 重建時移除統一資料中已不存在的月份
+        remove_months(store_dir, sorted(set(list_months(store_dir)) - found))
+    if not partial:
+        print("  - 沒有新的月份需要加入，儲存區已是最新狀態。")
+        return
+
+    for month in sorted(partial):
+        stats, values = merge_partitions([p[0] for p in partial[month]], [p[1] for p in partial[month]])
+        save_partition(store_dir, month, stats, values)
+        save_hll(store_dir, month, partial_hll[month])
+        print(f"  - 月份 {month} 已寫入特徵儲存區，共 {stats['卡號'].nunique()} 張卡號。")
+    save_card_month_facts(store_dir)
+
+
+def sync_store(unified_file, store_dir):
+    """
+    分析腳本使用儲存區前呼叫：只比較檔案修改時間，儲存區與統一資料檔一致時不讀取統一資料。
+    data_loader 寫出統一資料檔後即以 write_store 更新儲存區，因此正常流程下不會觸發重建；
+    只有儲存區不存在、或統一資料檔比儲存區新 (例如以舊版 data_loader 產生) 時，才以 update_store 整份重建。
+    """
+    facts_path = os.path.join(store_dir, FACTS_FILENAME)
+    if not os.path.exists(unified_file):
+        if not os.path.exists(facts_path):
+            print(f"錯誤：找不到檔案 '{unified_file}'。請先執行對應的 data_loader。")
+        return
+    if os.path.exists(facts_path) and list_months(store_dir) and \
+            os.path.getmtime(facts_path) >= os.path.getmtime(unified_file):
+        return
+    print("  - 特徵儲存區不存在或早於統一資料檔，重新建立所有月份...")
+    update_store(unified_file, store_dir, rebuild=True)
+
+# =============================================================================
+#  由統計量推導特徵
+# =============================================================================
+
+def _value_modes(values, field):
+    """ 由計數表取得每張卡號在某欄位的眾數 (同票數時取排序最小的值，與 Series.mode() 一致)。 """
+    table = values[values['欄位'] == field]
+    table = table.sort_values(['卡號', '次數', '值'], ascending=[True, False, True])
+    return table.drop_duplicates('卡號').set_index('卡號')['值']
+
+
+def compute_card_features(stats, values, complete_only=True):
+    """
+    由合併後的統計量推導出 cluster_analysis.py 使用的乘客特徵。
+
+    Args:
+        stats, values: load_store() 的回傳值 (不含月份維度)。
+        complete_only (bool): 是否只使用完整旅次 (與原本分群流程的前處理一致)。
+
+    Returns:
+        pd.DataFrame: 每張卡號一列的特徵表。
+    """
+    if complete_only:
+        stats = stats[stats['旅次是否完整'].astype(str) == 'True']
+        values = values[values['旅次是否完整'].astype(str) == 'True']
+    stats = stats.groupby('卡號')[STAT_COLUMNS].sum()
+    values = values.groupby(['卡號', '欄位', '值'], sort=False)['次數'].sum().reset_index()
+
+    features = pd.DataFrame(index=stats.index)
+    features['總乘車次數'] = stats['旅次數']
+    # 只以有旅次時長的旅次為分母 (沒有任何有效時長的卡號為 0)
+    features['平均旅次時長'] = stats['旅次時長總和'] / stats['有效時長次數']
+    features['平日乘車比例'] = stats['平日次數'] / stats['旅次數']
+    features['尖峰時段乘車比例'] = stats['尖峰次數'] / stats['旅次數']
+    features['深夜清晨乘車次數'] = stats['深夜清晨次數']
+
+    # 熵：H = -Σ p·log2(p)，p 為每張卡號各 OD 的搭乘比例
+    od = values[values['欄位'] == 'OD']
+    p = od['次數'] / od.groupby('卡號')['次數'].transform('sum')
+    features['旅次起終點熵'] = (-p * np.log2(p)).groupby(od['卡號']).sum()
+
+    features['搭乘路線數'] = values[values['欄位'] == '路線'].groupby('卡號').size()
+    features['最常上車站點'] = _value_modes(values, '上車站名')
+    features['最常下車站點'] = _value_modes(values, '下車站名')
+    features['主要活動路線'] = _value_modes(values, '路線')
+    features['主要持卡身分'] = _value_modes(values, '持卡身分')
+    features['主要票種類型'] = _value_modes(values, '票種類型')
+
+    features = features.reset_index()
+    features.replace([np.inf, -np.inf], 0, inplace=True)
+    features.fillna(0, inplace=True)
+    return features
+
+
+def card_trip_counts(stats=None, values=None, ticket_type=None):
+    """
+    計算每張卡號的總搭乘次數 (包含不完整旅次)。
+    若指定 ticket_type (例如 '定期票')，則只計算該票種的搭乘次數。
+    """
+    if ticket_type is None:
+        return stats.groupby('卡號')['旅次數'].sum()
+    table = values[(values['欄位'] == '票種類型') & (values['值'] == ticket_type)]
+    return table.groupby('卡號')['次數'].sum()
+
+
+def card_month_facts(values):
+    """
+    由計數表建立「卡號 × 月份」事實表 (load_store 需以 keep_month=True 讀取)。
+    卡號佔位值 (例如 '非電子票證') 會彙總該月所有現金旅次，不代表任何一位乘客，因此排除。
+
+    Returns:
+        pd.DataFrame: 欄位為 月份, 卡號, 旅次數, 消費扣款, 活躍日數, 非定期票旅次數, 非定期票消費扣款。
+                      活躍日數為該月有搭乘紀錄的相異日期數 (不分票種)。
+    """
+    keys = ['月份', '卡號']
+    values = values[has_card(values['卡號'])]
+    tickets = values[values['欄位'] == '票種類型']
+    non_pass = tickets['值'] != PASS_TICKET_TYPE
+    facts = tickets.groupby(keys).agg(旅次數=('次數', 'sum'), 消費扣款=('消費扣款', 'sum'))
+    non_pass_facts = tickets[non_pass].groupby(keys).agg(非定期票旅次數=('次數', 'sum'), 非定期票消費扣款=('消費扣款', 'sum'))
+    active_days = values[values['欄位'] == '上車日期'].groupby(keys)['值'].nunique()
+
+    facts['活躍日數'] = active_days.reindex(facts.index).fillna(0).astype(int)
+    facts = facts.join(non_pass_facts).fillna({'非定期票旅次數': 0, '非定期票消費扣款': 0})
+    facts = facts.astype({'旅次數': int, '非定期票旅次數': int})
+    return facts.reset_index()
+
+
+def save_card_month_facts(store_dir):
+    """ 由儲存區的全部月份重建並寫出「卡號 × 月份」事實表。 """
+    _, values = load_store(store_dir, keep_month=True)
+    if values is None:
+        return None
+    facts = card_month_facts(values)
+    facts_path = os.path.join(store_dir, FACTS_FILENAME)
+    facts.to_csv(facts_path, index=False, encoding='utf-8-sig')
+    print(f"  - 卡號 × 月份事實表已寫入: {facts_path} (共 {len(facts)} 列)")
+    return facts
+
+
+def load_card_month_facts(store_dir):
+    """ 讀取「卡號 × 月份」事實表 (排除卡號佔位值)；檔案不存在時由分割區重建。 """
+    facts_path = os.path.join(store_dir, FACTS_FILENAME)
+    if not os.path.exists(facts_path):
+        return save_card_month_facts(store_dir)
+    facts = pd.read_csv(facts_path, dtype={'月份': str, '卡號': str})
+    # 舊版事實表可能仍含有卡號佔位值
+    return facts[has_card(facts['卡號'])].reset_index(drop=True)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    update_store(config.BUS_UNIFIED_DATA_FILE, config.BUS_FEATURE_STORE_DIR, rebuild=True)
+    update_store(config.HIGHWAY_BUS_UNIFIED_DATA_FILE, config.HIGHWAY_BUS_FEATURE_STORE_DIR, rebuild=True)
@@ -0,0 +1,239 @@
+# 檔名: code/heavy_hitters.py
+# 功能: 熱門項目 (heavy hitter) 的可合併摘要 (Space-Saving / Misra-Gries)。
+# 說明: 熱門 OD、熱門車站、熱門路線的排名原本都要先對所有組合做完整的 groupby，再取 nlargest。
+#       這裡改為只保留前 capacity 個項目的摘要 (sketch)，可以逐塊 (chunk) 更新，也可以跨分割區合併，
+#       記憶體用量固定為 O(capacity)，不會隨 OD 組合數增加。
+#
+#       每個 sketch 為一個 dict：
+#         capacity : 最多保留的項目數
+#         total    : 已處理的總權重 (人次)
+#         bound    : 未收錄項目的權重上限 (沒有被保留的項目，真實值一定不超過此值)
+#         counts   : 各項目的估計值 (上界)，索引為項目 (多欄時為 MultiIndex)
+#         errors   : 各項目的最大高估量；真實值落在 [counts - errors, counts] 之間
+#
+#       合併規則 (Agarwal et al., Mergeable Summaries)：項目在某一邊沒有被收錄時，以該邊的 bound 代替，
+#       兩邊相加後保留估計值最大的 capacity 個項目；被捨棄項目的最大估計值併入新的 bound。
+import pandas as pd
+import numpy as np
+import os
+import sys
+from functools import reduce
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from alighting_inference import has_alighting_stop
+
+# 公車 data_loader 輸出的排名 sketch：{檔名: 項目欄位}
+BUS_RANKINGS = {
+    'od': ['上車站名', '下車站名'],
+    'boarding_stops': '上車站名',
+    'alighting_stops': '下車站名',
+    'routes': '路線',
+}
+
+# =============================================================================
+#  建立與合併
+# =============================================================================
+
+def empty_sketch(capacity=None):
+    """ 建立一個空的 sketch (capacity 預設為 config.RANKING_SKETCH_CAPACITY)。 """
+    capacity = capacity or config.RANKING_SKETCH_CAPACITY
+    return {'capacity': capacity, 'total': 0.0, 'bound': 0.0,
+            'counts': pd.Series(dtype=np.float64), 'errors': pd.Series(dtype=np.float64)}
+
+
+def _prune(counts, errors, capacity, bound, total):
+    """ 保留估計值最大的 capacity 個項目，被捨棄項目的最大估計值併入 bound。 """
+    if len(counts) > capacity:
+        order = np.argsort(-counts.to_numpy(), kind='stable')
+        bound = max(bound, float(counts.iloc[order[capacity]]))
+        keep = np.sort(order[:capacity])
+        counts, errors = counts.iloc[keep], errors.iloc[keep]
+    return {'capacity': capacity, 'total': total, 'bound': bound, 'counts': counts, 'errors': errors}
+
+
+def summarize_chunk(chunk, key_cols, weight_col=None, capacity=None):
+    """
+    將一塊資料做精確彙整後裁切為 sketch (只需對這一塊做 groupby)。
+
+    Args:
+        chunk (pd.DataFrame): 一塊資料 (例如 read_csv 的一個 chunk 或 Dask 的一個分割區)。
+        key_cols (str or list): 項目欄位，例如 ['起點', '迄點']。
+        weight_col (str, optional): 權重欄位 (例如 '人次')；未指定時每列權重為 1。
+        capacity (int): 最多保留的項目數。
+    """
+    capacity = capacity or config.RANKING_SKETCH_CAPACITY
+    key_cols = [key_cols] if isinstance(key_cols, str) else list(key_cols)
+    keys = chunk[key_cols].dropna()
+    if weight_col:
+        counts = chunk.loc[keys.index].groupby(key_cols, observed=True)[weight_col].sum().astype(np.float64)
+    else:
+        counts = keys.groupby(key_cols, observed=True).size().astype(np.float64)
+    counts = counts[counts > 0]
+    errors = pd.Series(0.0, index=counts.index)
+    return _prune(counts, errors, capacity, 0.0, float(counts.sum()))
+
+
+def merge_sketches(a, b):
+    """
+    合併兩個 sketch (可交換、可結合，因此可依任意順序合併各分割區的結果)。
+    """
+    capacity = min(a['capacity'], b['capacity'])
+    if a['counts'].empty and a['bound'] == 0:
+        return _prune(b['counts'], b['errors'], capacity, b['bound'], a['total'] + b['total'])
+    if b['counts'].empty and b['bound'] == 0:
+        return _prune(a['counts'], a['errors'], capacity, a['bound'], a['total'] + b['total'])
+
+    index = a['counts'].index.union(b['counts'].index)
+    counts = (a['counts'].reindex(index, fill_value=a['bound'])
+              + b['counts'].reindex(index, fill_value=b['bound']))
+    errors = (a['errors'].reindex(index, fill_value=a['bound'])
+              + b['errors'].reindex(index, fill_value=b['bound']))
+    return _prune(counts, errors, capacity, a['bound'] + b['bound'], a['total'] + b['total'])
+
+
+def update_sketch(sketch, chunk, key_cols, weight_col=None):
+    """ 以一塊新資料更新 sketch (供串流讀取的 data_loader 逐塊呼叫)。 """
+    return merge_sketches(sketch, summarize_chunk(chunk, key_cols, weight_col, sketch['capacity']))
+
+
+def dask_sketch(ddf, key_cols, weight_col=None, capacity=None):
+    """
+    對 Dask DataFrame 的每個分割區各自建立 sketch 後合併 (傳入 pandas DataFrame 時直接彙整)，
+    取代 ddf.groupby(key_cols)[weight_col].sum().nlargest(n) 對所有組合做的全域 groupby。
+    """
+    capacity = capacity or config.RANKING_SKETCH_CAPACITY
+    if isinstance(ddf, pd.DataFrame):
+        return summarize_chunk(ddf, key_cols, weight_col, capacity)
+    import dask  # 只有 Dask 分析腳本會用到，公車 data_loader 不需要安裝 dask
+    parts = [dask.delayed(summarize_chunk)(part, key_cols, weight_col, capacity) for part in ddf.to_delayed()]
+    sketches = dask.compute(*parts)
+    return reduce(merge_sketches, sketches, empty_sketch(capacity))
+
+# =============================================================================
+#  查詢
+# =============================================================================
+
+def top_k(sketch, n=20):
+    """
+    取出估計值最高的前 n 個項目與誤差範圍。
+
+    Returns:
+        pd.DataFrame: 索引為項目，欄位為 估計值, 下界, 上界, 排名是否確定。
+                      「排名是否確定」為 True 表示此項目的下界高於第 n+1 名之後所有項目 (含未收錄項目) 的上界，
+                      也就是它一定屬於真正的前 n 名。
+    """
+    counts, errors = sketch['counts'], sketch['errors']
+    ranked = counts.sort_values(ascending=False, kind='stable')
+    head = ranked.head(n)
+    runner_up = max(float(ranked.iloc[n]) if len(ranked) > n else 0.0, sketch['bound'])
+    lower = head - errors.reindex(head.index)
+    return pd.DataFrame({
+        '估計值': head,
+        '下界': lower,
+        '上界': head,
+        '排名是否確定': lower > runner_up,
+    })
+
+
+def top_k_series(sketch, n=20, name=None):
+    """ 以 Series 回傳前 n 個項目的估計值 (與 groupby().sum().nlargest(n) 相同格式，可直接取代)。 """
+    return top_k(sketch, n)['估計值'].rename(name)
+
+
+def candidates(sketch, n=20):
+    """
+    取出一定涵蓋真正前 n 名的候選項目：上界不低於第 n 名下界的所有收錄項目。
+    只對這些項目重新精確計數即可得到正確的前 n 名與人次。
+
+    Returns:
+        tuple: (候選項目的索引, 是否完整)。未收錄項目的權重上限 (bound) 達到門檻時，
+               真正的前 n 名可能不在候選中，「是否完整」為 False。
+    """
+    counts, errors = sketch['counts'], sketch['errors']
+    lower = (counts - errors.reindex(counts.index)).sort_values(ascending=False, kind='stable')
+    threshold = float(lower.iloc[n - 1]) if len(lower) >= n else 0.0
+    return counts.index[counts >= threshold], sketch['bound'] < threshold
+
+
+def error_bound(sketch):
+    """ 任何項目估計值的最大可能誤差 (即未收錄項目的權重上限)。 """
+    return sketch['bound']
+
+# =============================================================================
+#  儲存與讀取 (讓 data_loader 產生的 sketch 可供分析腳本直接使用)
+# =============================================================================
+
+def save_sketch(sketch, path):
+    """ 將 sketch 存為 CSV；capacity、total 與 bound 存在每一列的 _capacity, _total, _bound 欄位。 """
+    frame = pd.DataFrame({'計數': sketch['counts'], '誤差': sketch['errors']}).reset_index()
+    frame['_capacity'], frame['_total'], frame['_bound'] = sketch['capacity'], sketch['total'], sketch['bound']
+    frame.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def load_sketch(path):
+    """ 讀取 save_sketch 儲存的 sketch；找不到檔案時回傳 None。 """
+    try:
+        frame = pd.read_csv(path, dtype=str)
+    except FileNotFoundError:
+        print(f"錯誤：找不到 sketch 檔案 '{path}'。請先執行對應的 data_loader。")
+        return None
+    if frame.empty:
+        return empty_sketch(config.RANKING_SKETCH_CAPACITY)
+    meta = ['計數', '誤差', '_capacity', '_total', '_bound']
+    key_cols = [c for c in frame.columns if c not in meta]
+    index = pd.MultiIndex.from_frame(frame[key_cols]) if len(key_cols) > 1 else pd.Index(frame[key_cols[0]])
+    return {
+        'capacity': int(float(frame['_capacity'].iloc[0])),
+        'total': float(frame['_total'].iloc[0]),
+        'bound': float(frame['_bound'].iloc[0]),
+        'counts': pd.Series(frame['計數'].astype(float).to_numpy(), index=index),
+        'errors': pd.Series(frame['誤差'].astype(float).to_numpy(), index=index),
+    }
+
+
+def save_ranking_sketches(df, store_dir, rankings=None, chunk_size=1000000):
+    """
+    由 data_loader 的最終資料逐塊建立排名 sketch 並存檔 (用到下車站名的排名只使用有下車站的旅次)。
+
+    Args:
+        df (pd.DataFrame): data_loader 清理後的資料。
+        store_dir (str): sketch 的儲存資料夾。
+        rankings (dict, optional): {檔名: 項目欄位}，預設為 BUS_RANKINGS。
+    """
+    rankings = rankings or BUS_RANKINGS
+    sketches = {name: empty_sketch() for name in rankings}
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        od_chunk = chunk[has_alighting_stop(chunk)]
+        for name, key_cols in rankings.items():
+            uses_alighting = '下車站名' in ([key_cols] if isinstance(key_cols, str) else key_cols)
+            source = od_chunk if uses_alighting else chunk
+            sketches[name] = update_sketch(sketches[name], source, key_cols)
+
+    os.makedirs(store_dir, exist_ok=True)
+    for name, sketch in sketches.items():
+        save_sketch(sketch, os.path.join(store_dir, f'{name}.csv'))
+    print(f"排名 sketch 已儲存至: {store_dir} (每個排名保留 {config.RANKING_SKETCH_CAPACITY} 個項目)")
+
+
+def print_ranking_reports(store_dir, n=20, rankings=None):
+    """ 直接由已儲存的 sketch 輸出各項前 n 名 (不需要讀取統一資料檔或做 groupby)。 """
+    for name in (rankings or BUS_RANKINGS):
+        sketch = load_sketch(os.path.join(store_dir, f'{name}.csv'))
+        if sketch is None:
+            continue
+        print(f"\n--- [{name}] 前 {n} 名 (總量 {sketch['total']:.0f}，最大誤差 {error_bound(sketch):.0f}) ---")
+        print(top_k(sketch, n).to_string())
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    print_ranking_reports(config.BUS_RANKING_SKETCH_DIR)
+    print_ranking_reports(config.HIGHWAY_BUS_RANKING_SKETCH_DIR)
@@ -0,0 +1,229 @@
+# 檔名: code/load_profile.py
+# 功能: 公車車上人數 (load profile) 重建引擎。
+# 說明: 每一筆完整旅次拆成兩個事件：上車 +1、下車 −1。事件依 (路線, 往返程, [車號], 時間) 排序後，
+#       做一次全域累積和 (cumsum) 即得到每個事件發生後的車上人數。
+#       因為每筆旅次的 +1 與 −1 落在同一個群組內，群組結束時累積和必定回到 0，
+#       所以不需要逐群組重設，整體只有一次 O(n log n) 的排序加上線性掃描。
+#       資料中有「車號」欄位時 (例如雲林的資料) 會以車輛為單位計算；否則為該路線方向所有車輛的合計車上人數。
+#       輸出：
+#         1. 車上人數時間序列：每個群組、每個時段的最大車上人數 (沒有刷卡的時段沿用前一個事件後的人數)；
+#         2. 平均時段剖面：依日期類型與時段平均，可直接畫成擁擠度曲線；
+#         3. 最大負載點：每個群組的最大車上人數與發生時間、站點，以及各站離站時的平均車上人數排名。
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from time_bucket import DAY_TYPES, slot_to_time
+
+# 從統一資料中讀取的欄位 ('車號' 為選用欄位)
+SOURCE_COLUMNS = ['路線', '往返程', '上車時間', '上車站名', '下車時間', '下車站名', '旅次是否完整']
+VEHICLE_COLUMN = '車號'
+
+# =============================================================================
+#  資料讀取
+# =============================================================================
+
+def load_trips(file_path, chunk_size=1000000):
+    """
+    分塊讀取統一資料檔，只保留上下車時間皆有效、且下車晚於上車的完整旅次
+    (上下車同一時間的旅次會讓同時刻的 −1 排在自己的 +1 之前，因此排除)。
+
+    Returns:
+        pd.DataFrame or None: 旅次資料；找不到檔案時回傳 None。
+    """
+    wanted = set(SOURCE_COLUMNS + [VEHICLE_COLUMN])
+    parts = []
+    try:
+        reader = pd.read_csv(file_path, usecols=lambda c: c in wanted, chunksize=chunk_size, dtype=str, low_memory=False)
+        for chunk in reader:
+            chunk = chunk[chunk['旅次是否完整'].astype(str) == 'True'].copy()
+            chunk['上車時間'] = pd.to_datetime(chunk['上車時間'], errors='coerce')
+            chunk['下車時間'] = pd.to_datetime(chunk['下車時間'], errors='coerce')
+            parts.append(chunk[chunk['下車時間'] > chunk['上車時間']])
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案 '{file_path}'。請先執行對應的 data_loader。")
+        return None
+    if not parts:
+        return None
+    return pd.concat(parts, ignore_index=True)
+
+
+def group_columns(df):
+    """ 事件分組的欄位：路線、往返程，資料中有車號時再加上車號。 """
+    return ['路線', '往返程'] + ([VEHICLE_COLUMN] if VEHICLE_COLUMN in df.columns else [])
+
+# =============================================================================
+#  事件掃描
+# =============================================================================
+
+def sweep_load(trips, group_cols=None):
+    """
+    將旅次拆成 +1/−1 事件並以累積和計算每個事件後的車上人數。
+
+    同一時間的事件先處理下車 (−1) 再處理上車 (+1)，避免同站上下車時高估人數。
+
+    Args:
+        trips (pd.DataFrame): load_trips 的回傳值。
+        group_cols (list, optional): 分組欄位，預設由 group_columns 決定。
+
+    Returns:
+        tuple: (events, groups)
+            events : 依 (群組, 時間, 事件) 排序的事件表，欄位為 群組, 時間, 站名, 事件, 車上人數。
+            groups : 群組代碼對照表 (索引為群組代碼，欄位為 group_cols)。
+    """
+    group_cols = group_cols or group_columns(trips)
+    group_codes, groups = pd.MultiIndex.from_frame(trips[group_cols].fillna('未提供')).factorize()
+    n = len(trips)
+
+    group = np.concatenate([group_codes, group_codes]).astype(np.int64)
+    times = np.concatenate([trips['上車時間'].to_numpy(dtype='datetime64[s]'),
+                            trips['下車時間'].to_numpy(dtype='datetime64[s]')])
+    delta = np.concatenate([np.ones(n, dtype=np.int8), -np.ones(n, dtype=np.int8)])
+    stops = np.concatenate([trips['上車站名'].to_numpy(dtype=object), trips['下車站名'].to_numpy(dtype=object)])
+
+    order = np.lexsort((delta, times, group))
+    events = pd.DataFrame({
+        '群組': group[order],
+        '時間': times[order],
+        '站名': stops[order],
+        '事件': delta[order],
+        '車上人數': np.cumsum(delta[order], dtype=np.int64),
+    })
+    groups = pd.DataFrame(list(groups), columns=group_cols).rename_axis('群組')
+    return events, groups
+
+# =============================================================================
+#  車上人數時間序列與平均剖面
+# =============================================================================
+
+def load_timeline(events, bucket_minutes=5):
+    """
+    計算每個群組在每個時段內的最大車上人數。
+
+    有事件的時段取「時段開始時的人數」與「時段內各事件後人數」的最大值；
+    同一群組兩個事件之間沒有刷卡的時段，人數維持前一個事件後的值 (人數為 0 的時段不輸出)。
+
+    Returns:
+        pd.DataFrame: 欄位為 群組, 時段起點, 最大車上人數。
+    """
+    if events.empty:
+        return pd.DataFrame(columns=['群組', '時段起點', '最大車上人數'])
+    group = events['群組'].to_numpy()
+    seconds = events['時間'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    slot = seconds // (bucket_minutes * 60)
+    load = events['車上人數'].to_numpy()
+
+    # 依 (群組, 時段) 切出連續區段
+    starts = np.flatnonzero(np.r_[True, (group[1:] != group[:-1]) | (slot[1:] != slot[:-1])])
+    ends = np.r_[starts[1:], len(load)] - 1
+    run_group, run_slot = group[starts], slot[starts]
+    # 時段開始時的人數 = 前一個事件後的人數 (只在時段的第一個事件晚於時段起點時才會出現在時段內)
+    previous = np.maximum(starts - 1, 0)
+    carry_in = np.where((starts > 0) & (group[previous] == run_group)
+                        & (seconds[starts] > run_slot * bucket_minutes * 60), load[previous], 0)
+    # 同一時刻有多個事件時，只有處理完該時刻所有事件後的人數才是實際狀態
+    is_final = np.r_[(group[1:] != group[:-1]) | (seconds[1:] != seconds[:-1]), True]
+    run_max = np.maximum(np.maximum.reduceat(np.where(is_final, load, 0), starts), carry_in)
+
+    # 補上同一群組中兩個區段之間沒有事件、但車上仍有人的時段
+    next_same = np.r_[run_group[1:] == run_group[:-1], False]
+    gaps = np.where(next_same, np.r_[run_slot[1:], 0] - run_slot - 1, 0)
+    gaps = np.where(load[ends] > 0, gaps, 0)
+    fill_group = np.repeat(run_group, gaps)
+    fill_slot = np.repeat(run_slot, gaps) + (np.arange(gaps.sum()) - np.repeat(np.cumsum(gaps) - gaps, gaps)) + 1
+    fill_load = np.repeat(load[ends], gaps)
+
+    timeline = pd.DataFrame({
+        '群組': np.r_[run_group, fill_group],
+        '時段起點': (np.r_[run_slot, fill_slot] * bucket_minutes).astype('datetime64[m]'),
+        '最大車上人數': np.r_[run_max, fill_load],
+    })
+    return timeline.sort_values(['群組', '時段起點'], ignore_index=True)
+
+
+def average_slot_profile(timeline, groups, bucket_minutes=5):
+    """
+    將時間序列依「日期類型 × 當日時段」彙整：平均與最大的時段最大車上人數 (沒有資料的日期不列入平均)。
+
+    Returns:
+        pd.DataFrame: 欄位為 分組欄位, 日期類型, 時段, 時間, 平均最大車上人數, 最高車上人數, 天數。
+    """
+    times = pd.to_datetime(timeline['時段起點'])
+    profile = timeline.assign(
+        日期類型=np.asarray(DAY_TYPES, dtype=object)[(times.dt.weekday >= 5).astype(int)],
+        時段=(times.dt.hour * 60 + times.dt.minute) // bucket_minutes,
+    ).groupby(['群組', '日期類型', '時段'])['最大車上人數'].agg(
+        平均最大車上人數='mean', 最高車上人數='max', 天數='size').reset_index()
+    profile['平均最大車上人數'] = profile['平均最大車上人數'].round(2)
+    profile.insert(3, '時間', [slot_to_time(s, bucket_minutes) for s in profile['時段']])
+    return groups.reset_index().merge(profile, on='群組').drop(columns='群組')
+
+# =============================================================================
+#  最大負載點
+# =============================================================================
+
+def max_load_points(events, groups, top_n=5):
+    """
+    找出每個群組的最大負載點。
+
+    Returns:
+        tuple: (peaks, stops)
+            peaks : 每個群組一列，含最大車上人數、發生時間與發生站點 (最大值的第一次發生)。
+            stops : 每個群組中，各站事件後平均車上人數最高的前 top_n 站 (即離站時最擁擠的站)。
+    """
+    peak_rows = events.sort_values(['群組', '車上人數'], ascending=[True, False], kind='stable').drop_duplicates('群組')
+    peaks = groups.reset_index().merge(
+        peak_rows[['群組', '車上人數', '時間', '站名']].rename(
+            columns={'車上人數': '最大車上人數', '時間': '發生時間', '站名': '發生站點'}), on='群組')
+
+    stops = (events.groupby(['群組', '站名'])['車上人數']
+             .agg(平均車上人數='mean', 最大車上人數='max', 事件數='size').reset_index())
+    stops = stops.sort_values(['群組', '平均車上人數'], ascending=[True, False], kind='stable')
+    stops['排名'] = stops.groupby('群組').cumcount() + 1
+    stops = stops[stops['排名'] <= top_n]
+    stops['平均車上人數'] = stops['平均車上人數'].round(2)
+    stops = groups.reset_index().merge(stops, on='群組')
+    return peaks.drop(columns='群組'), stops.drop(columns='群組')
+
+# =============================================================================
+#  主流程
+# =============================================================================
+
+def run_load_profile(unified_file, output_dir, bucket_minutes=None, top_n=5):
+    """ 讀取統一資料，重建車上人數並輸出時間序列、平均時段剖面與最大負載點。 """
+    bucket_minutes = bucket_minutes or config.TIME_BUCKET_MINUTES
+    trips = load_trips(unified_file)
+    if trips is None or trips.empty:
+        print("警告：沒有可用的完整旅次，無法重建車上人數。")
+        return None
+
+    events, groups = sweep_load(trips)
+    print(f"--- [車上人數剖面] {len(trips)} 筆完整旅次，{len(groups)} 個群組 (分組: {list(groups.columns)}) ---")
+    timeline = load_timeline(events, bucket_minutes)
+    profile = average_slot_profile(timeline, groups, bucket_minutes)
+    peaks, stops = max_load_points(events, groups, top_n)
+    print(peaks.sort_values('最大車上人數', ascending=False).head(15).to_string(index=False))
+
+    os.makedirs(output_dir, exist_ok=True)
+    groups.reset_index().merge(timeline, on='群組').drop(columns='群組').to_csv(
+        os.path.join(output_dir, f'load_timeline_{bucket_minutes}min.csv'), index=False, encoding='utf-8-sig')
+    profile.to_csv(os.path.join(output_dir, f'load_profile_{bucket_minutes}min.csv'), index=False, encoding='utf-8-sig')
+    peaks.to_csv(os.path.join(output_dir, 'max_load_points.csv'), index=False, encoding='utf-8-sig')
+    stops.to_csv(os.path.join(output_dir, 'max_load_stops.csv'), index=False, encoding='utf-8-sig')
+    print(f"車上人數時間序列、平均時段剖面與最大負載點已儲存至: {output_dir}")
+    return peaks
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_load_profile(config.BUS_UNIFIED_DATA_FILE, os.path.join(config.LOAD_PROFILE_OUTPUT_DIR, '市區公車'))
+    run_load_profile(config.HIGHWAY_BUS_UNIFIED_DATA_FILE, os.path.join(config.LOAD_PROFILE_OUTPUT_DIR, '公路客運'))
@@ -0,0 +1,295 @@
+# 檔名: code/loader_backend.py
+# 功能: 公車 data_loader 的資料框架後端選擇，以及 Polars LazyFrame 版本的讀取、清理與特徵工程。
+# 說明: 市區公車與公路客運的 data_loader 原本只有 pandas 版本 (逐檔讀入記憶體後再清理)。
+#       config.LOADER_BACKEND 可選擇：
+#         'pandas' : 原本的流程 (各 data_loader 的 load_with_pandas)；
+#         'polars' : 以 pl.scan_csv 建立 LazyFrame，檢核篩選、路線篩選與欄位選取都在讀檔時下推
+#                    (predicate / projection pushdown)，CSV 以多執行緒解析，
+#                    config.POLARS_STREAMING 為 True 時以串流引擎分批執行，不需一次載入整個檔案。
+#       兩種後端輸出相同欄位與型態的 pandas DataFrame，之後的下車站推估、sketch 與儲存區建立都共用。
+#       polars 為選用套件 (pip install polars，需 1.0 以上)；未安裝或測試模式 (卡號雜湊抽樣以 pandas 實作)
+#       時自動改用 pandas 後端。
+#
+#       台鐵 (code/台鐵/data_loader.py) 不在此設定的範圍內：台鐵原本就以 dd.read_csv 分區平行讀取，
+#       不會一次載入整個檔案，Polars 要解決的問題在台鐵不存在；而且台鐵的分析腳本
+#       (main_analysis_台鐵 等) 全部以 Dask DataFrame 的 .compute() 與 dd.to_datetime 運算，
+#       換成 Polars 後仍須轉回 Dask，反而多一次完整的資料複製。因此 LOADER_BACKEND 只影響公車的 data_loader，
+#       設為 'polars' 時台鐵的 data_loader 會提示並維持 Dask。
+#
+#       執行 python loader_backend.py 會以兩種後端分別處理市區公車原始資料，比較耗時與輸出是否一致，
+#       作為選擇預設後端的依據。
+import pandas as pd
+import numpy as np
+import os
+import glob
+import sys
+import time
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from alighting_inference import infer_alighting_stops
+
+BACKENDS = ('pandas', 'polars')
+
+# 資料代碼對應 (與公車 data_loader 相同)
+TICKET_TYPE_MAP = {'1': '單程票', '2': '來回票', '3': '回數票', '4': '定期票', '5': '團體票', '9': '其他'}
+HOLDER_TYPE_MAP = {'A': '普通', 'B': '學生', 'C01': '敬老', 'C02': '愛心', 'C09': '其他優待', 'D': '員工', 'X': '無法區別'}
+DIRECTION_MAP = {'0': '去程', '1': '返程', '2': '迴圈'}
+
+ETICKET_COLUMNS = {
+    '搭乘附屬路線名稱': '路線', '卡號': '卡號', '持卡身分': '持卡身分', '票種類型': '票種類型',
+    '搭乘公車路線方向': '往返程', '刷卡上車時間': '上車時間', '上車站牌名稱': '上車站名',
+    '刷卡下車時間': '下車時間', '下車站牌名稱': '下車站名', '實際支付價格': '消費扣款'
+}
+PROCESSED_COLUMNS = list(ETICKET_COLUMNS.values())
+
+# 站名清理規則 (與 clean_and_enrich_data 相同)
+STOP_NAME_PATTERN = r'^\d{2,}|[\(（].*?[\)）]|[\s=,-]'
+# 原始資料中出現的時間格式 (依序嘗試，皆不符合時為空值)
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M',
+                '%Y-%m-%d %H:%M:%S%.f', '%Y/%m/%d %H:%M:%S%.f']
+
+
+def resolve_backend(name=None):
+    """
+    決定實際使用的後端：設定值不正確、未安裝 polars 或測試模式時改用 pandas。
+    """
+    name = name or config.LOADER_BACKEND
+    if name not in BACKENDS:
+        print(f"警告：未知的 LOADER_BACKEND '{name}'，改用 pandas。")
+        return 'pandas'
+    if name == 'polars':
+        if config.TEST_MODE:
+            print("提示：測試模式的卡號抽樣以 pandas 實作，本次改用 pandas 後端。")
+            return 'pandas'
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            print("警告：未安裝 polars (pip install polars)，改用 pandas 後端。")
+            return 'pandas'
+    return name
+
+# =============================================================================
+#  Polars 版本的讀取與格式處理
+# =============================================================================
+
+def _map_codes(pl, column, mapping, default):
+    """ 代碼轉文字 (對應不到的代碼與空值為 default)。 """
+    return pl.col(column).str.strip_chars().replace_strict(mapping, default=default, return_dtype=pl.String)
+
+
+def _scan_file(pl, file):
+    """ 以 LazyFrame 掃描單一原始檔 (所有欄位先以字串讀取)，並套用檢核結果篩選。 """
+    skip = 1 if pd.read_csv(file, header=0, nrows=1, low_memory=False,
+                            on_bad_lines='skip').columns[0] == 'Authority' else 0
+    lf = pl.scan_csv(file, infer_schema_length=0, skip_rows_after_header=skip, ignore_errors=True,
+                     truncate_ragged_lines=True, encoding='utf8-lossy')
+    columns = lf.collect_schema().names()
+    validation_col = next((col for col in columns if '檢核結果' in col), None)
+    if validation_col:
+        lf = lf.filter(pl.col(validation_col).cast(pl.Float64, strict=False) == 3)
+    return lf, columns
+
+
+def _process_eticket(pl, lf):
+    return lf.select(
+        pl.col('搭乘附屬路線名稱').alias('路線'),
+        pl.col('卡號'),
+        _map_codes(pl, '持卡身分', HOLDER_TYPE_MAP, '未知身分'),
+        _map_codes(pl, '票種類型', TICKET_TYPE_MAP, '未知票種'),
+        _map_codes(pl, '搭乘公車路線方向', DIRECTION_MAP, None).alias('往返程'),
+        pl.col('刷卡上車時間').alias('上車時間'),
+        pl.col('上車站牌名稱').alias('上車站名'),
+        pl.col('刷卡下車時間').alias('下車時間'),
+        pl.col('下車站牌名稱').alias('下車站名'),
+        pl.col('實際支付價格').alias('消費扣款'),
+    )
+
+
+def _process_non_eticket(pl, lf, columns):
+    boarding_time = pl.concat_str([pl.col('乘車日期'), pl.col('乘車時間')], separator=' ')
+    if '搭乘公車路線方向' in columns:
+        direction = _map_codes(pl, '搭乘公車路線方向', DIRECTION_MAP, None)
+    else:
+        direction = pl.lit('未提供')
+    return lf.select(
+        pl.col('搭乘附屬路線名稱').alias('路線'),
+        pl.lit('非電子票證').alias('卡號'),
+        pl.lit('非電子票證').alias('持卡身分'),
+        _map_codes(pl, '票種類型', TICKET_TYPE_MAP, '未知票種'),
+        direction.alias('往返程'),
+        boarding_time.alias('上車時間'),
+        pl.lit('非電子票證').alias('上車站名'),
+        boarding_time.alias('下車時間'),  # 非電子票證無下車時間，暫時設為上車時間
+        pl.lit('非電子票證').alias('下車站名'),
+        pl.col('實際支付價格').alias('消費扣款'),
+    )
+
+
+def _parse_time(pl, column):
+    text = pl.col(column).str.strip_chars()
+    return pl.coalesce([text.str.strptime(pl.Datetime('ns'), fmt, strict=False) for fmt in TIME_FORMATS])
+
+# =============================================================================
+#  Polars 版本的清理與特徵工程 (與 clean_and_enrich_data 的結果相同)
+# =============================================================================
+
+def _clean_and_enrich(pl, lf):
+    lf = lf.with_columns(
+        # 站名清理 (空值維持空值，與 pandas 的 str 型態相同)
+        *[pl.col(col).str.replace_all(STOP_NAME_PATTERN, '') for col in ['上車站名', '下車站名']],
+        _parse_time(pl, '上車時間'),
+        _parse_time(pl, '下車時間'),
+        pl.col('消費扣款').str.strip_chars().cast(pl.Float64, strict=False),
+    ).filter(pl.col('上車時間').is_not_null())
+
+    # 標記不完整旅次：電子票證中沒有下車時間或下車站名無效者
+    is_eticket = pl.col('持卡身分') != '非電子票證'
+    no_alighting = pl.col('下車時間').is_null() | pl.col('下車站名').is_null() | \
+        pl.col('下車站名').str.to_lowercase().is_in(['', '0', 'nan', '未提供'])
+    lf = lf.with_columns((~(is_eticket & no_alighting)).alias('旅次是否完整'))
+
+    def seconds(col):
+        return (pl.col(col).dt.hour().cast(pl.Int32) * 3600 + pl.col(col).dt.minute().cast(pl.Int32) * 60
+                + pl.col(col).dt.second().cast(pl.Int32)).fill_null(-1).cast(pl.Int32)
+
+    def weekday(col):
+        # Polars 的星期一為 1，pandas 的 dayofweek 星期一為 0
+        return (pl.col(col).dt.weekday().cast(pl.Int8) - 1).fill_null(-1).cast(pl.Int8)
+
+    # 這裡只算到秒；Polars 除以常數時會改乘倒數，換算為分鐘留到 _to_pandas，才能與 pandas 的浮點數完全相同
+    duration = (pl.col('下車時間') - pl.col('上車時間')).dt.total_microseconds() / 1_000_000
+    return lf.with_columns(
+        pl.col('上車時間').dt.month().cast(pl.Int32).alias('上車月份'),
+        seconds('上車時間').alias('上車秒數'),
+        weekday('上車時間').alias('上車星期'),
+        seconds('下車時間').alias('下車秒數'),
+        weekday('下車時間').alias('下車星期'),
+        pl.col('上車時間').dt.hour().cast(pl.Int32).alias('上車小時'),
+        pl.when(pl.col('上車時間').dt.weekday() >= 6).then(pl.lit('假日')).otherwise(pl.lit('平日')).alias('日期類型'),
+        pl.when(pl.col('旅次是否完整')).then(duration).otherwise(0.0).fill_null(0.0).alias('旅次時長(秒)'),
+    )
+
+
+def _collect(lf):
+    """ 執行 LazyFrame (依 config.POLARS_STREAMING 決定是否使用串流引擎)。 """
+    if not config.POLARS_STREAMING:
+        return lf.collect()
+    try:
+        return lf.collect(engine='streaming')
+    except TypeError:
+        return lf.collect(streaming=True)
+
+
+def _to_pandas(df):
+    """ 轉為 pandas DataFrame (逐欄轉成 numpy，不需要 pyarrow)；型態與 pandas 後端相同。 """
+    frame = pd.DataFrame({col: df[col].to_numpy() for col in df.columns})
+    frame = frame.rename(columns={'旅次時長(秒)': '旅次時長(分)'})
+    frame['旅次時長(分)'] = frame['旅次時長(分)'] / 60
+    # pandas 讀檔時全為整數的欄位 (路線代碼、金額) 會推斷為 int64，有空值、小數或文字時才維持原樣
+    for col in ['路線', '消費扣款']:
+        values = pd.to_numeric(frame[col], errors='coerce')
+        if values.notna().all() and (values % 1 == 0).all():
+            frame[col] = values.astype(np.int64)
+    return frame
+
+
+def load_with_polars(files, target_routes=None):
+    """
+    以 Polars LazyFrame 讀取、篩選、清理並建立衍生欄位 (對應 pandas 後端的讀檔迴圈與 clean_and_enrich_data)。
+
+    Args:
+        files (list): 原始 CSV 檔案。
+        target_routes (list, optional): 只保留的路線 (公路客運的 HIGHWAY_BUS_TARGET_ROUTES)。
+
+    Returns:
+        pd.DataFrame or None: 清理後的資料；沒有任何有效資料時回傳 None。
+    """
+    import polars as pl
+
+    frames = []
+    for file in files:
+        print(f"正在掃描檔案: {os.path.basename(file)}")
+        try:
+            lf, columns = _scan_file(pl, file)
+            if '卡號' in columns:
+                print("    - 偵測到 [電子票證] 格式。")
+                lf = _process_eticket(pl, lf)
+            else:
+                print("    - 偵測到 [非電子票證] 格式。")
+                lf = _process_non_eticket(pl, lf, columns)
+            if target_routes:
+                lf = lf.filter(pl.col('路線').is_in([str(route) for route in target_routes]))
+            frames.append(lf)
+        except Exception as e:
+            print(f"  - 無法讀取檔案 {os.path.basename(file)}，錯誤訊息: {e}")
+
+    if not frames:
+        print("\n處理完成，但沒有產生任何有效資料。")
+        return None
+
+    print("\n開始以 Polars 執行讀取、清理與特徵工程...")
+    df = _to_pandas(_collect(_clean_and_enrich(pl, pl.concat(frames, how='vertical'))))
+    if df.empty:
+        print("\n處理完成，但沒有產生任何有效資料。")
+        return None
+
+    # 下車站推估需要依卡號串接前後旅次，沿用 pandas 版本 (只補下車站名，不影響其他衍生欄位)
+    if config.INFER_ALIGHTING_STOPS:
+        print("  - 推估不完整旅次的下車站...")
+        df = infer_alighting_stops(df)
+    print("資料清理與特徵工程完成。")
+    return df
+
+# =============================================================================
+#  後端比較
+# =============================================================================
+
+def compare_outputs(left, right, columns):
+    """
+    比較兩個後端的輸出 (依欄位排序後逐欄比較)。
+
+    Returns:
+        pd.DataFrame: 各欄位的型態與不一致的筆數。
+    """
+    # 以輸出到 CSV 時的文字比較 (兩個後端的時間精度或字串型態可能不同，但寫出的內容應相同)
+    as_text = {name: frame[columns].astype(str).sort_values(columns, ignore_index=True)
+               for name, frame in [('left', left), ('right', right)]}
+    rows = []
+    for col in columns:
+        a, b = as_text['left'][col], as_text['right'][col]
+        mismatched = int((~((a == b) | (a.isna() & b.isna()))).sum()) if len(a) == len(b) else max(len(a), len(b))
+        rows.append((col, str(left[col].dtype), str(right[col].dtype), mismatched))
+    return pd.DataFrame(rows, columns=['欄位', 'pandas 型態', 'polars 型態', '不一致筆數'])
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    sys.path.append(config.BUS_CODE_DIR)
+    from data_loader_市區公車 import load_with_pandas
+
+    raw_files = glob.glob(os.path.join(config.BUS_RAW_DATA_DIR, '*.csv'))
+    if not raw_files:
+        print(f"錯誤：在 '{config.BUS_RAW_DATA_DIR}' 資料夾中找不到任何 .csv 檔案。")
+        sys.exit(1)
+    if resolve_backend('polars') != 'polars':
+        sys.exit(0)
+
+    start = time.perf_counter()
+    pandas_df = load_with_pandas(raw_files)
+    pandas_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    polars_df = load_with_polars(raw_files)
+    polars_seconds = time.perf_counter() - start
+
+    print(f"\n--- 後端比較 (市區公車，{len(raw_files)} 個檔案) ---")
+    print(f"pandas: {pandas_seconds:.1f} 秒，{len(pandas_df)} 筆")
+    print(f"polars: {polars_seconds:.1f} 秒，{len(polars_df)} 筆 (串流引擎: {config.POLARS_STREAMING})")
+    shared = [col for col in pandas_df.columns if col in polars_df.columns]
+    print(compare_outputs(pandas_df, polars_df, shared).to_string(index=False))
@@ -0,0 +1,64 @@
+# 檔名: code/od_utils.py
+# 功能: 以整數編碼處理起訖站 (OD) 配對的共用工具。
+# 說明: 原本各腳本是先將「上車站名 + ' -> ' + 下車站名」逐筆串成字串再 value_counts，
+#       每一筆旅次都會產生一個新的字串。這裡改為先把站名編成整數代碼，
+#       再將起訖代碼合併成單一 int64 鍵值 (起站代碼 × 站數 + 迄站代碼) 進行計數，
+#       只有最後要顯示的前 N 名才會轉回文字標籤。
+import pandas as pd
+import numpy as np
+
+
+def encode_od(origin, destination, dropna=True):
+    """
+    將起訖站欄位編碼為單一 int64 OD 鍵值。
+
+    Args:
+        origin (pd.Series): 起站名稱。
+        destination (pd.Series): 迄站名稱。
+        dropna (bool): 為 True 時，任一端為空值的旅次鍵值設為 -1 (不列入計數)；
+                       為 False 時，空值視為一個獨立的站名。
+
+    Returns:
+        tuple: (keys, stations)。keys 為 int64 陣列，stations 為代碼對應的站名 Index。
+    """
+    codes, stations = pd.factorize(pd.concat([origin, destination], ignore_index=True),
+                                   use_na_sentinel=dropna)
+    n_rows = len(origin)
+    n_stations = max(len(stations), 1)
+    origin_codes = codes[:n_rows].astype(np.int64)
+    destination_codes = codes[n_rows:].astype(np.int64)
+    keys = origin_codes * n_stations + destination_codes
+    if dropna:
+        keys[(origin_codes < 0) | (destination_codes < 0)] = -1
+    return keys, stations
+
+
+def decode_od(keys, stations, sep=' -> '):
+    """ 將 OD 鍵值轉回「起站{sep}迄站」文字標籤 (只應對少量鍵值呼叫)。 """
+    n_stations = max(len(stations), 1)
+    return [f"{stations[k // n_stations]}{sep}{stations[k % n_stations]}" for k in np.asarray(keys, dtype=np.int64)]
+
+
+def count_od_pairs(origin, destination, dropna=True):
+    """
+    計算每個 OD 鍵值的出現次數 (由多到少排序)。
+
+    Returns:
+        tuple: (counts, stations)。counts 的索引為 OD 鍵值。
+    """
+    keys, stations = encode_od(origin, destination, dropna=dropna)
+    counts = pd.Series(keys[keys >= 0]).value_counts()
+    return counts, stations
+
+
+def top_od_pairs(origin, destination, top_n=10, sep=' -> ', dropna=True):
+    """
+    取得搭乘次數最多的前 N 個 OD，並只為這 N 個 OD 產生文字標籤。
+
+    Returns:
+        pd.Series: 索引為 OD 標籤、值為搭乘次數，格式與 value_counts() 的結果相同。
+    """
+    counts, stations = count_od_pairs(origin, destination, dropna=dropna)
+    top = counts.head(top_n)
+    labels = pd.Index(decode_od(top.index, stations, sep=sep), name='OD')
+    return pd.Series(top.values, index=labels, name='count')
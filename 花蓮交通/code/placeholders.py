@@ -0,0 +1,40 @@
+# 檔名: code/placeholders.py
+# 功能: data_loader 在統一資料中填入的佔位值 (共用清單與判斷函式)。
+# 說明: 非電子票證的旅次沒有卡號，data_loader 會在卡號欄位填入 '非電子票證' 或 'N/A' 等佔位值；
+#       讀取時缺值也可能變成 '' 或 'nan'。這些值不代表任何一位乘客，以卡號分組、計數或串接時都必須排除，
+#       各模組統一由這裡判斷，避免各自維護不同的清單。
+
+# 無法識別乘客的卡號佔位值
+NON_CARD_VALUES = ['非電子票證', '無卡號', 'N/A', '', 'nan', '0']
+
+# 無效的站名 (與 data_loader 判斷不完整旅次的條件相同，比較時不分大小寫)
+INVALID_STOP_NAMES = ['', '0', 'nan', '未提供']
+
+# 不代表實際站點的站名：無效站名，加上非電子票證旅次在站名欄位填入的佔位值
+NON_STOP_VALUES = ['非電子票證'] + INVALID_STOP_NAMES
+
+
+def has_card(cards):
+    """
+    判斷每一筆卡號是否代表一張實際的卡片 (非缺值且不是佔位值)。
+
+    Args:
+        cards (pd.Series): 卡號欄位。
+
+    Returns:
+        pd.Series: bool，True 表示為實際的卡號。
+    """
+    return cards.notna() & ~cards.astype(str).str.strip().isin(NON_CARD_VALUES)
+
+
+def has_stop(stops):
+    """
+    判斷每一筆站名是否為實際的站點 (非缺值且不在 NON_STOP_VALUES 中)。
+
+    Args:
+        stops (pd.Series): 上車站名或下車站名欄位。
+
+    Returns:
+        pd.Series: bool，True 表示為有效的站名。
+    """
+    return stops.notna() & ~stops.astype(str).str.strip().str.lower().isin(NON_STOP_VALUES)
@@ -0,0 +1,277 @@
+# 檔名: code/preview_sample.py
+# 功能: 分層抽樣的快速預覽模式 (以樣本估計運量等彙總值，並附上信賴區間)。
+# 說明: config.TEST_MODE 只讀取每個檔案的前幾列，樣本集中在月初，估計值有偏誤。
+#       這裡在 data_loader 整合資料時，依 (路線, 月份, 日期類型) 分層，
+#       每層以 bottom-k 抽樣保留優先值最小的 k 筆 (優先值為隨機均勻數，等同每層的簡單隨機抽樣)，
+#       並記錄每層的母體筆數。bottom-k 樣本可以合併：各分塊 / 各分割區各自取前 k 小後再取一次前 k 小即可。
+#
+#       預覽時以分層估計量放大樣本：
+#         總數估計 Ŷ = Σ_h (N_h / n_h) · Σ_i y_hi
+#         變異數   V(Ŷ) = Σ_h N_h² · (1 − n_h / N_h) · s_h² / n_h
+#       平均值以比率估計 (總和 ÷ 筆數)，變異數以線性化近似。信賴區間為估計值 ± z · 標準誤。
+#
+# 儲存格式 (每個運具一個資料夾):
+#   sample.csv : 樣本資料 (原欄位 + 月份 + _優先值)
+#   strata.csv : 分層欄位 + 母體筆數
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from quantile_sketch import valid_duration_mask
+
+# 各運具的分層欄位 (台鐵沒有路線，以起點車站代替)
+BUS_STRATA = ['路線', '月份', '日期類型']
+TRA_STRATA = ['起點', '月份', '日期類型']
+
+# 預覽模式的標準彙總：{報表名稱: (分組欄位, 數值欄位, 彙總方式)}
+BUS_PREVIEW_REPORTS = {
+    '每月運量': (['月份'], None, 'count'),
+    '路線運量': (['路線'], None, 'count'),
+    '每小時運量': (['上車小時', '日期類型'], None, 'count'),
+    '持卡身分運量': (['持卡身分'], None, 'count'),
+    '路線平均旅次時長': (['路線'], '旅次時長(分)', 'mean'),
+    '路線票收': (['路線'], '消費扣款', 'sum'),
+}
+TRA_PREVIEW_REPORTS = {
+    '每月運量': (['月份'], '人次', 'sum'),
+    '車站進站量': (['起點'], '人次', 'sum'),
+    '每小時運量': (['時段', '日期類型'], '人次', 'sum'),
+    '票證分類運量': (['票證分類'], '人次', 'sum'),
+}
+
+# 95% 信賴區間的 z 值
+Z_95 = 1.96
+
+# =============================================================================
+#  抽樣
+# =============================================================================
+
+def sample_partition(df, strata_cols, k=None, seed=None, partition_info=None):
+    """
+    對一塊資料做分層 bottom-k 抽樣。
+
+    Args:
+        df (pd.DataFrame): 一塊資料 (pandas DataFrame 或 Dask 的一個分割區)，需含 strata_cols。
+        strata_cols (list): 分層欄位。
+        k (int): 每層最多保留的筆數，預設為 config.PREVIEW_SAMPLE_PER_STRATUM。
+        seed (int): 亂數種子，預設為 config.PREVIEW_SAMPLE_SEED。
+        partition_info (dict): Dask map_partitions 傳入的分割區資訊，讓每個分割區使用不同的亂數序列。
+
+    Returns:
+        pd.DataFrame: 抽出的資料列，另加 '_優先值' 欄位。
+    """
+    k = k or config.PREVIEW_SAMPLE_PER_STRATUM
+    seed = config.PREVIEW_SAMPLE_SEED if seed is None else seed
+    partition = partition_info['number'] if partition_info else 0
+    priority = np.random.default_rng([seed, partition]).random(len(df))
+
+    # 只對分層欄位與優先值排序，選出每層前 k 小的列後再取出完整資料
+    keys = df[strata_cols].reset_index(drop=True).assign(_優先值=priority)
+    keys = keys.sort_values('_優先值', kind='stable')
+    chosen = np.sort(keys[keys.groupby(strata_cols, observed=True).cumcount() < k].index.to_numpy())
+    return df.iloc[chosen].assign(_優先值=priority[chosen])
+
+
+def merge_samples(samples, strata_cols, k=None):
+    """ 合併多個 bottom-k 樣本：每層重新取優先值最小的 k 筆。 """
+    k = k or config.PREVIEW_SAMPLE_PER_STRATUM
+    merged = pd.concat(samples, ignore_index=True).sort_values('_優先值', kind='stable')
+    merged = merged[merged.groupby(strata_cols, observed=True).cumcount() < k]
+    return merged.sort_values(strata_cols + ['_優先值'], ignore_index=True)
+
+
+def build_stratified_sample(df, strata_cols, k=None, seed=None):
+    """
+    建立分層樣本與各層母體筆數 (pandas 或 Dask DataFrame 皆可)。
+
+    Returns:
+        tuple: (樣本 DataFrame, 各層母體筆數 DataFrame (分層欄位 + 母體筆數))
+    """
+    if isinstance(df, pd.DataFrame):
+        sample = merge_samples([sample_partition(df, strata_cols, k, seed)], strata_cols, k)
+        population = df.groupby(strata_cols, observed=True).size()
+    else:
+        parts = df.map_partitions(sample_partition, strata_cols, k, seed).compute()
+        sample = merge_samples([parts], strata_cols, k)
+        population = df.groupby(strata_cols, observed=True).size().compute()
+    return sample, population.rename('母體筆數').reset_index()
+
+# =============================================================================
+#  儲存與讀取
+# =============================================================================
+
+def save_sample(store_dir, sample, population):
+    """ 將樣本與各層母體筆數寫入 store_dir (會覆蓋舊檔)。 """
+    os.makedirs(store_dir, exist_ok=True)
+    sample.to_csv(os.path.join(store_dir, 'sample.csv'), index=False, encoding='utf-8-sig')
+    population.to_csv(os.path.join(store_dir, 'strata.csv'), index=False, encoding='utf-8-sig')
+    print(f"預覽樣本已儲存至: {store_dir} (共 {len(sample)} 筆樣本、{len(population)} 層，"
+          f"代表 {int(population['母體筆數'].sum())} 筆資料)")
+
+
+def load_sample(store_dir, dtype=None):
+    """
+    讀取 save_sample 儲存的樣本與母體筆數。
+
+    Returns:
+        tuple: (sample, population)；找不到檔案時回傳 (None, None)。
+    """
+    dtype = dtype or {'路線': str, '月份': str, '卡號': str, '起點': str}
+    try:
+        sample = pd.read_csv(os.path.join(store_dir, 'sample.csv'), dtype=dtype, low_memory=False)
+        population = pd.read_csv(os.path.join(store_dir, 'strata.csv'), dtype=dtype)
+    except FileNotFoundError:
+        print(f"錯誤：找不到預覽樣本 '{store_dir}'。請先執行對應的 data_loader。")
+        return None, None
+    return sample, population
+
+# =============================================================================
+#  估計
+# =============================================================================
+
+def estimate(sample, population, strata_cols, group_cols, value_col=None, agg='count', mask=None, z=Z_95):
+    """
+    以分層樣本估計各組的筆數、總和或平均值，並附上標準誤與信賴區間。
+
+    Args:
+        sample, population: load_sample 的回傳值。
+        strata_cols (list): 抽樣時使用的分層欄位。
+        group_cols (list): 要估計的分組欄位 (可以與分層欄位不同)。
+        value_col (str, optional): agg 為 'sum' 或 'mean' 時的數值欄位。
+        agg (str): 'count'、'sum' 或 'mean'。
+        mask (pd.Series, optional): 只估計符合條件的資料 (例如排除異常值)；
+                                    仍以完整樣本計算每層的樣本數，估計量維持不偏。
+
+    Returns:
+        pd.DataFrame: 索引為 group_cols，欄位為 估計值, 標準誤, 下限, 上限, 樣本數。
+    """
+    strata = population.merge(sample.groupby(strata_cols, observed=True).size().rename('樣本筆數').reset_index(),
+                              on=strata_cols)
+    rows = sample if mask is None else sample[mask]
+    if agg == 'count':
+        y = pd.Series(1.0, index=rows.index)
+    else:
+        y = pd.to_numeric(rows[value_col], errors='coerce')
+        rows, y = rows[y.notna()], y[y.notna()]
+
+    # 每個 (層, 組) 的 Σy、Σy² 與筆數 (分組欄位可以與分層欄位重疊)
+    cell_keys = list(dict.fromkeys(strata_cols + group_cols))
+    cells = rows[cell_keys].assign(y=y, y2=y * y, c=1.0)
+    cells = cells.groupby(cell_keys, observed=True)[['y', 'y2', 'c']].sum().reset_index()
+    cells = cells.merge(strata, on=strata_cols)
+    n, big_n = cells['樣本筆數'].to_numpy(dtype=np.float64), cells['母體筆數'].to_numpy(dtype=np.float64)
+    weight = big_n / n
+    fpc_factor = np.where(n > 1, big_n * big_n * (1 - n / big_n) / (n * np.maximum(n - 1, 1)), 0.0)
+
+    def _total_and_variance(s1, s2):
+        # 層內變異數以 n_h 筆資料計算 (不屬於這一組的資料 y = 0)
+        total = (weight * s1)
+        variance = fpc_factor * (s2 - s1 * s1 / n)
+        grouped = pd.DataFrame({'total': total, 'variance': variance}).groupby(
+            [cells[c] for c in group_cols], observed=True).sum()
+        return grouped['total'], grouped['variance']
+
+    sample_size = cells.groupby(group_cols, observed=True)['c'].sum()
+    if agg in ('count', 'sum'):
+        value, variance = _total_and_variance(cells['y'].to_numpy(), cells['y2'].to_numpy())
+    else:
+        count, _ = _total_and_variance(cells['c'].to_numpy(), cells['c'].to_numpy())
+        total, _ = _total_and_variance(cells['y'].to_numpy(), cells['y2'].to_numpy())
+        value = total / count
+        # 線性化：z = y − R·x，Σz 與 Σz² 由 Σy、Σy²、筆數換算
+        ratio = value.reindex(pd.MultiIndex.from_frame(cells[group_cols]) if len(group_cols) > 1
+                              else pd.Index(cells[group_cols[0]])).to_numpy()
+        s1 = cells['y'].to_numpy() - ratio * cells['c'].to_numpy()
+        s2 = cells['y2'].to_numpy() - 2 * ratio * cells['y'].to_numpy() + ratio * ratio * cells['c'].to_numpy()
+        _, z_variance = _total_and_variance(s1, s2)
+        variance = z_variance / (count * count)
+
+    std_error = np.sqrt(variance.clip(lower=0))
+    result = pd.DataFrame({'估計值': value, '標準誤': std_error,
+                           '下限': value - z * std_error, '上限': value + z * std_error,
+                           '樣本數': sample_size.astype(int)})
+    result.index.names = group_cols
+    return result
+
+# =============================================================================
+#  預覽報表
+# =============================================================================
+
+def _plot_estimate(result, title, chart_path, top_n=20):
+    """ 單一分組欄位畫長條圖 (含誤差線)；兩個分組欄位時以第二欄分線，並以陰影表示信賴區間。 """
+    plt.figure(figsize=(12, 7))
+    if result.index.nlevels == 1:
+        data = result.sort_values('估計值', ascending=False).head(top_n).iloc[::-1]
+        plt.barh(data.index.astype(str), data['估計值'], xerr=Z_95 * data['標準誤'], color='steelblue',
+                 ecolor='black', capsize=3)
+        plt.xlabel('估計值 (95% 信賴區間)', fontsize=12)
+    else:
+        for series_name, part in result.groupby(level=1, observed=True):
+            part = part.droplevel(1).sort_index()
+            plt.plot(part.index, part['估計值'], marker='o', label=str(series_name))
+            plt.fill_between(part.index, part['下限'], part['上限'], alpha=0.2)
+        plt.ylabel('估計值 (95% 信賴區間)', fontsize=12)
+        plt.legend()
+    plt.title(f'[預覽] {title}', fontsize=16, fontweight='bold')
+    plt.tight_layout()
+    plt.savefig(chart_path)
+    plt.close()
+
+
+def run_preview(store_dir, strata_cols, reports, output_dir, mask_builders=None):
+    """
+    由預覽樣本產生標準彙總的估計值、信賴區間與圖表 (只讀取樣本，數秒內完成)。
+
+    Args:
+        store_dir (str): save_sample 的儲存資料夾。
+        strata_cols (list): 抽樣時使用的分層欄位。
+        reports (dict): {報表名稱: (分組欄位, 數值欄位, 彙總方式)}。
+        output_dir (str): 報表與圖表的輸出資料夾。
+        mask_builders (dict, optional): {報表名稱: 由樣本產生篩選條件的函式}。
+
+    Returns:
+        dict or None: {報表名稱: estimate() 的結果}。
+    """
+    sample, population = load_sample(store_dir)
+    if sample is None:
+        return None
+    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    os.makedirs(output_dir, exist_ok=True)
+    mask_builders = mask_builders or {}
+
+    print(f"--- [預覽模式] 以 {len(sample)} 筆樣本估計 {int(population['母體筆數'].sum())} 筆資料 ---")
+    results = {}
+    for name, (group_cols, value_col, agg) in reports.items():
+        mask = mask_builders[name](sample) if name in mask_builders else None
+        result = estimate(sample, population, strata_cols, group_cols, value_col, agg, mask)
+        results[name] = result
+        print(f"\n[{name}] (95% 信賴區間)")
+        print(result.round(2).head(20).to_string())
+        result.round(4).to_csv(os.path.join(output_dir, f'preview_{name}.csv'), encoding='utf-8-sig')
+        _plot_estimate(result, name, os.path.join(output_dir, f'preview_{name}.png'))
+    print(f"\n預覽報表與圖表已儲存至: {output_dir}")
+    return results
+
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    # 與 main_analyze 的平均旅次時長、分位數使用同一個有效旅次母體 (quantile_sketch.valid_duration_mask)
+    bus_masks = {'路線平均旅次時長': valid_duration_mask}
+    run_preview(config.BUS_PREVIEW_SAMPLE_DIR, BUS_STRATA, BUS_PREVIEW_REPORTS,
+                os.path.join(config.PREVIEW_OUTPUT_DIR, '市區公車'), bus_masks)
+    run_preview(config.HIGHWAY_BUS_PREVIEW_SAMPLE_DIR, BUS_STRATA, BUS_PREVIEW_REPORTS,
+                os.path.join(config.PREVIEW_OUTPUT_DIR, '公路客運'), bus_masks)
+    run_preview(config.TRA_PREVIEW_SAMPLE_DIR, TRA_STRATA, TRA_PREVIEW_REPORTS,
+                os.path.join(config.PREVIEW_OUTPUT_DIR, '台鐵'))
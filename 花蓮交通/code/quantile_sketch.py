@@ -0,0 +1,227 @@
+# 檔名: code/quantile_sketch.py
+# 功能: 旅次時間分位數 (p50 / p90 / p95) 的可合併摘要。
+# 說明: 中位數與百分位數需要先排序，在 Dask 上對所有 OD 組合計算非常昂貴，所以報表原本只列平均值。
+#       這裡採用 DDSketch 的對數分桶：數值 x 落在桶 ceil(log_γ(x))，γ = (1 + α) / (1 - α)，
+#       以桶中點回推的分位數與真實值的相對誤差不超過 α (config.TRAVEL_TIME_SKETCH_ACCURACY)。
+#       每個 sketch 只是「項目 × 桶」的計數表，因此：
+#         - 各分割區 / 各分塊各自 groupby 計數後相加即為合併，不需要排序整份資料；
+#         - 以月份作為鍵值之一儲存，之後任意月份範圍都可以直接相加後再取分位數。
+#       (原始需求為 t-digest 或 KLL；對數分桶同樣可合併且誤差有保證，計數表又能直接用 pandas 彙整與存成 CSV。)
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+# 小於等於 0 的數值集中放在這個桶 (回推值為 0)
+ZERO_BUCKET = np.iinfo(np.int32).min
+
+# 報表輸出的分位數
+REPORT_QUANTILES = [0.5, 0.9, 0.95]
+
+# 公車 data_loader 輸出的旅次時間 sketch：{檔名: 項目欄位} (另以「月份」為鍵值)
+BUS_TRAVEL_TIME_SKETCHES = {
+    'route': ['路線'],
+    'od': ['上車站名', '下車站名'],
+}
+
+# 公車旅次時長的有效範圍 (分鐘)；0 分鐘為非電子票證或不完整旅次的填補值
+BUS_MAX_DURATION_MINUTES = 180
+
+# =============================================================================
+#  分桶
+# =============================================================================
+
+def _log_gamma(accuracy):
+    return np.log((1 + accuracy) / (1 - accuracy))
+
+
+def bucket_index(values, accuracy=None):
+    """ 將數值轉為桶編號 ceil(log_γ(x))；小於等於 0 的數值放入 ZERO_BUCKET。 """
+    accuracy = accuracy or config.TRAVEL_TIME_SKETCH_ACCURACY
+    values = np.asarray(values, dtype=np.float64)
+    positive = values > 0
+    index = np.full(len(values), ZERO_BUCKET, dtype=np.int64)
+    index[positive] = np.ceil(np.log(values[positive]) / _log_gamma(accuracy))
+    return index
+
+
+def bucket_value(index, accuracy=None):
+    """ 桶編號回推的代表值 2γ^i / (γ + 1)，與桶內任何數值的相對誤差都不超過 accuracy。 """
+    accuracy = accuracy or config.TRAVEL_TIME_SKETCH_ACCURACY
+    gamma = (1 + accuracy) / (1 - accuracy)
+    index = np.asarray(index, dtype=np.int64)
+    return np.where(index == ZERO_BUCKET, 0.0, 2 * np.exp(index * _log_gamma(accuracy)) / (gamma + 1))
+
+# =============================================================================
+#  建立與合併
+# =============================================================================
+
+def build_quantile_sketch(df, key_cols, value_col, accuracy=None):
+    """
+    將一塊資料彙整為「項目 × 桶」的計數表。
+
+    Args:
+        df (pd.DataFrame): 一塊資料 (例如 read_csv 的一個 chunk 或 Dask 的一個分割區)。
+        key_cols (list): 項目欄位，例如 ['月份', '起點', '迄點']。
+        value_col (str): 數值欄位，例如 '旅次時間(分)'；缺值會被略過。
+
+    Returns:
+        pd.DataFrame: 欄位為 key_cols + ['桶', '次數']。
+    """
+    df = df[df[value_col].notna()]
+    frame = df[key_cols].assign(桶=bucket_index(df[value_col].to_numpy(), accuracy))
+    return frame.groupby(key_cols + ['桶'], observed=True, sort=False).size().reset_index(name='次數')
+
+
+def dask_quantile_sketch(ddf, key_cols, value_col, accuracy=None):
+    """ 對 Dask DataFrame 的每個分割區各自建立計數表後合併 (傳入 pandas DataFrame 時直接彙整)。 """
+    if isinstance(ddf, pd.DataFrame):
+        return build_quantile_sketch(ddf, key_cols, value_col, accuracy)
+    parts = ddf.map_partitions(build_quantile_sketch, key_cols, value_col, accuracy).compute()
+    return merge_quantile_sketches([parts], key_cols)
+
+
+def merge_quantile_sketches(sketches, key_cols):
+    """
+    合併多個計數表；key_cols 可以只取原本鍵值的一部分 (例如省略「月份」即為跨月份合併)。
+    """
+    frame = pd.concat(sketches, ignore_index=True)
+    return frame.groupby(key_cols + ['桶'], observed=True)['次數'].sum().reset_index()
+
+# =============================================================================
+#  查詢
+# =============================================================================
+
+def quantiles(sketch, key_cols, qs=None, accuracy=None):
+    """
+    由計數表計算各項目的分位數。
+
+    Args:
+        sketch (pd.DataFrame): build_quantile_sketch 或 merge_quantile_sketches 的結果。
+        key_cols (list): 要分組的項目欄位 (未列出的鍵值欄位會先合併)。
+        qs (list): 分位數，預設為 REPORT_QUANTILES。
+
+    Returns:
+        pd.DataFrame: 索引為項目，欄位為 樣本數 與 p50、p90、p95 等 (單位與原數值相同)。
+    """
+    qs = qs or REPORT_QUANTILES
+    merged = merge_quantile_sketches([sketch], key_cols).sort_values(key_cols + ['桶'], ignore_index=True)
+    groups = merged.groupby(key_cols, observed=True, sort=False)
+    cumulative = groups['次數'].cumsum().to_numpy()
+    total = groups['次數'].transform('sum').to_numpy()
+
+    result = pd.DataFrame({'樣本數': groups['次數'].sum()})
+    for q in qs:
+        # 第一個累積次數超過排名 q·(n−1) 的桶 (與 DDSketch 的定義相同)
+        reached = merged[cumulative > q * (total - 1)]
+        first = reached.groupby(key_cols, observed=True, sort=False)['桶'].first()
+        result[f'p{round(q * 100)}'] = pd.Series(bucket_value(first.to_numpy(), accuracy), index=first.index)
+    return result
+
+# =============================================================================
+#  儲存與讀取
+# =============================================================================
+
+def save_quantile_sketch(sketch, path, accuracy=None):
+    """ 將計數表存為 CSV；建立時使用的精度存在 _accuracy 欄位。 """
+    frame = sketch.copy()
+    frame['_accuracy'] = accuracy or config.TRAVEL_TIME_SKETCH_ACCURACY
+    frame.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def load_quantile_sketch(path, accuracy=None):
+    """ 讀取 save_quantile_sketch 儲存的計數表；找不到檔案或精度與設定不同時回傳 None。 """
+    accuracy = accuracy or config.TRAVEL_TIME_SKETCH_ACCURACY
+    try:
+        frame = pd.read_csv(path, dtype={'路線': str, '上車站名': str, '下車站名': str, '月份': str})
+    except FileNotFoundError:
+        print(f"警告：找不到旅次時間 sketch '{path}'。")
+        return None
+    if not frame.empty and not np.isclose(frame['_accuracy'].iloc[0], accuracy):
+        print(f"警告：'{path}' 的精度 ({frame['_accuracy'].iloc[0]}) 與設定 ({accuracy}) 不同，請重新執行 data_loader。")
+        return None
+    return frame.drop(columns='_accuracy')
+
+
+def valid_duration_mask(df):
+    """ 旅次時長在 (0, BUS_MAX_DURATION_MINUTES] 分鐘之間的旅次 (排除 0 分鐘的填補值與異常值)。 """
+    duration = pd.to_numeric(df['旅次時長(分)'], errors='coerce')
+    return (duration > 0) & (duration <= BUS_MAX_DURATION_MINUTES)
+
+
+def valid_durations(df):
+    """ 只保留 valid_duration_mask 的旅次，並將旅次時長轉為數值。 """
+    valid = valid_duration_mask(df)
+    return df[valid].assign(**{'旅次時長(分)': pd.to_numeric(df.loc[valid, '旅次時長(分)'], errors='coerce')})
+
+
+def duration_summary(df, key_cols):
+    """
+    由同一份資料、同一個有效旅次母體 (valid_durations) 計算各項目的平均旅次時長與 p50 / p90 / p95，
+    避免平均值與分位數來自不同的母體或不同時間點的資料。
+
+    Returns:
+        pd.DataFrame: 索引為項目，欄位為 平均、樣本數 與 p50、p90、p95。
+    """
+    valid = valid_durations(df)
+    mean = valid.groupby(key_cols, observed=True)['旅次時長(分)'].mean().rename('平均')
+    return pd.concat([mean, quantiles(build_quantile_sketch(valid, key_cols, '旅次時長(分)'), key_cols)], axis=1)
+
+
+def save_travel_time_sketches(df, store_dir, chunk_size=1000000):
+    """
+    由公車 data_loader 的最終資料逐塊建立各路線、各 OD 的旅次時間 sketch (以月份為鍵值) 並存檔。
+    只使用旅次時長在 (0, BUS_MAX_DURATION_MINUTES] 分鐘之間的完整電子票證旅次。
+    """
+    sketches = {name: [] for name in BUS_TRAVEL_TIME_SKETCHES}
+    for start in range(0, len(df), chunk_size):
+        chunk = valid_durations(df.iloc[start:start + chunk_size])
+        chunk = chunk.assign(月份=pd.to_datetime(chunk['上車時間'], errors='coerce').dt.strftime('%Y-%m'))
+        for name, key_cols in BUS_TRAVEL_TIME_SKETCHES.items():
+            sketches[name].append(build_quantile_sketch(chunk, ['月份'] + key_cols, '旅次時長(分)'))
+
+    os.makedirs(store_dir, exist_ok=True)
+    for name, key_cols in BUS_TRAVEL_TIME_SKETCHES.items():
+        merged = merge_quantile_sketches(sketches[name], ['月份'] + key_cols)
+        save_quantile_sketch(merged, os.path.join(store_dir, f'{name}.csv'))
+    print(f"旅次時間分位數 sketch 已儲存至: {store_dir}")
+
+
+def travel_time_quantiles(store_dir, name, months=None, df=None):
+    """
+    讀取公車的旅次時間 sketch，合併指定月份後回傳各項目的 p50 / p90 / p95。
+    sketch 不存在時，若有提供 df 則由 df 直接建立。
+
+    Returns:
+        pd.DataFrame or None: quantiles() 的結果。
+    """
+    key_cols = BUS_TRAVEL_TIME_SKETCHES[name]
+    sketch = load_quantile_sketch(os.path.join(store_dir, f'{name}.csv'))
+    if sketch is None:
+        if df is None:
+            return None
+        print("  - 改由目前載入的資料建立旅次時間 sketch。")
+        valid = valid_durations(df)
+        sketch = build_quantile_sketch(
+            valid.assign(月份=pd.to_datetime(valid['上車時間'], errors='coerce').dt.strftime('%Y-%m')),
+            ['月份'] + key_cols, '旅次時長(分)')
+    if months is not None:
+        sketch = sketch[sketch['月份'].isin(months)]
+    return quantiles(sketch, key_cols)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    for store in [config.BUS_TRAVEL_TIME_SKETCH_DIR, config.HIGHWAY_BUS_TRAVEL_TIME_SKETCH_DIR]:
+        route_quantiles = travel_time_quantiles(store, 'route')
+        if route_quantiles is not None:
+            print(f"\n--- {store} 各路線旅次時間分位數 (分鐘) ---")
+            print(route_quantiles.sort_values('p90', ascending=False).round(1).to_string())
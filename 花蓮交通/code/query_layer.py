@@ -0,0 +1,290 @@
+# 檔名: code/query_layer.py
+# 功能: 以嵌入式 DuckDB 對統一資料提供 SQL 查詢層。
+# 說明: 各分析腳本原本各自以 pandas / Dask 撰寫 groupby，新的問題就要再寫一支腳本。
+#       這裡將市區公車、公路客運與台鐵的資料登錄為 DuckDB 的 view (bus / highway_bus / tra)，
+#       並把常用的彙總寫成帶參數的查詢函式 (熱門 OD、車站運量、各小時人次、縣市間流量、路線摘要)。
+#       DuckDB 為嵌入式資料庫 (不需伺服器)，以向量化、多執行緒執行，超過記憶體上限時會溢寫到
+#       SQL_TEMP_DIR，可直接處理全年資料。
+#       view 優先讀取叢集化儲存區 (clustered_store.py 輸出的 Parquet 或 CSV 列群組)，
+#       沒有儲存區時改讀 data_loader 輸出的統一資料檔。
+#       duckdb 為選用套件 (pip install duckdb)；未安裝時 connect() 會回傳 None，呼叫端改用原本的 pandas / Dask 計算。
+#
+# 使用方式:
+#   python query_layer.py                       # 列出各 view 的筆數與熱門 OD
+#   python query_layer.py "SELECT ... FROM bus" # 執行任意 SQL 並印出結果
+import pandas as pd
+import os
+import glob
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from placeholders import NON_CARD_VALUES, NON_STOP_VALUES
+
+# 各 view 的資料來源：(叢集化儲存區, 統一資料檔)
+DATASETS = {
+    'bus': (config.BUS_CLUSTERED_STORE_DIR, config.BUS_UNIFIED_DATA_FILE),
+    'highway_bus': (config.HIGHWAY_BUS_CLUSTERED_STORE_DIR, config.HIGHWAY_BUS_UNIFIED_DATA_FILE),
+    'tra': (config.TRA_CLUSTERED_STORE_DIR, config.TRA_UNIFIED_DATA_FILE),
+}
+
+# 各 view 在標準查詢中對應的欄位 (公車每一列為一人次，台鐵以「人次」欄位加權)
+_BUS_ROLES = {'origin': '上車站名', 'dest': '下車站名', 'time': '上車時間', 'weight': '1',
+              'day_type': '日期類型', 'route': '路線'}
+DATASET_ROLES = {
+    'bus': _BUS_ROLES,
+    'highway_bus': _BUS_ROLES,
+    'tra': {'origin': '起點', 'dest': '迄點', 'time': '進站時間', 'weight': '"人次"',
+            'day_type': '日期類型', 'route': None},
+}
+
+# =============================================================================
+#  連線與 view
+# =============================================================================
+
+def _quote_path(path):
+    return "'" + path.replace('\\', '/').replace("'", "''") + "'"
+
+
+def _source_sql(dataset):
+    """ 回傳讀取某個資料集的 DuckDB 表格函式；沒有任何資料時回傳 None。 """
+    store_dir, unified_file = DATASETS[dataset]
+    if glob.glob(os.path.join(store_dir, '月份=*', '*.parquet')):
+        return f"read_parquet({_quote_path(os.path.join(store_dir, '月份=*', '*.parquet'))}, union_by_name = true)"
+    if glob.glob(os.path.join(store_dir, '月份=*', '*.csv')):
+        return (f"read_csv({_quote_path(os.path.join(store_dir, '月份=*', '*.csv'))}, header = true, "
+                f"union_by_name = true)")
+    if os.path.exists(unified_file):
+        return f"read_csv({_quote_path(unified_file)}, header = true)"
+    return None
+
+
+def connect(datasets=None):
+    """
+    建立 DuckDB 連線並登錄資料集的 view。
+
+    Args:
+        datasets (list, optional): 要登錄的資料集 ('bus', 'highway_bus', 'tra')，預設為全部。
+
+    Returns:
+        duckdb.DuckDBPyConnection or None: 未安裝 duckdb 或沒有任何資料時回傳 None。
+    """
+    try:
+        import duckdb
+    except ImportError:
+        print("警告：未安裝 duckdb (pip install duckdb)，SQL 查詢層無法使用，將改用 pandas / Dask 計算。")
+        return None
+
+    con = duckdb.connect()
+    if config.SQL_THREADS:
+        con.execute(f"SET threads = {int(config.SQL_THREADS)}")
+    if config.SQL_MEMORY_LIMIT:
+        con.execute(f"SET memory_limit = '{config.SQL_MEMORY_LIMIT}'")
+    os.makedirs(config.SQL_TEMP_DIR, exist_ok=True)
+    con.execute(f"SET temp_directory = {_quote_path(config.SQL_TEMP_DIR)}")
+
+    registered = [dataset for dataset in datasets or list(DATASETS) if register_view(con, dataset)]
+    if not registered:
+        con.close()
+        return None
+    print(f"SQL 查詢層已登錄 view: {', '.join(registered)}")
+    return con
+
+
+def register_view(con, dataset):
+    """
+    (重新) 登錄單一資料集的 view；資料來源改變 (例如重新執行 data_loader 後多了叢集化儲存區) 時可再呼叫一次。
+
+    Returns:
+        bool: 是否成功登錄 (找不到資料時為 False)。
+    """
+    source = _source_sql(dataset)
+    if source is None:
+        print(f"警告：找不到 '{dataset}' 的資料，請先執行對應的 data_loader。")
+        return False
+    con.execute(f"CREATE OR REPLACE VIEW {dataset} AS SELECT * FROM {source}")
+    return True
+
+
+def sql(con, query, params=None):
+    """ 執行任意 SQL (可用 ? 作為參數)，回傳 pandas DataFrame。 """
+    return con.execute(query, params or []).df()
+
+# =============================================================================
+#  標準查詢
+# =============================================================================
+
+def _where(dataset, months=None, stations=None, day_type=None, stops=()):
+    """
+    組合標準查詢共用的篩選條件。
+
+    Args:
+        months (list): 月份 (YYYY-MM)。
+        stations (list): 起點與迄點都必須在此清單中 (與 main_analysis_台鐵 的區間篩選相同)。
+        day_type (str): '平日' 或 '假日'。
+        stops (tuple): 必須是實際站點的欄位角色 ('origin' / 'dest')；排除缺值與 '非電子票證' 等佔位值，
+            避免現金旅次的佔位站名被當成最熱門的站點或 OD。
+
+    Returns:
+        tuple: (WHERE 子句, 參數清單)
+    """
+    roles = DATASET_ROLES[dataset]
+    clauses, params = [], []
+    if months:
+        clauses.append(f"strftime(TRY_CAST({roles['time']} AS TIMESTAMP), '%Y-%m') IN "
+                       f"({', '.join('?' * len(months))})")
+        params += [str(m) for m in months]
+    if stations:
+        placeholders = ', '.join('?' * len(stations))
+        clauses.append(f"{roles['origin']} IN ({placeholders}) AND {roles['dest']} IN ({placeholders})")
+        params += [str(s) for s in stations] * 2
+    if day_type:
+        clauses.append(f"{roles['day_type']} = ?")
+        params.append(day_type)
+    for role in stops:
+        clauses.append(_is_real_value(roles[role], NON_STOP_VALUES))
+    return ('WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _weighted_sum(roles):
+    """ 人次加總；一律轉為 BIGINT，讓 DuckDB 與 pandas 備援回傳相同的整數型態 (而非 182.0)。 """
+    return f"CAST(SUM({roles['weight']}) AS BIGINT)"
+
+
+def _is_real_value(column, placeholders):
+    """ SQL 條件：column 不是缺值或佔位值 (轉為文字並忽略大小寫比較，CSV 推斷為數值欄位時同樣適用)。 """
+    literals = ', '.join("'" + value.lower().replace("'", "''") + "'" for value in placeholders)
+    return f"{column} IS NOT NULL AND lower(trim(CAST({column} AS VARCHAR))) NOT IN ({literals})"
+
+
+def _and(where, clause):
+    """ 在 _where 的結果後再加上一個條件。 """
+    return f"{where} AND {clause}" if where else f"WHERE {clause}"
+
+
+def top_od(con, dataset, n=20, months=None, stations=None, day_type=None, origin=None):
+    """ 人次最高的前 n 個 OD (欄位: 起點, 迄點, 人次)；指定 origin 時只計算由該站出發的旅次。 """
+    roles = DATASET_ROLES[dataset]
+    where, params = _where(dataset, months, stations, day_type, stops=('origin', 'dest'))
+    if origin is not None:
+        where = _and(where, f"{roles['origin']} = ?")
+        params.append(str(origin))
+    query = f"""
+        SELECT {roles['origin']} AS 起點, {roles['dest']} AS 迄點, {_weighted_sum(roles)} AS 人次
+        FROM {dataset} {where}
+        GROUP BY ALL
+        ORDER BY 人次 DESC LIMIT {int(n)}
+    """
+    return sql(con, query, params)
+
+
+def station_traffic(con, dataset, n=20, months=None, stations=None, day_type=None, station=None):
+    """
+    各車站的上車 (進站)、下車 (出站) 與合計人次，依合計取前 n 名 (欄位: 車站, 上車人次, 下車人次, 總人次)。
+    指定 station 時只回傳該站一列。上車與下車分別排除佔位站名，下車站未知的旅次仍計入上車人次。
+    """
+    roles = DATASET_ROLES[dataset]
+    where, params = _where(dataset, months, stations, day_type)
+    station_clause = ''
+    if station is not None:
+        station_clause = 'AND 車站 = ?'
+        params.append(str(station))
+    query = f"""
+        WITH trips AS (SELECT * FROM {dataset} {where}),
+        boarding AS (SELECT {roles['origin']} AS 車站, {_weighted_sum(roles)} AS 上車人次 FROM trips
+                     WHERE {_is_real_value(roles['origin'], NON_STOP_VALUES)} GROUP BY 1),
+        alighting AS (SELECT {roles['dest']} AS 車站, {_weighted_sum(roles)} AS 下車人次 FROM trips
+                      WHERE {_is_real_value(roles['dest'], NON_STOP_VALUES)} GROUP BY 1)
+        SELECT 車站, COALESCE(上車人次, 0) AS 上車人次, COALESCE(下車人次, 0) AS 下車人次,
+               COALESCE(上車人次, 0) + COALESCE(下車人次, 0) AS 總人次
+        FROM boarding FULL OUTER JOIN alighting USING (車站)
+        WHERE 車站 IS NOT NULL {station_clause}
+        ORDER BY 總人次 DESC LIMIT {int(n)}
+    """
+    return sql(con, query, params)
+
+
+def hourly_counts(con, dataset, station=None, months=None, day_type=None):
+    """
+    各小時 × 日期類型的上車 (進站) 人次；指定 station 時只計算該站上車的旅次。
+    (欄位: 小時, 日期類型, 人次)
+    """
+    roles = DATASET_ROLES[dataset]
+    where, params = _where(dataset, months, None, day_type)
+    where = _and(where, f"TRY_CAST({roles['time']} AS TIMESTAMP) IS NOT NULL")
+    if station is not None:
+        where = _and(where, f"{roles['origin']} = ?")
+        params.append(str(station))
+    query = f"""
+        SELECT hour(TRY_CAST({roles['time']} AS TIMESTAMP)) AS 小時, {roles['day_type']} AS 日期類型,
+               {_weighted_sum(roles)} AS 人次
+        FROM {dataset} {where}
+        GROUP BY ALL
+        ORDER BY 小時, 日期類型
+    """
+    return sql(con, query, params)
+
+
+def county_flows(con, dataset, station_to_county, months=None, day_type=None):
+    """
+    縣市間流量 (欄位: 起點縣市, 迄點縣市, 人次)；只計算起迄站都在 station_to_county 中的旅次。
+    """
+    roles = DATASET_ROLES[dataset]
+    where, params = _where(dataset, months, list(station_to_county), day_type)
+    mapping = pd.DataFrame({'車站': list(station_to_county), '縣市': list(station_to_county.values())})
+    con.register('station_county', mapping)
+    query = f"""
+        SELECT o.縣市 AS 起點縣市, d.縣市 AS 迄點縣市, {_weighted_sum(roles)} AS 人次
+        FROM (SELECT * FROM {dataset} {where}) AS trips
+        JOIN station_county AS o ON trips.{roles['origin']} = o.車站
+        JOIN station_county AS d ON trips.{roles['dest']} = d.車站
+        GROUP BY ALL
+        ORDER BY 人次 DESC
+    """
+    try:
+        return sql(con, query, params)
+    finally:
+        con.unregister('station_county')
+
+
+def route_summary(con, dataset, months=None, day_type=None):
+    """
+    公車各路線的旅次數、相異卡號數與平均旅次時長 (欄位: 路線, 旅次數, 相異卡號數, 平均旅次時長(分))。
+    """
+    roles = DATASET_ROLES[dataset]
+    if roles['route'] is None:
+        print(f"錯誤：'{dataset}' 沒有路線欄位，無法計算路線摘要。")
+        return None
+    where, params = _where(dataset, months, None, day_type)
+    query = f"""
+        SELECT {roles['route']} AS 路線, COUNT(*) AS 旅次數,
+               COUNT(DISTINCT 卡號) FILTER (WHERE {_is_real_value('卡號', NON_CARD_VALUES)}) AS 相異卡號數,
+               AVG("旅次時長(分)") FILTER (WHERE "旅次時長(分)" > 0) AS "平均旅次時長(分)"
+        FROM {dataset} {where}
+        GROUP BY ALL
+        ORDER BY 旅次數 DESC
+    """
+    return sql(con, query, params)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    connection = connect()
+    if connection is None:
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        print(sql(connection, sys.argv[1]).to_string())
+    else:
+        for name in DATASETS:
+            try:
+                total = connection.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            except Exception:
+                continue
+            print(f"\n--- {name}: 共 {total} 筆；熱門 OD ---")
+            print(top_od(connection, name, 10).to_string(index=False))
@@ -0,0 +1,504 @@
+# 檔名: code/query_service.py
+# 功能: 本機 HTTP 查詢服務，以 JSON 提供儀表板所需的標準彙總，並快取查詢結果。
+# 說明: 過去的成果是各分析腳本寫到 analysis_output/ 的 PNG 與 CSV，每次有人要看新的月份或車站都要重跑腳本。
+#       這裡以標準函式庫的 http.server 啟動一個本機服務，儀表板直接以 HTTP 取得 JSON：
+#         - 有安裝 duckdb 時由 query_layer.py 的 SQL 查詢計算 (讀取叢集化儲存區的 Parquet / CSV 列群組)；
+#         - 沒有 duckdb 時改以 pandas 計算，資料由 clustered_store.read_clustered 讀取
+#           (依月份、日期類型與起站略過不需要的列群組)，沒有儲存區時讀取統一資料檔。
+#       查詢結果 (JSON 位元組) 放在 LRU 快取中，以總位元組數為上限，超過時淘汰最久未使用的結果；
+#       快取鍵包含資料來源的版本 (layout.csv / row_groups.csv 或統一資料檔的修改時間與大小)，
+#       重新執行 data_loader 後舊結果不會再被取用，並在下一次查詢該資料集時一併清除。
+#
+# 端點 (GET；dataset 為 bus / highway_bus / tra，months 與 stations 以逗號分隔):
+#   /api/datasets                                      各資料集的資料來源與更新時間
+#   /api/top_od?dataset=tra&n=20&origin=花蓮             熱門 OD (origin 可省略)
+#   /api/stations?dataset=bus&n=20                     車站運量排名 (上車、下車與合計人次)
+#   /api/station_profile?dataset=tra&station=花蓮        單一車站的上下車人次、各小時人次與主要去向
+#   /api/hourly?dataset=tra&station=花蓮                 各小時 × 日期類型的人次 (station 可省略)
+#   /api/county_flows?dataset=tra                      縣市間流量 (依 config.TRA_STATION_TO_COUNTY，僅適用台鐵)
+#   /api/cache                                         快取統計 (筆數、位元組、命中率)
+#   共同參數: months=2024-03,2024-04、day_type=平日 或 假日、stations=... (起迄站都必須在清單中)
+#
+# 使用方式:
+#   python query_service.py          # 於 config.QUERY_SERVICE_HOST:QUERY_SERVICE_PORT 啟動服務
+import pandas as pd
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+import query_layer
+from clustered_store import read_clustered, LAYOUT_FILENAME, ROW_GROUPS_FILENAME
+from placeholders import has_stop
+
+DAY_TYPES = ['平日', '假日']
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+# =============================================================================
+#  查詢結果快取 (LRU，以位元組數為上限)
+# =============================================================================
+
+def new_cache(max_bytes=None):
+    """ 建立快取；entries 依使用順序排列 (最久未使用的在最前面)。 """
+    return {'entries': OrderedDict(), 'bytes': 0,
+            'max_bytes': config.QUERY_CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+            'versions': {}, 'hits': 0, 'misses': 0, 'evictions': 0, 'lock': threading.Lock()}
+
+
+def cache_get(cache, key):
+    """ 取出快取的結果並標記為最近使用；沒有時回傳 None。 """
+    with cache['lock']:
+        body = cache['entries'].get(key)
+        if body is None:
+            cache['misses'] += 1
+            return None
+        cache['entries'].move_to_end(key)
+        cache['hits'] += 1
+        return body
+
+
+def cache_put(cache, key, body):
+    """ 存入結果，總位元組數超過上限時由最久未使用的結果開始淘汰 (單筆就超過上限的結果不快取)。 """
+    if len(body) > cache['max_bytes']:
+        return
+    with cache['lock']:
+        old = cache['entries'].pop(key, None)
+        if old is not None:
+            cache['bytes'] -= len(old)
+        cache['entries'][key] = body
+        cache['bytes'] += len(body)
+        while cache['bytes'] > cache['max_bytes']:
+            _, evicted = cache['entries'].popitem(last=False)
+            cache['bytes'] -= len(evicted)
+            cache['evictions'] += 1
+
+
+def cache_check_version(cache, dataset, version):
+    """
+    記錄資料集目前的版本；版本與上次不同時清除該資料集的所有快取結果。
+
+    Returns:
+        bool: 是否為新的版本 (包含第一次查詢該資料集)。
+    """
+    with cache['lock']:
+        if cache['versions'].get(dataset) == version:
+            return False
+        stale = [key for key in cache['entries'] if key[0] == dataset]
+        for key in stale:
+            cache['bytes'] -= len(cache['entries'].pop(key))
+        cache['versions'][dataset] = version
+        return True
+
+
+def cache_stats(cache):
+    with cache['lock']:
+        lookups = cache['hits'] + cache['misses']
+        return {'筆數': len(cache['entries']), '位元組': cache['bytes'], '上限位元組': cache['max_bytes'],
+                '命中': cache['hits'], '未命中': cache['misses'], '淘汰': cache['evictions'],
+                '命中率': round(cache['hits'] / lookups, 4) if lookups else None}
+
+# =============================================================================
+#  資料來源版本
+# =============================================================================
+
+def dataset_version(dataset):
+    """
+    資料來源的版本：叢集化儲存區的 layout.csv 與 row_groups.csv (沒有儲存區時為統一資料檔) 的修改時間與大小。
+    data_loader 重建儲存區時一定會重寫這兩個檔案，因此版本改變即代表資料已更新。
+
+    Returns:
+        tuple or None: 版本；找不到任何資料時回傳 None。
+    """
+    store_dir, unified_file = query_layer.DATASETS[dataset]
+    paths = [os.path.join(store_dir, LAYOUT_FILENAME), os.path.join(store_dir, ROW_GROUPS_FILENAME)]
+    if not all(os.path.exists(path) for path in paths):
+        paths = [unified_file] if os.path.exists(unified_file) else []
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(version) or None
+
+# =============================================================================
+#  pandas 計算 (沒有 duckdb 時使用；輸出欄位與 query_layer 的查詢相同)
+# =============================================================================
+
+def _load_frame(dataset, months=None, day_type=None, origin=None):
+    """
+    讀取標準查詢需要的欄位 (起點、迄點、時間、日期類型，台鐵另加人次)，並依月份、日期類型與起站篩選。
+
+    Returns:
+        pd.DataFrame or None: 找不到任何資料時回傳 None。
+    """
+    roles = query_layer.DATASET_ROLES[dataset]
+    store_dir, unified_file = query_layer.DATASETS[dataset]
+    weight = roles['weight'].strip('"')
+    columns = [roles['origin'], roles['dest'], roles['time'], roles['day_type']] + ([weight] if weight != '1' else [])
+    filters = {}
+    if day_type:
+        filters[roles['day_type']] = day_type
+    if origin is not None:
+        filters[roles['origin']] = str(origin)
+
+    df = read_clustered(store_dir, filters, columns, months, verbose=False)
+    if df is not None:
+        df[roles['time']] = pd.to_datetime(df[roles['time']], errors='coerce')
+        return df
+    if not os.path.exists(unified_file):
+        return None
+    df = pd.read_csv(unified_file, usecols=columns, low_memory=False,
+                     dtype={roles['origin']: str, roles['dest']: str, roles['day_type']: str})
+    df[roles['time']] = pd.to_datetime(df[roles['time']], errors='coerce')
+    mask = pd.Series(True, index=df.index)
+    if months:
+        mask &= df[roles['time']].dt.strftime('%Y-%m').isin([str(m) for m in months])
+    for col, value in filters.items():
+        mask &= df[col] == value
+    return df[mask].reset_index(drop=True)
+
+
+def _weights(df, dataset):
+    """ 每一列代表的人次 (公車每列一人次，台鐵為「人次」欄位)；與 DuckDB 的 BIGINT 加總一樣為整數。 """
+    weight = query_layer.DATASET_ROLES[dataset]['weight'].strip('"')
+    if weight == '1':
+        return pd.Series(1, index=df.index, dtype='int64')
+    return pd.to_numeric(df[weight], errors='coerce').fillna(0).astype('int64')
+
+
+def _within(df, dataset, stations):
+    """ 起點與迄點都在 stations 中的旅次 (與 query_layer._where 相同)。 """
+    if not stations:
+        return df
+    roles = query_layer.DATASET_ROLES[dataset]
+    stations = [str(s) for s in stations]
+    return df[df[roles['origin']].isin(stations) & df[roles['dest']].isin(stations)]
+
+
+def pandas_top_od(dataset, n=20, months=None, stations=None, day_type=None, origin=None):
+    roles = query_layer.DATASET_ROLES[dataset]
+    df = _load_frame(dataset, months, day_type, origin)
+    if df is None:
+        return None
+    df = _within(df, dataset, stations)
+    df = df[has_stop(df[roles['origin']]) & has_stop(df[roles['dest']])]
+    trips = pd.DataFrame({'起點': df[roles['origin']], '迄點': df[roles['dest']], '人次': _weights(df, dataset)})
+    return trips.groupby(['起點', '迄點'], as_index=False)['人次'].sum() \
+        .sort_values('人次', ascending=False).head(int(n)).reset_index(drop=True)
+
+
+def pandas_station_traffic(dataset, n=20, months=None, stations=None, day_type=None, station=None):
+    roles = query_layer.DATASET_ROLES[dataset]
+    df = _load_frame(dataset, months, day_type)
+    if df is None:
+        return None
+    df = _within(df, dataset, stations)
+    weights = _weights(df, dataset)
+    boarding, alighting = has_stop(df[roles['origin']]), has_stop(df[roles['dest']])
+    traffic = pd.concat([weights[boarding].groupby(df.loc[boarding, roles['origin']]).sum().rename('上車人次'),
+                         weights[alighting].groupby(df.loc[alighting, roles['dest']]).sum().rename('下車人次')],
+                        axis=1).fillna(0).astype('int64')
+    traffic.index.name = '車站'
+    traffic['總人次'] = traffic['上車人次'] + traffic['下車人次']
+    if station is not None:
+        traffic = traffic[traffic.index == str(station)]
+    return traffic.sort_values('總人次', ascending=False).head(int(n)).reset_index()
+
+
+def pandas_hourly_counts(dataset, station=None, months=None, day_type=None):
+    roles = query_layer.DATASET_ROLES[dataset]
+    df = _load_frame(dataset, months, day_type, origin=station)
+    if df is None:
+        return None
+    df = df[df[roles['time']].notna()]
+    counts = _weights(df, dataset).groupby([df[roles['time']].dt.hour.rename('小時'),
+                                            df[roles['day_type']].astype(str).rename('日期類型')]).sum()
+    return counts.rename('人次').reset_index().sort_values(['小時', '日期類型'], ignore_index=True)
+
+
+def pandas_county_flows(dataset, station_to_county, months=None, day_type=None):
+    roles = query_layer.DATASET_ROLES[dataset]
+    df = _load_frame(dataset, months, day_type)
+    if df is None:
+        return None
+    flows = pd.DataFrame({'起點縣市': df[roles['origin']].map(station_to_county),
+                          '迄點縣市': df[roles['dest']].map(station_to_county),
+                          '人次': _weights(df, dataset)}).dropna(subset=['起點縣市', '迄點縣市'])
+    return flows.groupby(['起點縣市', '迄點縣市'], as_index=False)['人次'].sum() \
+        .sort_values('人次', ascending=False, ignore_index=True)
+
+
+# 標準查詢：(DuckDB 版本, pandas 版本)；兩者的參數與輸出欄位相同
+QUERIES = {
+    'top_od': (query_layer.top_od, pandas_top_od),
+    'station_traffic': (query_layer.station_traffic, pandas_station_traffic),
+    'hourly_counts': (query_layer.hourly_counts, pandas_hourly_counts),
+    'county_flows': (query_layer.county_flows, pandas_county_flows),
+}
+
+# =============================================================================
+#  服務狀態與端點
+# =============================================================================
+
+def new_state(use_sql=True):
+    """
+    建立服務狀態：快取、DuckDB 連線 (沒有 duckdb 或 use_sql=False 時為 None) 與已登錄的 view。
+    DuckDB 連線不能同時被多個執行緒使用，SQL 查詢以 sql_lock 依序執行。
+    """
+    con = query_layer.connect() if use_sql else None
+    return {'cache': new_cache(), 'con': con, 'views': set(), 'sql_lock': threading.Lock()}
+
+
+def _backend(state, dataset):
+    return 'duckdb' if state['con'] is not None and dataset in state['views'] else 'pandas'
+
+
+def _query(state, name, dataset, **kwargs):
+    sql_query, pandas_query = QUERIES[name]
+    if _backend(state, dataset) == 'duckdb':
+        with state['sql_lock']:
+            return sql_query(state['con'], dataset, **kwargs)
+    return pandas_query(dataset, **kwargs)
+
+
+def _refresh_dataset(state, dataset, version):
+    """ 資料集版本改變時清除快取，並重新登錄 DuckDB view (資料來源可能由統一資料檔換成儲存區)。 """
+    if not cache_check_version(state['cache'], dataset, version):
+        return
+    if state['con'] is not None:
+        with state['sql_lock']:
+            registered = query_layer.register_view(state['con'], dataset)
+        if registered:
+            state['views'].add(dataset)
+        else:
+            state['views'].discard(dataset)
+
+
+def _records(df):
+    """ DataFrame 轉為 JSON 可用的列清單 (缺值為 null)。 """
+    if df is None:
+        return None
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _common(params):
+    return {key: params.get(key) for key in ['months', 'stations', 'day_type']}
+
+
+def endpoint_top_od(state, params):
+    return _records(_query(state, 'top_od', params['dataset'], n=params['n'], origin=params.get('origin'),
+                           **_common(params)))
+
+
+def endpoint_stations(state, params):
+    return _records(_query(state, 'station_traffic', params['dataset'], n=params['n'], **_common(params)))
+
+
+def endpoint_hourly(state, params):
+    return _records(_query(state, 'hourly_counts', params['dataset'], station=params.get('station'),
+                           months=params.get('months'), day_type=params.get('day_type')))
+
+
+def endpoint_county_flows(state, params):
+    if params['dataset'] != 'tra':
+        raise ValueError("縣市間流量僅適用於台鐵 (dataset=tra)；公車站牌沒有縣市對應表。")
+    return _records(_query(state, 'county_flows', params['dataset'], station_to_county=config.TRA_STATION_TO_COUNTY,
+                           months=params.get('months'), day_type=params.get('day_type')))
+
+
+def endpoint_station_profile(state, params):
+    station = params.get('station')
+    if station is None:
+        raise ValueError("車站概況需要指定 station 參數。")
+    dataset, months, day_type = params['dataset'], params.get('months'), params.get('day_type')
+    traffic = _query(state, 'station_traffic', dataset, n=1, months=months, day_type=day_type, station=station)
+    if traffic is None:
+        return None
+    hourly = _query(state, 'hourly_counts', dataset, station=station, months=months, day_type=day_type)
+    destinations = _query(state, 'top_od', dataset, n=params['n'], months=months, day_type=day_type, origin=station)
+    totals = _records(traffic)
+    return {'車站': station,
+            '上車人次': totals[0]['上車人次'] if totals else 0,
+            '下車人次': totals[0]['下車人次'] if totals else 0,
+            '各小時人次': _records(hourly),
+            '主要去向': _records(destinations[['迄點', '人次']])}
+
+
+ENDPOINTS = {
+    '/api/top_od': endpoint_top_od,
+    '/api/stations': endpoint_stations,
+    '/api/station_profile': endpoint_station_profile,
+    '/api/hourly': endpoint_hourly,
+    '/api/county_flows': endpoint_county_flows,
+}
+
+
+def parse_params(query):
+    """
+    解析並驗證 query string；只保留認得的參數 (讓同一個查詢得到相同的快取鍵)。
+
+    Raises:
+        ValueError: 參數不正確時 (訊息會回傳給呼叫端)。
+    """
+    raw = {key: values[-1].strip() for key, values in parse_qs(query).items() if values[-1].strip()}
+    dataset = raw.get('dataset')
+    if dataset not in query_layer.DATASETS:
+        raise ValueError(f"dataset 必須是 {', '.join(query_layer.DATASETS)} 其中之一。")
+    params = {'dataset': dataset, 'n': config.QUERY_SERVICE_DEFAULT_N}
+    if 'n' in raw:
+        if not raw['n'].isdigit() or int(raw['n']) < 1:
+            raise ValueError("n 必須是正整數。")
+        params['n'] = int(raw['n'])
+    if 'months' in raw:
+        months = sorted({m.strip() for m in raw['months'].split(',') if m.strip()})
+        if not all(MONTH_PATTERN.match(m) for m in months):
+            raise ValueError("months 的格式為 YYYY-MM，多個月份以逗號分隔。")
+        params['months'] = months
+    if 'stations' in raw:
+        params['stations'] = sorted({s.strip() for s in raw['stations'].split(',') if s.strip()})
+    if 'day_type' in raw:
+        if raw['day_type'] not in DAY_TYPES:
+            raise ValueError(f"day_type 必須是 {' 或 '.join(DAY_TYPES)}。")
+        params['day_type'] = raw['day_type']
+    for key in ['station', 'origin']:
+        if key in raw:
+            params[key] = raw[key]
+    return params
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def datasets_info():
+    info = []
+    for dataset in query_layer.DATASETS:
+        version = dataset_version(dataset)
+        info.append({'dataset': dataset,
+                     '資料來源': None if version is None else
+                     ('叢集化儲存區' if version[0][0] == LAYOUT_FILENAME else '統一資料檔'),
+                     '更新時間': None if version is None else
+                     pd.Timestamp(max(v[1] for v in version), unit='ns').strftime('%Y-%m-%d %H:%M:%S')})
+    return info
+
+
+def handle_request(state, path):
+    """
+    處理一個 GET 請求。
+
+    Returns:
+        tuple: (HTTP 狀態碼, JSON 位元組, 快取狀態 'HIT' / 'MISS' / None)
+    """
+    url = urlparse(path)
+    if url.path == '/api/datasets':
+        return 200, _dumps(datasets_info()), None
+    if url.path == '/api/cache':
+        return 200, _dumps(cache_stats(state['cache'])), None
+    endpoint = ENDPOINTS.get(url.path)
+    if endpoint is None:
+        return 404, _dumps({'error': f"找不到端點 '{url.path}'。",
+                            'endpoints': ['/api/datasets', '/api/cache'] + list(ENDPOINTS)}), None
+    try:
+        params = parse_params(url.query)
+    except ValueError as e:
+        return 400, _dumps({'error': str(e)}), None
+
+    dataset = params['dataset']
+    version = dataset_version(dataset)
+    if version is None:
+        return 503, _dumps({'error': f"找不到 '{dataset}' 的資料，請先執行對應的 data_loader。"}), None
+    _refresh_dataset(state, dataset, version)
+
+    key = (dataset, version, url.path, tuple(sorted((k, str(v)) for k, v in params.items())))
+    body = cache_get(state['cache'], key)
+    if body is not None:
+        return 200, body, 'HIT'
+
+    started = time.perf_counter()
+    try:
+        data = endpoint(state, params)
+    except ValueError as e:
+        return 400, _dumps({'error': str(e)}), None
+    except Exception as e:
+        print(f"錯誤：查詢 {path} 失敗，錯誤訊息: {e}")
+        return 500, _dumps({'error': f"查詢失敗: {e}"}), None
+    if data is None:
+        return 503, _dumps({'error': f"找不到 '{dataset}' 的資料，請先執行對應的 data_loader。"}), None
+    body = _dumps({'query': url.path.rsplit('/', 1)[-1], 'params': params, 'backend': _backend(state, dataset),
+                   'compute_ms': round((time.perf_counter() - started) * 1000, 1), 'data': data})
+    cache_put(state['cache'], key, body)
+    return 200, body, 'MISS'
+
+
+def warm_cache(state):
+    """ 先計算各資料集的預設查詢並放入快取。 """
+    for dataset in query_layer.DATASETS:
+        if dataset_version(dataset) is None:
+            continue
+        paths = [f'/api/top_od?dataset={dataset}', f'/api/stations?dataset={dataset}',
+                 f'/api/hourly?dataset={dataset}'] + ([f'/api/county_flows?dataset={dataset}'] if dataset == 'tra' else [])
+        started = time.perf_counter()
+        statuses = [handle_request(state, path)[0] for path in paths]
+        print(f"  - 預先計算 '{dataset}' 的 {statuses.count(200)} / {len(paths)} 個預設查詢，"
+              f"耗時 {time.perf_counter() - started:.1f} 秒。")
+
+# =============================================================================
+#  HTTP 服務
+# =============================================================================
+
+def make_handler(state):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body, cache_status = handle_request(state, self.path)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            if cache_status:
+                self.send_header('X-Cache', cache_status)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return QueryHandler
+
+
+def run_server(host=None, port=None):
+    """ 啟動查詢服務 (按 Ctrl+C 停止)。 """
+    host = host or config.QUERY_SERVICE_HOST
+    port = port or config.QUERY_SERVICE_PORT
+    state = new_state()
+    if config.QUERY_SERVICE_WARMUP:
+        print("預先計算預設查詢...")
+        warm_cache(state)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    print(f"查詢服務已啟動: http://{host}:{port}/api/datasets "
+          f"(計算後端: {'duckdb' if state['con'] is not None else 'pandas'}，"
+          f"快取上限 {config.QUERY_CACHE_MAX_BYTES / 1024 / 1024:.0f} MB)。按 Ctrl+C 停止。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n查詢服務已停止。")
+    finally:
+        server.server_close()
+        if state['con'] is not None:
+            state['con'].close()
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_server()
@@ -0,0 +1,193 @@
+# 檔名: code/row_store.py
+# 功能: 統一資料的欄式儲存 (.npy) 與卡號、站名的 CSR 列索引。
+# 說明: 單一卡號或單一站點的查詢 (轉乘分析、指定車站的人流分析) 原本都要讀入整份統一資料檔，
+#       再對整張表做布林篩選。這裡在 data_loader 輸出統一資料檔的同時：
+#         1. 將每個欄位存成一個 .npy 檔 (文字欄位存成 int32 代碼 + 類別清單)，可用 mmap 讀取；
+#         2. 對卡號與站名各建立 CSR 索引：perm 為依鍵值排序後的列編號，offsets[c]:offsets[c+1]
+#            即為代碼 c 的所有列在 perm 中的範圍。
+#       查詢時只需將鍵值轉成代碼 (在排序好的類別陣列上二分搜尋)，取出 perm 的一段，
+#       再以這些列編號從 mmap 的欄位陣列取值，不需要讀入整份資料。
+#
+# 儲存格式 (store_dir 底下):
+#   manifest.csv                : 欄位, 型態 (numeric / datetime / category), 列數
+#   <欄位>.npy                   : 數值或 datetime64 欄位；類別欄位為 int32 代碼 (−1 表示缺值)
+#   <欄位>.categories.npy        : 類別欄位的類別清單 (定長 unicode 陣列，依名稱排序，位置即為代碼)
+#   index_<欄位>.perm.npy        : 依該欄位代碼排序後的列編號 (int64)
+#   index_<欄位>.offsets.npy     : CSR 位移陣列 (長度為類別數 + 1)
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+# 公車統一資料要建立索引的欄位
+BUS_INDEX_COLUMNS = ['卡號', '上車站名', '下車站名']
+
+# =============================================================================
+#  建立
+# =============================================================================
+
+def _column_kind(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return 'numeric'
+    return 'category'
+
+
+def build_row_store(df, store_dir, index_columns, columns=None):
+    """
+    將資料寫成欄式 .npy 儲存區，並為 index_columns 建立 CSR 列索引。
+
+    Args:
+        df (pd.DataFrame): data_loader 的最終資料。
+        store_dir (str): 儲存資料夾 (會覆蓋舊檔)。
+        index_columns (list): 要建立索引的欄位 (必須是文字欄位，例如卡號、站名)。
+        columns (list, optional): 要儲存的欄位，預設為全部。
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    columns = columns or list(df.columns)
+    manifest = []
+    for col in columns:
+        series = df[col]
+        kind = 'category' if col in index_columns else _column_kind(series)
+        path = os.path.join(store_dir, f'{col}.npy')
+        if kind == 'datetime':
+            np.save(path, series.to_numpy(dtype='datetime64[ns]'))
+        elif kind == 'numeric':
+            np.save(path, series.to_numpy())
+        else:
+            codes, categories = pd.factorize(series.astype(str).where(series.notna()), sort=True)
+            codes = codes.astype(np.int32)
+            np.save(path, codes)
+            # 存成定長 unicode 陣列 (非 object)，開啟時可以 mmap 讀取並直接二分搜尋
+            np.save(os.path.join(store_dir, f'{col}.categories.npy'), np.asarray(categories, dtype=str))
+            if col in index_columns:
+                # CSR 索引：排除缺值 (代碼 −1) 後依代碼做穩定排序，同一鍵值的列維持原本順序
+                valid = np.flatnonzero(codes >= 0)
+                perm = valid[np.argsort(codes[valid], kind='stable')]
+                offsets = np.zeros(len(categories) + 1, dtype=np.int64)
+                np.cumsum(np.bincount(codes[valid], minlength=len(categories)), out=offsets[1:])
+                np.save(os.path.join(store_dir, f'index_{col}.perm.npy'), perm)
+                np.save(os.path.join(store_dir, f'index_{col}.offsets.npy'), offsets)
+        manifest.append((col, kind, len(df)))
+    pd.DataFrame(manifest, columns=['欄位', '型態', '列數']).to_csv(
+        os.path.join(store_dir, 'manifest.csv'), index=False, encoding='utf-8-sig')
+    print(f"欄式儲存區與索引已建立: {store_dir} (共 {len(df)} 列、{len(columns)} 欄，索引欄位: {', '.join(index_columns)})")
+
+# =============================================================================
+#  開啟與查詢
+# =============================================================================
+
+def open_row_store(store_dir):
+    """
+    開啟儲存區 (只讀取 manifest；類別清單以 mmap 開啟，欄位與索引陣列在查詢時以 mmap 讀取)。
+    開啟的成本與類別數無關，不需要為卡號等高基數欄位建立查表 dict。
+
+    Returns:
+        dict or None: 儲存區資訊；找不到儲存區時回傳 None。
+    """
+    manifest_path = os.path.join(store_dir, 'manifest.csv')
+    if not os.path.exists(manifest_path):
+        return None
+    manifest = pd.read_csv(manifest_path)
+    store = {'dir': store_dir, 'kinds': dict(zip(manifest['欄位'], manifest['型態'])),
+             'rows': int(manifest['列數'].iloc[0]) if len(manifest) else 0,
+             'categories': {}, 'arrays': {}}
+    for col, kind in store['kinds'].items():
+        if kind == 'category':
+            path = os.path.join(store_dir, f'{col}.categories.npy')
+            if not os.path.exists(path):
+                print(f"警告：儲存區 '{store_dir}' 缺少 '{col}' 的類別清單 (舊版格式)，請重新執行 data_loader。")
+                return None
+            store['categories'][col] = np.load(path, mmap_mode='r')
+    return store
+
+
+def _array(store, name):
+    """ 以 mmap 開啟 (並快取) 儲存區中的 .npy 陣列。 """
+    if name not in store['arrays']:
+        store['arrays'][name] = np.load(os.path.join(store['dir'], f'{name}.npy'), mmap_mode='r')
+    return store['arrays'][name]
+
+
+def category_codes(store, column, values):
+    """
+    以二分搜尋 (np.searchsorted) 將鍵值轉為類別代碼。
+
+    Returns:
+        np.ndarray: 與 values 等長的 int64 代碼；不存在的鍵值為 −1。
+    """
+    categories = store['categories'][column]
+    keys = np.asarray([str(value) for value in values], dtype=str)
+    if not len(categories) or not len(keys):
+        return np.full(len(keys), -1, dtype=np.int64)
+    codes = np.minimum(np.searchsorted(categories, keys), len(categories) - 1)
+    return np.where(categories[codes] == keys, codes, -1).astype(np.int64)
+
+
+def row_ids(store, column, values):
+    """
+    取得 column 等於 values 中任一值的列編號 (由 CSR 索引取出，不掃描整欄)。
+
+    Args:
+        column (str or list): 索引欄位；傳入多個欄位時取聯集 (例如上車站名或下車站名等於某站)。
+        values (str or list): 要查詢的鍵值。
+
+    Returns:
+        np.ndarray: 依原始順序排列、不重複的列編號。
+    """
+    columns = [column] if isinstance(column, str) else column
+    values = [values] if isinstance(values, str) else values
+    parts = []
+    for col in columns:
+        perm, offsets = _array(store, f'index_{col}.perm'), _array(store, f'index_{col}.offsets')
+        for code in category_codes(store, col, values):
+            if code >= 0:
+                parts.append(np.asarray(perm[offsets[code]:offsets[code + 1]]))
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(parts)) if len(parts) > 1 else np.sort(parts[0])
+
+
+def read_rows(store, rows, columns=None):
+    """
+    由 mmap 的欄位陣列取出指定列，組成 DataFrame (類別欄位還原為文字，缺值為 NaN)。
+    """
+    columns = columns or list(store['kinds'])
+    data = {}
+    for col in columns:
+        values = np.asarray(_array(store, col)[rows])
+        if store['kinds'][col] == 'category':
+            text = store['categories'][col][np.maximum(values, 0)].astype(object) if len(store['categories'][col]) else \
+                np.full(len(values), np.nan, dtype=object)
+            text[values < 0] = np.nan
+            values = text
+        data[col] = values
+    return pd.DataFrame(data, columns=columns)
+
+
+def lookup(store, column, values, columns=None):
+    """ 一次完成 row_ids 與 read_rows：取出 column 等於 values 的所有列。 """
+    return read_rows(store, row_ids(store, column, values), columns)
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    for store_dir in [config.BUS_ROW_STORE_DIR, config.HIGHWAY_BUS_ROW_STORE_DIR]:
+        store = open_row_store(store_dir)
+        if store is None:
+            print(f"找不到儲存區 '{store_dir}'，請先執行對應的 data_loader。")
+            continue
+        sizes = np.diff(_array(store, 'index_上車站名.offsets'))
+        top = np.argsort(-sizes)[:10]
+        print(f"\n--- {store_dir} 共 {store['rows']} 列；上車人次最多的站 ---")
+        for code in top:
+            print(f"  {store['categories']['上車站名'][code]}: {sizes[code]}")
@@ -0,0 +1,230 @@
+# 檔名: code/station_batch.py
+# 功能: 轉乘分析的「全車站批次模式」。
+# 說明: 單站模式每分析一個車站就要對整份資料重新篩選一次。批次模式先將站名編為整數代碼，
+#       以一次 np.bincount 同時算出所有車站的「車站 × 日類型 × 時段」上下車剖面，
+#       再以一次 groupby 算出所有車站的平日早上目的地排名與平日傍晚起始站排名，
+#       最後合併輸出成單一長表 (tidy table)，圖表可依需要再從長表重建。
+import pandas as pd
+import numpy as np
+
+from time_bucket import DAY_TYPES, slots_per_day, slot_to_time, time_to_slot, time_to_day_type, label_to_day_type
+
+# 長表的欄位順序
+TIDY_COLUMNS = ['車站', '指標', '日期類型', '時段', '時間', '對應車站', '排名', '人次']
+
+# 平日通勤排名的時間窗 (以當日分鐘數表示，含起點、不含終點)
+MORNING_RUSH_MINUTES = (6 * 60 + 30, 9 * 60)     # 06:30-09:00
+EVENING_RUSH_MINUTES = (16 * 60, 18 * 60 + 30)   # 16:00-18:30
+
+# =============================================================================
+#  車站清單
+# =============================================================================
+
+def resolve_stations(setting, available):
+    """
+    解析設定檔中的批次車站設定。
+
+    Args:
+        setting: None (不啟用批次模式)、'ALL' (全部車站) 或車站名稱的 list。
+        available (iterable): 資料中出現過的車站名稱。
+
+    Returns:
+        list or None: 要分析的車站清單；未啟用批次模式時回傳 None。
+    """
+    if not setting:
+        return None
+    available = pd.Index(pd.Series(list(available)).dropna().unique())
+    if isinstance(setting, str) and setting.upper() == 'ALL':
+        return sorted(available.astype(str))
+    stations = [setting] if isinstance(setting, str) else list(setting)
+    missing = [s for s in stations if s not in available]
+    if missing:
+        print(f"警告：以下車站不存在於資料中，將略過：{missing}")
+    return [s for s in stations if s in available]
+
+
+def _station_codes(values, stations):
+    """ 將站名轉為整數代碼；不在清單內的站名代碼為 -1。 """
+    codes = pd.Categorical(pd.Series(values).astype(object), categories=stations).codes
+    return codes.astype(np.int64)
+
+# =============================================================================
+#  上下車剖面 (車站 × 日類型 × 時段)
+# =============================================================================
+
+def station_bucket_counts(station_codes, slots, day_types, n_stations, weights=None, bucket_minutes=5):
+    """
+    以單次 np.bincount 計算所有車站的 (日類型 × 時段) 人次。
+
+    Returns:
+        np.ndarray: 形狀為 (車站數, 2, 時段數) 的陣列。
+    """
+    n_slots = slots_per_day(bucket_minutes)
+    n_day_types = len(DAY_TYPES)
+    station_codes = np.asarray(station_codes, dtype=np.int64)
+    slots = np.asarray(slots, dtype=np.int64)
+    day_types = np.asarray(day_types, dtype=np.int64)
+    valid = (station_codes >= 0) & (slots >= 0) & (slots < n_slots) & (day_types >= 0)
+    flat_index = (station_codes[valid] * n_day_types + day_types[valid]) * n_slots + slots[valid]
+    if weights is not None:
+        weights = np.nan_to_num(np.asarray(weights, dtype=np.float64)[valid])
+    counts = np.bincount(flat_index, weights=weights, minlength=n_stations * n_day_types * n_slots)
+    return counts.reshape(n_stations, n_day_types, n_slots)
+
+
+def _profile_rows(counts, stations, label, bucket_minutes):
+    """ 將 (車站, 日類型, 時段) 陣列中的非零格子轉為長表的列。 """
+    station_idx, day_idx, slot_idx = np.nonzero(counts)
+    time_labels = np.array([slot_to_time(s, bucket_minutes) for s in range(counts.shape[2])])
+    return pd.DataFrame({
+        '車站': np.asarray(stations, dtype=object)[station_idx],
+        '指標': label,
+        '日期類型': np.asarray(DAY_TYPES, dtype=object)[day_idx],
+        '時段': slot_idx,
+        '時間': time_labels[slot_idx],
+        '人次': counts[station_idx, day_idx, slot_idx].round().astype(int),
+    })
+
+# =============================================================================
+#  平日通勤排名
+# =============================================================================
+
+def _rush_ranking_rows(station_values, partner_values, minute_of_day, day_types, window, label,
+                       stations, top_n, weights=None):
+    """
+    以一次 groupby 計算所有車站在平日指定時間窗內的對應車站排名 (前 top_n 名)。
+    """
+    start_minute, end_minute = window
+    mask = (np.asarray(day_types) == 0) & (minute_of_day >= start_minute) & (minute_of_day < end_minute)
+    mask &= np.asarray(pd.Series(station_values).isin(stations))
+    frame = pd.DataFrame({
+        '車站': np.asarray(station_values, dtype=object)[mask],
+        '對應車站': np.asarray(partner_values, dtype=object)[mask],
+        '人次': np.asarray(weights, dtype=np.float64)[mask] if weights is not None else 1,
+    }).dropna(subset=['對應車站'])
+
+    ranking = frame.groupby(['車站', '對應車站'], sort=False)['人次'].sum().reset_index()
+    ranking = ranking.sort_values(['車站', '人次'], ascending=[True, False], kind='stable')
+    ranking['排名'] = ranking.groupby('車站').cumcount() + 1
+    ranking = ranking[ranking['排名'] <= top_n]
+    ranking['人次'] = ranking['人次'].round().astype(int)
+    ranking['指標'] = label
+    ranking['日期類型'] = DAY_TYPES[0]
+    return ranking
+
+
+def _minute_of_day(times):
+    return (times.dt.hour * 60 + times.dt.minute).fillna(-1).to_numpy(dtype=np.int64)
+
+# =============================================================================
+#  批次長表
+# =============================================================================
+
+def build_station_batch_table(df, origin_col, destination_col, board_time_col, alight_time_col,
+                              stations, weight_col=None, day_type_col=None, bucket_minutes=5, top_n=15):
+    """
+    一次計算多個車站的上下車剖面與平日通勤排名，輸出為單一長表。
+
+    Args:
+        df (pd.DataFrame): 旅次資料。
+        origin_col / destination_col (str): 上車站與下車站欄位。
+        board_time_col / alight_time_col (str): 上車時間與下車時間欄位 (datetime)。
+        stations (list): 要分析的車站清單。
+        weight_col (str, optional): 人次欄位 (預設每筆為 1 人次)。
+        day_type_col (str, optional): 既有的 '平日'/'假日' 欄位；未指定時依時間的星期判斷。
+        bucket_minutes (int): 時段寬度 (分鐘)。
+        top_n (int): 每個車站的排名保留筆數。
+
+    Returns:
+        pd.DataFrame: 欄位為 TIDY_COLUMNS 的長表。指標為 '上車'、'下車'、'早上目的地'、'傍晚起始站'。
+    """
+    weights = df[weight_col].to_numpy() if weight_col else None
+    board_times, alight_times = df[board_time_col], df[alight_time_col]
+    if day_type_col:
+        board_day = alight_day = label_to_day_type(df[day_type_col]).to_numpy()
+    else:
+        board_day = time_to_day_type(board_times).to_numpy()
+        alight_day = time_to_day_type(alight_times).to_numpy()
+
+    origin_codes = _station_codes(df[origin_col], stations)
+    destination_codes = _station_codes(df[destination_col], stations)
+
+    boarding = station_bucket_counts(origin_codes, time_to_slot(board_times, bucket_minutes), board_day,
+                                     len(stations), weights, bucket_minutes)
+    alighting = station_bucket_counts(destination_codes, time_to_slot(alight_times, bucket_minutes), alight_day,
+                                      len(stations), weights, bucket_minutes)
+
+    parts = [
+        _profile_rows(boarding, stations, '上車', bucket_minutes),
+        _profile_rows(alighting, stations, '下車', bucket_minutes),
+        _rush_ranking_rows(df[origin_col], df[destination_col], _minute_of_day(board_times), board_day,
+                           MORNING_RUSH_MINUTES, '早上目的地', stations, top_n, weights),
+        _rush_ranking_rows(df[destination_col], df[origin_col], _minute_of_day(alight_times), alight_day,
+                           EVENING_RUSH_MINUTES, '傍晚起始站', stations, top_n, weights),
+    ]
+    tidy = pd.concat(parts, ignore_index=True).reindex(columns=TIDY_COLUMNS)
+    return tidy.astype({'時段': 'Int64', '排名': 'Int64'})
+
+# =============================================================================
+#  從長表重建單站結果 (供繪圖使用)
+# =============================================================================
+
+def station_peak_frame(tidy, station, bucket_minutes=5, layout='{day_type}{direction}'):
+    """
+    從長表取出單一車站的上下車剖面，還原為 (時段 × 類型) 的寬表。
+
+    Args:
+        layout (str): 欄位名稱格式，例如 '{day_type}{direction}' -> '平日上車'。
+    """
+    rows = tidy[(tidy['車站'] == station) & tidy['指標'].isin(['上車', '下車'])]
+    columns = [layout.format(day_type=d, direction=direction) for direction in ['上車', '下車'] for d in DAY_TYPES]
+    frame = pd.DataFrame(0, index=pd.Index(range(slots_per_day(bucket_minutes)), name=f'時段_{bucket_minutes}分'),
+                         columns=columns)
+    for (direction, day_type), group in rows.groupby(['指標', '日期類型']):
+        frame.loc[group['時段'].astype(int).to_numpy(), layout.format(day_type=day_type, direction=direction)] = group['人次'].to_numpy()
+    return frame
+
+
+def station_peak_summary(tidy, stations, window_minutes=60, bucket_minutes=5, layout='{day_type}{direction}'):
+    """
+    一次計算所有車站、各類型 (上下車 × 日期類型) 的連續 window_minutes 分鐘尖峰區間，
+    結果與逐站呼叫 peak_windows(station_peak_frame(...)) 相同，但不需對長表逐站篩選。
+
+    Returns:
+        pd.DataFrame: 欄位為 車站, 類型, 尖峰開始, 尖峰結束, 尖峰人次。
+    """
+    n_slots = slots_per_day(bucket_minutes)
+    directions = ['上車', '下車']
+    rows = tidy[tidy['指標'].isin(directions)]
+    counts = rows.groupby(['車站', '指標', '日期類型', '時段'], sort=False)['人次'].sum().reset_index()
+
+    # 依 (車站, 方向, 日期類型, 時段) 填入陣列，再沿時段軸以累積和計算所有序列的移動視窗加總
+    grid = np.zeros((len(stations), len(directions), len(DAY_TYPES), n_slots))
+    station_idx = pd.Categorical(counts['車站'], categories=stations).codes
+    direction_idx = pd.Categorical(counts['指標'], categories=directions).codes
+    day_idx = pd.Categorical(counts['日期類型'], categories=DAY_TYPES).codes
+    valid = (station_idx >= 0) & (day_idx >= 0)
+    grid[station_idx[valid], direction_idx[valid], day_idx[valid],
+         counts['時段'].to_numpy(dtype=np.int64)[valid]] = counts['人次'].to_numpy()[valid]
+
+    window_buckets = min(max(window_minutes // bucket_minutes, 1), n_slots)
+    cumulative = np.concatenate([np.zeros(grid.shape[:-1] + (1,)), np.cumsum(grid, axis=-1)], axis=-1)
+    window_sums = cumulative[..., window_buckets:] - cumulative[..., :-window_buckets]
+    starts = window_sums.argmax(axis=-1)
+    totals = np.take_along_axis(window_sums, starts[..., None], axis=-1)[..., 0]
+
+    time_labels = [slot_to_time(s, bucket_minutes) for s in range(n_slots)] + ['24:00']
+    end_slots = starts + window_buckets
+    return pd.DataFrame({
+        '車站': np.repeat(np.asarray(stations, dtype=object), len(directions) * len(DAY_TYPES)),
+        '類型': [layout.format(day_type=d, direction=direction) for direction in directions for d in DAY_TYPES] * len(stations),
+        '尖峰開始': np.asarray(time_labels, dtype=object)[starts.ravel()],
+        '尖峰結束': np.asarray(time_labels, dtype=object)[np.where(end_slots < n_slots, end_slots, n_slots).ravel()],
+        '尖峰人次': np.round(totals.ravel()).astype(int),
+    })
+
+
+def station_ranking(tidy, station, label):
+    """ 從長表取出單一車站的排名，回傳以對應車站為索引的 Series (與 value_counts 結果同格式)。 """
+    rows = tidy[(tidy['車站'] == station) & (tidy['指標'] == label)].sort_values('排名')
+    return pd.Series(rows['人次'].to_numpy(), index=pd.Index(rows['對應車站'], name=None), name='count')
@@ -0,0 +1,185 @@
+# 檔名: code/time_bucket.py
+# 功能: 車站尖峰時段分析共用的「日類型 × 時段」直方圖核心。
+# 說明: 原本各腳本是先算 minute_of_day // 5，再用 pivot_table 或 groupby().unstack()
+#       彙整，最後 reindex 成 288 個時段並補 0。這裡改為先建立 int16 的時段代碼與
+#       int8 的日類型代碼 (0 = 平日, 1 = 假日)，再以一次 np.bincount 完成計數，
+#       可支援任意時段寬度 (1/5/15/60 分鐘) 並計算連續 N 分鐘的尖峰區間。
+import pandas as pd
+import numpy as np
+
+# 日類型代碼對應的名稱 (代碼即為陣列的列索引)
+DAY_TYPES = ['平日', '假日']
+
+# =============================================================================
+#  代碼欄位的建立
+# =============================================================================
+
+def slots_per_day(bucket_minutes=5):
+    """ 一天共有幾個時段 (例如 5 分鐘 -> 288 個時段)。 """
+    if 1440 % bucket_minutes != 0:
+        raise ValueError(f"時段寬度 {bucket_minutes} 分鐘無法整除一天，請使用 1/5/15/30/60 等數值。")
+    return 1440 // bucket_minutes
+
+
+def time_to_slot(times, bucket_minutes=5):
+    """
+    將時間欄位轉為 int16 時段代碼 (空值為 -1)。
+
+    Args:
+        times (pd.Series): datetime 欄位。
+        bucket_minutes (int): 時段寬度 (分鐘)。
+    """
+    minute_of_day = times.dt.hour * 60 + times.dt.minute
+    return (minute_of_day // bucket_minutes).fillna(-1).astype(np.int16)
+
+
+def time_to_day_type(times):
+    """ 將時間欄位轉為 int8 日類型代碼 (週一至週五為 0，週末為 1，空值為 -1)。 """
+    return (times.dt.dayofweek >= 5).astype(np.int8).where(times.notna(), -1).astype(np.int8)
+
+
+def label_to_day_type(labels):
+    """ 將既有的 '平日'/'假日' 文字欄位轉為 int8 日類型代碼 (其他值為 -1)。 """
+    labels = labels.astype(object)
+    codes = np.where(labels == DAY_TYPES[0], 0, np.where(labels == DAY_TYPES[1], 1, -1))
+    return pd.Series(codes.astype(np.int8), index=labels.index)
+
+
+def time_to_seconds(times):
+    """ 將時間欄位轉為 int32 的當日秒數 (0 ~ 86399，空值為 -1)，供時間窗篩選使用。 """
+    seconds = times.dt.hour * 3600 + times.dt.minute * 60 + times.dt.second
+    return seconds.fillna(-1).astype(np.int32)
+
+
+def time_to_weekday(times):
+    """ 將時間欄位轉為 int8 星期代碼 (週一為 0、週日為 6，空值為 -1)。 """
+    return times.dt.dayofweek.fillna(-1).astype(np.int8)
+
+
+def clock_to_seconds(clock):
+    """ 將 'HH:MM' 或 'HH:MM:SS' 字串轉為當日秒數。 """
+    parts = [int(p) for p in clock.split(':')]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+
+def add_time_of_day_columns(df, prefixes=('上車', '下車')):
+    """
+    在 DataFrame 上預先建立 '{prefix}秒數' (int32) 與 '{prefix}星期' (int8) 欄位，
+    讓「平日 06:30-09:00」這類時間窗查詢可以直接用整數範圍比較，
+    不必再對每一列產生 datetime.time 物件。
+    """
+    for prefix in prefixes:
+        df[f'{prefix}秒數'] = time_to_seconds(df[f'{prefix}時間'])
+        df[f'{prefix}星期'] = time_to_weekday(df[f'{prefix}時間'])
+    return df
+
+
+def add_bucket_columns(df, time_col, prefix, bucket_minutes=5):
+    """
+    在 DataFrame 上預先建立 '{prefix}時段' (int16) 與 '{prefix}日類型' (int8) 欄位。
+    同時適用於 pandas 與 dask 的 DataFrame。
+    """
+    df[f'{prefix}時段'] = time_to_slot(df[time_col], bucket_minutes)
+    df[f'{prefix}日類型'] = time_to_day_type(df[time_col])
+    return df
+
+# =============================================================================
+#  直方圖核心
+# =============================================================================
+
+def bucket_counts(slots, day_types, weights=None, bucket_minutes=5):
+    """
+    以單次 np.bincount 計算 (日類型 × 時段) 的人次。
+
+    Args:
+        slots (array-like): int16 時段代碼。
+        day_types (array-like): int8 日類型代碼。
+        weights (array-like, optional): 每筆紀錄的人次 (預設每筆為 1)。
+        bucket_minutes (int): 時段寬度 (分鐘)。
+
+    Returns:
+        np.ndarray: 形狀為 (2, 時段數) 的陣列，第 0 列為平日、第 1 列為假日。
+    """
+    n_slots = slots_per_day(bucket_minutes)
+    slots = np.asarray(slots, dtype=np.int64)
+    day_types = np.asarray(day_types, dtype=np.int64)
+    valid = (slots >= 0) & (slots < n_slots) & (day_types >= 0)
+    flat_index = day_types[valid] * n_slots + slots[valid]
+    if weights is not None:
+        weights = np.nan_to_num(np.asarray(weights, dtype=np.float64)[valid])
+    counts = np.bincount(flat_index, weights=weights, minlength=len(DAY_TYPES) * n_slots)
+    return counts.reshape(len(DAY_TYPES), n_slots)
+
+
+def dask_bucket_counts(ddf, slot_col, day_type_col, weight_col=None, bucket_minutes=5):
+    """
+    dask 版本：每個分區各自做一次 bincount，只把 (2 × 時段數) 的小陣列傳回來相加，
+    不需要對整份資料做 pivot_table 的洗牌 (shuffle)。
+    """
+    n_cells = len(DAY_TYPES) * slots_per_day(bucket_minutes)
+
+    def _partition_counts(part):
+        weights = part[weight_col].to_numpy() if weight_col else None
+        counts = bucket_counts(part[slot_col].to_numpy(), part[day_type_col].to_numpy(), weights, bucket_minutes)
+        return pd.DataFrame(counts.reshape(1, -1))
+
+    meta = pd.DataFrame({i: pd.Series(dtype='float64') for i in range(n_cells)})
+    partial = ddf.map_partitions(_partition_counts, meta=meta).compute()
+    return partial.to_numpy().sum(axis=0).reshape(len(DAY_TYPES), -1)
+
+
+def counts_to_frame(counts, bucket_minutes=5, suffix=''):
+    """
+    將 bucket_counts 的結果轉為 DataFrame：索引為 0..時段數-1，欄位為 '平日{suffix}'、'假日{suffix}'。
+    """
+    frame = pd.DataFrame(
+        {f'{day_type}{suffix}': counts[code] for code, day_type in enumerate(DAY_TYPES)},
+        index=pd.Index(range(counts.shape[1]), name=f'時段_{bucket_minutes}分')
+    )
+    return frame.round().astype(int)
+
+# =============================================================================
+#  時段標籤與尖峰區間
+# =============================================================================
+
+def slot_to_time(slot, bucket_minutes=5):
+    """ 將時段代碼轉為 'HH:MM' 字串。 """
+    minutes = int(slot) * bucket_minutes
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def rolling_peak(values, window_buckets):
+    """
+    找出連續 window_buckets 個時段的加總最大值 (以累積和計算，單次線性掃描)。
+
+    Returns:
+        tuple: (起始時段代碼, 區間總人次)。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or window_buckets <= 0:
+        return 0, 0.0
+    window_buckets = min(window_buckets, len(values))
+    cumulative = np.concatenate([[0.0], np.cumsum(values)])
+    window_sums = cumulative[window_buckets:] - cumulative[:-window_buckets]
+    start = int(np.argmax(window_sums))
+    return start, float(window_sums[start])
+
+
+def peak_windows(frame, window_minutes=60, bucket_minutes=5):
+    """
+    對 DataFrame 的每個欄位計算連續 window_minutes 分鐘的尖峰區間。
+
+    Returns:
+        pd.DataFrame: 每個欄位一列，含 尖峰開始、尖峰結束、尖峰人次。
+    """
+    window_buckets = max(window_minutes // bucket_minutes, 1)
+    rows = []
+    for col in frame.columns:
+        start, total = rolling_peak(frame[col].to_numpy(), window_buckets)
+        rows.append({
+            '類型': col,
+            '尖峰開始': slot_to_time(start, bucket_minutes),
+            '尖峰結束': slot_to_time(start + window_buckets, bucket_minutes) if start + window_buckets < len(frame) else '24:00',
+            '尖峰人次': int(round(total)),
+        })
+    return pd.DataFrame(rows).set_index('類型')
@@ -0,0 +1,233 @@
+# 檔名: code/transfer_engine.py
+# 功能: 公車 ↔ 台鐵 跨運具轉乘判定引擎。
+# 說明: station_transfer_analyze.py 是分別看公車站牌與台鐵車站的上下車量，無法得知實際上有多少人轉乘。
+#       這裡以電子票證的卡號串接兩種運具：
+#         公車 → 台鐵: 每筆台鐵進站，找同一卡號在 TRANSFER_WINDOW_MINUTES 分鐘內最近一次的公車下車；
+#         台鐵 → 公車: 每筆公車上車，找同一卡號在時間窗內最近一次的台鐵出站。
+#       轉出事件先依 config.TRANSFER_STATION_PAIRS 的鄰近對照表展開成「可轉入的站點」，
+#       兩邊各自依時間排序後以 pd.merge_asof(by=['卡號', '轉入站']) 做一次有序掃描，不需要任何笛卡兒積 join，
+#       計算量與資料筆數 (乘上每站的鄰近站數) 成線性 (另加一次排序)，可直接處理全年資料。
+#       最後輸出「站點組合 × 小時」的轉乘人次。
+import pandas as pd
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from row_store import open_row_store, lookup
+from placeholders import has_card
+
+# 轉乘明細的欄位順序
+TRANSFER_COLUMNS = ['轉乘方向', '卡號', '轉出站', '轉出時間', '轉入站', '轉入時間', '轉乘時間(分)']
+
+# =============================================================================
+#  資料讀取 (分塊讀取並只保留鄰近對照表中的站點)
+# =============================================================================
+
+def _read_card_taps(file_path, columns, station_cols, stations, chunk_size=1000000):
+    """
+    分塊讀取統一資料檔，只保留有卡號、且站名在 stations 中的刷卡紀錄。
+
+    Args:
+        file_path (str): data_loader 產生的統一資料檔。
+        columns (list): 要讀取的欄位 (需包含 '卡號')。
+        station_cols (list): 用來篩選的站名欄位，任一欄位符合即保留。
+        stations (set): 鄰近對照表中出現的站名。
+
+    Returns:
+        pd.DataFrame or None: 篩選後的資料；找不到檔案時回傳 None。
+    """
+    kept = []
+    try:
+        reader = pd.read_csv(file_path, usecols=columns, chunksize=chunk_size, dtype=str, low_memory=False)
+        for chunk in reader:
+            chunk = chunk[has_card(chunk['卡號'])]
+            near_station = pd.Series(False, index=chunk.index)
+            for col in station_cols:
+                near_station |= chunk[col].isin(stations)
+            kept.append(chunk[near_station])
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案 '{file_path}'。請先執行對應的 data_loader。")
+        return None
+    except ValueError as e:
+        print(f"錯誤：檔案 '{file_path}' 缺少轉乘判定所需的欄位 ({e})。請重新執行 data_loader。")
+        return None
+    if not kept:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(kept, ignore_index=True)
+
+
+def load_bus_taps(file_path, stations, store_dir=None):
+    """
+    讀取公車刷卡紀錄 (卡號、上下車時間與站名)。
+    有 data_loader 建立的欄式儲存區時，以站名的 CSR 索引只讀取鄰近站點的列，不掃描整份統一資料檔。
+    """
+    columns = ['卡號', '上車時間', '上車站名', '下車時間', '下車站名']
+    store = open_row_store(store_dir) if store_dir else None
+    if store is not None:
+        taps = lookup(store, ['上車站名', '下車站名'], sorted(stations), columns)
+        return taps[has_card(taps['卡號'])].reset_index(drop=True)
+    return _read_card_taps(file_path, columns, ['上車站名', '下車站名'], stations)
+
+
+def load_tra_taps(file_path, stations):
+    """ 讀取台鐵電子票證的進出站紀錄 (卡號、進出站時間與車站)。 """
+    columns = ['卡號', '起點', '進站時間', '迄點', '出站時間']
+    return _read_card_taps(file_path, columns, ['起點', '迄點'], stations)
+
+# =============================================================================
+#  轉乘配對
+# =============================================================================
+
+def _pair_index(station_pairs):
+    """ 將 {轉出站: [轉入站, ...]} 轉為 (轉出站, 轉入站) 的 MultiIndex。 """
+    pairs = [(source, target) for source, targets in station_pairs.items() for target in targets]
+    return pd.MultiIndex.from_tuples(pairs, names=['轉出站', '轉入站'])
+
+
+def reverse_pairs(station_pairs):
+    """ 反轉鄰近對照表：{公車站牌: [台鐵車站]} -> {台鐵車站: [公車站牌]}。 """
+    reversed_pairs = {}
+    for source, targets in station_pairs.items():
+        for target in targets:
+            reversed_pairs.setdefault(target, []).append(source)
+    return reversed_pairs
+
+
+def _events(df, time_col, station_col, stations):
+    """ 取出單一方向的刷卡事件 (卡號, 時間, 站名)，只保留指定站點且時間有效的紀錄，並依時間排序。 """
+    events = pd.DataFrame({
+        '卡號': df['卡號'].astype(str).str.strip(),
+        '時間': pd.to_datetime(df[time_col], errors='coerce'),
+        '站名': df[station_col],
+    })
+    events = events[events['時間'].notna() & events['站名'].isin(stations)]
+    return events.sort_values('時間', kind='stable')
+
+
+def match_transfers(origin, origin_time_col, origin_station_col,
+                    target, target_time_col, target_station_col,
+                    station_pairs, window_minutes, label):
+    """
+    以 merge_asof 找出「轉出 → 轉入」的轉乘。
+
+    轉出事件先依鄰近對照表展開為 (轉出站, 可轉入的轉入站) 的組合，再以 (卡號, 轉入站) 為 by 鍵，
+    讓每一筆轉入事件向前 (backward) 尋找同一卡號在 window_minutes 內、且站點可步行轉乘的最近一筆轉出事件。
+    因此較新的非鄰近站點紀錄不會遮蔽較早但符合條件的轉出；同一筆轉入最多只會對應一筆轉出
+    (轉出重複被配對時保留最早的轉入)。
+
+    Args:
+        origin / target (pd.DataFrame): 轉出與轉入運具的刷卡紀錄。
+        *_time_col / *_station_col (str): 時間與站名欄位。
+        station_pairs (dict): {轉出站: [可步行轉乘的轉入站]}。
+        window_minutes (int): 轉乘時間窗 (分鐘)。
+        label (str): 轉乘方向名稱，例如 '公車→台鐵'。
+
+    Returns:
+        pd.DataFrame: 欄位為 TRANSFER_COLUMNS 的轉乘明細。
+    """
+    pair_index = _pair_index(station_pairs)
+    origin_events = _events(origin, origin_time_col, origin_station_col, set(pair_index.get_level_values(0)))
+    target_events = _events(target, target_time_col, target_station_col, set(pair_index.get_level_values(1)))
+    if origin_events.empty or target_events.empty:
+        return pd.DataFrame(columns=TRANSFER_COLUMNS)
+
+    origin_events = origin_events.rename(columns={'時間': '轉出時間', '站名': '轉出站'})
+    target_events = target_events.rename(columns={'時間': '轉入時間', '站名': '轉入站'})
+    # 每筆轉出事件展開為其可轉入的每一個轉入站，使 merge_asof 只在符合鄰近條件的紀錄中尋找
+    pairs = pair_index.to_frame(index=False)
+    origin_events = origin_events.merge(pairs, on='轉出站').sort_values('轉出時間', kind='stable')
+    origin_events['轉入時間'] = origin_events['轉出時間']  # merge_asof 的比對鍵
+
+    matched = pd.merge_asof(target_events, origin_events, on='轉入時間', by=['卡號', '轉入站'],
+                            direction='backward', tolerance=pd.Timedelta(minutes=window_minutes))
+    matched = matched[matched['轉出時間'].notna()]
+    # 同一筆轉出若被多筆轉入配對 (例如重複刷卡)，只保留時間最早的一筆
+    matched = matched.drop_duplicates(['卡號', '轉出時間', '轉出站'], keep='first')
+
+    matched['轉乘方向'] = label
+    matched['轉乘時間(分)'] = (matched['轉入時間'] - matched['轉出時間']).dt.total_seconds() / 60
+    return matched[TRANSFER_COLUMNS].reset_index(drop=True)
+
+
+def detect_transfers(bus_taps, tra_taps, station_pairs=None, window_minutes=None):
+    """
+    判定兩個方向的跨運具轉乘。
+
+    Returns:
+        pd.DataFrame: 公車→台鐵 與 台鐵→公車 的轉乘明細 (欄位為 TRANSFER_COLUMNS)。
+    """
+    station_pairs = station_pairs or config.TRANSFER_STATION_PAIRS
+    window_minutes = window_minutes or config.TRANSFER_WINDOW_MINUTES
+    bus_to_tra = match_transfers(bus_taps, '下車時間', '下車站名', tra_taps, '進站時間', '起點',
+                                 station_pairs, window_minutes, '公車→台鐵')
+    tra_to_bus = match_transfers(tra_taps, '出站時間', '迄點', bus_taps, '上車時間', '上車站名',
+                                 reverse_pairs(station_pairs), window_minutes, '台鐵→公車')
+    return pd.concat([bus_to_tra, tra_to_bus], ignore_index=True)
+
+
+def transfer_counts(transfers):
+    """
+    計算「轉乘方向 × 站點組合 × 小時」的轉乘人次 (小時以轉出時間為準)。
+
+    Returns:
+        pd.DataFrame: 欄位為 轉乘方向, 轉出站, 轉入站, 小時, 轉乘人次, 平均轉乘時間(分)。
+    """
+    columns = ['轉乘方向', '轉出站', '轉入站', '小時']
+    if transfers.empty:
+        return pd.DataFrame(columns=columns + ['轉乘人次', '平均轉乘時間(分)'])
+    counts = (transfers.assign(小時=transfers['轉出時間'].dt.hour)
+              .groupby(columns)['轉乘時間(分)']
+              .agg(轉乘人次='size', **{'平均轉乘時間(分)': 'mean'})
+              .reset_index())
+    counts['平均轉乘時間(分)'] = counts['平均轉乘時間(分)'].round(1)
+    return counts
+
+# =============================================================================
+#  主流程
+# =============================================================================
+
+def run_transfer_detection(bus_file=None, tra_file=None, output_dir=None, station_pairs=None, window_minutes=None):
+    """ 讀取公車與台鐵的統一資料檔，判定跨運具轉乘並輸出明細與「站點組合 × 小時」人次表。 """
+    bus_file = bus_file or config.BUS_UNIFIED_DATA_FILE
+    tra_file = tra_file or config.TRA_UNIFIED_DATA_FILE
+    output_dir = output_dir or config.TRANSFER_ANALYSIS_OUTPUT_DIR
+    station_pairs = station_pairs or config.TRANSFER_STATION_PAIRS
+    window_minutes = window_minutes or config.TRANSFER_WINDOW_MINUTES
+
+    bus_stations = set(station_pairs)
+    tra_stations = {target for targets in station_pairs.values() for target in targets}
+    print(f"--- [跨運具轉乘判定] 時間窗: {window_minutes} 分鐘，站點組合: {len(_pair_index(station_pairs))} 組 ---")
+
+    # 列索引由 BUS_UNIFIED_DATA_FILE 建立，指定其他檔案時改為分塊讀取
+    bus_store = config.BUS_ROW_STORE_DIR if bus_file == config.BUS_UNIFIED_DATA_FILE else None
+    bus_taps = load_bus_taps(bus_file, bus_stations, bus_store)
+    tra_taps = load_tra_taps(tra_file, tra_stations)
+    if bus_taps is None or tra_taps is None:
+        return None
+    print(f"  - 鄰近站點的公車刷卡 {len(bus_taps)} 筆、台鐵電子票證 {len(tra_taps)} 筆。")
+
+    transfers = detect_transfers(bus_taps, tra_taps, station_pairs, window_minutes)
+    counts = transfer_counts(transfers)
+    print(f"  - 共判定出 {len(transfers)} 次轉乘：")
+    print(transfers['轉乘方向'].value_counts().to_string() if not transfers.empty else "    (無)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    counts_path = os.path.join(output_dir, f'cross_mode_transfer_counts_{window_minutes}min.csv')
+    trips_path = os.path.join(output_dir, f'cross_mode_transfer_trips_{window_minutes}min.csv')
+    counts.to_csv(counts_path, index=False, encoding='utf-8-sig')
+    transfers.to_csv(trips_path, index=False, encoding='utf-8-sig')
+    print(f"站點組合 × 小時的轉乘人次已儲存至: {counts_path}")
+    print(f"轉乘明細已儲存至: {trips_path}")
+    return counts
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_transfer_detection()
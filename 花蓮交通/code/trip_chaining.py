@@ -0,0 +1,233 @@
+# 檔名: code/trip_chaining.py
+# 功能: 公車旅程重建 (trip chaining)。
+# 說明: 統一資料中的每一筆都是「一段」搭乘，轉乘的乘客會被拆成多筆起迄，OD 分析因此只看得到各段的起迄。
+#       這裡將市區公車與公路客運的刷卡紀錄合併，依 (卡號, 上車時間) 排序後，
+#       以「前一段下車到這一段上車的間隔」判斷是否為同一旅程，把連續搭乘串成多段旅程，
+#       再輸出每趟旅程的真正起點、迄點、段數與車上時間，以及旅程層級的 OD 表。
+#       串接判斷是排序後的向量化 shift/diff；若環境中有安裝 numba，則改用 JIT 編譯的單次掃描 (結果相同)。
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# --- 從 config.py 載入設定 ---
+try:
+    # 從 code/ 回到根目錄
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import config
+except ImportError:
+    print("錯誤：無法找到 config.py。請確認您的專案結構。")
+    sys.exit(1)
+
+from placeholders import has_card
+
+# --- 選用套件：numba (未安裝時使用 numpy 向量化版本) ---
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 從統一資料中讀取的欄位
+SOURCE_COLUMNS = ['路線', '卡號', '上車時間', '上車站名', '下車時間', '下車站名']
+
+# 旅程表的欄位順序
+JOURNEY_COLUMNS = ['卡號', '運具', '出發時間', '抵達時間', '起點', '迄點', '段數',
+                   '車上時間(分)', '旅程時間(分)', '轉乘等候(分)', '旅程是否完整']
+
+# 缺少下車時間時使用的哨兵值 (秒)
+MISSING_TIME = np.iinfo(np.int64).min
+
+# =============================================================================
+#  資料讀取
+# =============================================================================
+
+def load_taps(sources, chunk_size=1000000):
+    """
+    分塊讀取各運具的統一資料檔，只保留有卡號且上車時間有效的紀錄，並合併為一張表。
+
+    Args:
+        sources (dict): {運具名稱: 統一資料檔路徑}。
+
+    Returns:
+        pd.DataFrame or None: 欄位為 SOURCE_COLUMNS 加上 '運具'；所有檔案都讀取失敗時回傳 None。
+    """
+    parts = []
+    for mode, file_path in sources.items():
+        try:
+            reader = pd.read_csv(file_path, usecols=SOURCE_COLUMNS, chunksize=chunk_size, dtype=str, low_memory=False)
+            for chunk in reader:
+                chunk = chunk[has_card(chunk['卡號'])].copy()
+                chunk['上車時間'] = pd.to_datetime(chunk['上車時間'], errors='coerce')
+                chunk['下車時間'] = pd.to_datetime(chunk['下車時間'], errors='coerce')
+                chunk = chunk[chunk['上車時間'].notna()]
+                chunk['運具'] = mode
+                parts.append(chunk)
+        except FileNotFoundError:
+            print(f"警告：找不到 {mode} 的統一資料檔 '{file_path}'，將略過此運具。")
+    if not parts:
+        return None
+    taps = pd.concat(parts, ignore_index=True)
+    for col in ['路線', '上車站名', '下車站名', '運具']:
+        taps[col] = taps[col].astype('category')
+    return taps
+
+# =============================================================================
+#  串接邏輯
+# =============================================================================
+
+def _to_seconds(times):
+    """ 將 datetime Series 轉為 int64 秒數，缺值為 MISSING_TIME。 """
+    seconds = times.to_numpy(dtype='datetime64[s]').astype(np.int64)
+    seconds[times.isna().to_numpy()] = MISSING_TIME
+    return seconds
+
+
+def _new_journey_flags(cards, board, alight, routes, threshold):
+    """
+    numpy 向量化版本：標記每一段是否為新旅程的第一段 (資料需已依卡號與上車時間排序)。
+
+    下列任一情況視為新旅程：卡號改變、前一段沒有下車時間、間隔為負或超過門檻、與前一段搭乘同一路線 (視為回程)。
+    """
+    flags = np.ones(len(cards), dtype=bool)
+    if len(cards) > 1:
+        prev_alight = alight[:-1]
+        gap = board[1:] - prev_alight
+        linked = ((cards[1:] == cards[:-1]) & (prev_alight != MISSING_TIME)
+                  & (gap >= 0) & (gap <= threshold) & (routes[1:] != routes[:-1]))
+        flags[1:] = ~linked
+    return flags
+
+
+def _new_journey_flags_loop(cards, board, alight, routes, threshold):
+    """ 與 _new_journey_flags 相同的判斷，以單次迴圈寫成，供 numba 編譯。 """
+    n = len(cards)
+    flags = np.ones(n, dtype=np.bool_)
+    for i in range(1, n):
+        prev_alight = alight[i - 1]
+        if cards[i] != cards[i - 1] or prev_alight == MISSING_TIME or routes[i] == routes[i - 1]:
+            continue
+        gap = board[i] - prev_alight
+        if 0 <= gap <= threshold:
+            flags[i] = False
+    return flags
+
+
+if numba is not None:
+    _new_journey_flags_jit = numba.njit(cache=True)(_new_journey_flags_loop)
+else:
+    _new_journey_flags_jit = None
+
+
+def link_legs(taps, transfer_minutes=None, use_jit=True):
+    """
+    依 (卡號, 上車時間) 排序並標記旅程。
+
+    Args:
+        taps (pd.DataFrame): load_taps 的回傳值。
+        transfer_minutes (int, optional): 轉乘門檻 (分鐘)，預設為 config.JOURNEY_TRANSFER_MINUTES。
+        use_jit (bool): 有安裝 numba 時是否使用 JIT 版本。
+
+    Returns:
+        tuple: (排序後的資料, 每一段是否為新旅程的 bool 陣列)
+    """
+    transfer_minutes = transfer_minutes or config.JOURNEY_TRANSFER_MINUTES
+    taps = taps.sort_values(['卡號', '上車時間'], kind='stable', ignore_index=True)
+    cards = pd.factorize(taps['卡號'])[0].astype(np.int64)
+    routes = pd.factorize(taps['路線'])[0].astype(np.int64)
+    board, alight = _to_seconds(taps['上車時間']), _to_seconds(taps['下車時間'])
+    kernel = _new_journey_flags_jit if (use_jit and _new_journey_flags_jit is not None) else _new_journey_flags
+    return taps, kernel(cards, board, alight, routes, transfer_minutes * 60)
+
+# =============================================================================
+#  旅程彙整
+# =============================================================================
+
+def build_journeys(taps, transfer_minutes=None, use_jit=True):
+    """
+    將刷卡紀錄串成旅程。
+
+    由於排序後同一旅程的各段必定相鄰，以旅程的第一段與最後一段位置直接取值，
+    並用 np.add.reduceat 計算各旅程的合計，不需要 groupby。
+
+    Returns:
+        pd.DataFrame: 欄位為 JOURNEY_COLUMNS，每列一趟旅程。
+    """
+    taps, flags = link_legs(taps, transfer_minutes, use_jit)
+    starts = np.flatnonzero(flags)
+    ends = np.append(starts[1:], len(taps)) - 1
+
+    in_vehicle = (taps['下車時間'] - taps['上車時間']).dt.total_seconds().to_numpy() / 60
+    complete = ~np.isnan(in_vehicle)
+    mode_codes = taps['運具'].cat.codes.to_numpy()
+    mode_names = np.asarray(taps['運具'].cat.categories, dtype=object)
+    legs = ends - starts + 1
+    first_mode = mode_codes[starts]
+    is_mixed = np.add.reduceat(mode_codes != np.repeat(first_mode, legs), starts) > 0
+
+    journeys = pd.DataFrame({
+        '卡號': taps['卡號'].to_numpy()[starts],
+        '運具': np.where(is_mixed, '混合', mode_names[first_mode]),
+        '出發時間': taps['上車時間'].to_numpy()[starts],
+        '抵達時間': taps['下車時間'].to_numpy()[ends],
+        '起點': taps['上車站名'].to_numpy()[starts],
+        '迄點': taps['下車站名'].to_numpy()[ends],
+        '段數': legs,
+        '車上時間(分)': np.add.reduceat(np.nan_to_num(in_vehicle), starts).round(1),
+        '旅程是否完整': np.add.reduceat(~complete, starts) == 0,
+    })
+    journeys['旅程時間(分)'] = ((journeys['抵達時間'] - journeys['出發時間']).dt.total_seconds() / 60).round(1)
+    journeys['轉乘等候(分)'] = (journeys['旅程時間(分)'] - journeys['車上時間(分)']).round(1)
+    return journeys[JOURNEY_COLUMNS]
+
+
+def journey_od(journeys):
+    """
+    旅程層級的 OD 表 (只計入完整旅程)。
+
+    Returns:
+        pd.DataFrame: 欄位為 起點, 迄點, 旅程數, 多段旅程數, 平均段數, 平均旅程時間(分)，依旅程數排序。
+    """
+    complete = journeys[journeys['旅程是否完整']]
+    od = (complete.assign(多段=complete['段數'] > 1)
+          .groupby(['起點', '迄點'], observed=True)
+          .agg(旅程數=('段數', 'size'), 多段旅程數=('多段', 'sum'),
+               平均段數=('段數', 'mean'), **{'平均旅程時間(分)': ('旅程時間(分)', 'mean')})
+          .reset_index())
+    od[['平均段數', '平均旅程時間(分)']] = od[['平均段數', '平均旅程時間(分)']].round(2)
+    return od.sort_values('旅程數', ascending=False, ignore_index=True)
+
+# =============================================================================
+#  主流程
+# =============================================================================
+
+def run_trip_chaining(sources=None, output_dir=None, transfer_minutes=None):
+    """ 讀取市區公車與公路客運的統一資料，重建旅程並輸出旅程表、旅程 OD 表與段數分布。 """
+    sources = sources or {
+        '市區公車': config.BUS_UNIFIED_DATA_FILE,
+        '公路客運': config.HIGHWAY_BUS_UNIFIED_DATA_FILE,
+    }
+    output_dir = output_dir or config.JOURNEY_OUTPUT_DIR
+    transfer_minutes = transfer_minutes or config.JOURNEY_TRANSFER_MINUTES
+
+    taps = load_taps(sources)
+    if taps is None or taps.empty:
+        print("錯誤：沒有可用的刷卡紀錄，無法重建旅程。")
+        return None
+
+    engine = 'numba JIT' if _new_journey_flags_jit is not None else 'numpy 向量化'
+    print(f"--- [旅程重建] 共 {len(taps)} 段搭乘，轉乘門檻 {transfer_minutes} 分鐘 (串接方式: {engine}) ---")
+    journeys = build_journeys(taps, transfer_minutes)
+    leg_distribution = journeys['段數'].value_counts().sort_index().rename_axis('段數').reset_index(name='旅程數')
+    print(f"  - 重建出 {len(journeys)} 趟旅程，其中多段旅程 {int((journeys['段數'] > 1).sum())} 趟。")
+    print(leg_distribution.to_string(index=False))
+
+    os.makedirs(output_dir, exist_ok=True)
+    journeys.to_csv(os.path.join(output_dir, 'journeys.csv'), index=False, encoding='utf-8-sig')
+    journey_od(journeys).to_csv(os.path.join(output_dir, 'journey_od.csv'), index=False, encoding='utf-8-sig')
+    leg_distribution.to_csv(os.path.join(output_dir, 'journey_leg_distribution.csv'), index=False, encoding='utf-8-sig')
+    print(f"旅程表、旅程 OD 表與段數分布已儲存至: {output_dir}")
+    return journeys
+
+# --- 主程式執行區 ---
+if __name__ == '__main__':
+    run_trip_chaining()
@@ -19,6 +19,14 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from feature_store import sync_store, load_store, card_trip_counts, card_month_facts
+from fare_tiers import tier_counts
+from fare_simulator import build_spend_matrix, simulate_policies
+from od_utils import top_od_pairs
+from alighting_inference import has_alighting_stop
+
 def setup_visualization():
     """
     設定 Matplotlib 的視覺化樣式與中文字體。
@@ -41,7 +49,7 @@ def setup_visualization():
         print("警告：找不到可用的中文字體。圖表中的中文可能無法正常顯示。")
 
 
-def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_DATA_FILE):
+def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_DATA_FILE, store_dir=config.HIGHWAY_BUS_FEATURE_STORE_DIR):
     """
     分析公路客運資料，對定期票與非定期票用戶進行視覺化分析並儲存圖表。
     """
@@ -67,6 +75,13 @@ def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_
         print("警告：無資料可分析。")
         return
     
+    # --- 卡號層級統計 (由特徵儲存區讀取，保留月份維度) ---
+    sync_store(file_path, store_dir)
+    _, store_values = load_store(store_dir, keep_month=True)
+    if store_values is None:
+        print("警告：特徵儲存區為空，無法進行卡號層級的分析。")
+        return
+
     # --- 使用者分類 (定期票/非定期票) ---
     df['使用者類型'] = np.where(df['票種類型'] == '定期票', '定期票用戶', '非定期票用戶')
     
@@ -88,14 +103,12 @@ def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_
 
         # 1. 非定期票用戶高額消費分析
         print("\n[圖表 1] 產生非定期票用戶高額消費人數圖...")
-        monthly_spending = non_pass_users_df.groupby(['上車月份', '卡號'])['消費扣款'].sum().reset_index()
-        chart_data = []
-        for month in sorted(monthly_spending['上車月份'].dropna().astype(int).unique()):
-            month_data = monthly_spending[monthly_spending['上車月份'] == month]
-            # 公路客運的月票價格可能不同，但這裡暫時沿用199元作為一個觀察基準
-            spent_over_199 = month_data[month_data['消費扣款'] >= 199]['卡號'].nunique()
-            chart_data.append({'月份': month, '消費門檻': '>= 199 元', '人數': spent_over_199})
-        chart_df = pd.DataFrame(chart_data)
+        # 每卡每月的消費總額直接由「卡號 × 月份」事實表取得，並以 pd.cut + crosstab 一次完成分級
+        # 公路客運的月票價格可能不同，但這裡暫時沿用199元作為一個觀察基準
+        facts = card_month_facts(store_values)
+        facts = facts[facts['非定期票旅次數'] > 0]
+        tier_table = tier_counts(facts, [199], value_col='非定期票消費扣款')
+        chart_df = tier_table[['>= 199 元']].reset_index().melt(id_vars='月份', var_name='消費門檻', value_name='人數')
         
         print("\n--- [分析結果 1] 各月份非定期票用戶高額消費人數 (月消費>=199元) ---")
         print(chart_df.pivot(index='月份', columns='消費門檻', values='人數').fillna(0))
@@ -107,6 +120,13 @@ def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_
         plt.xlabel('月份', fontsize=12); plt.ylabel('潛在定期票轉換用戶數', fontsize=12)
         plt.savefig(os.path.join(output_dir, '1_non_pass_high_spending_counts.png'))
         plt.close(); print(" -> 圖表 1 已儲存。")
+
+        # 1-1. 票價方案試算：各卡號月份在 config.FARE_POLICIES 各方案下最划算的選擇與收入變化
+        policy_summary, _, _ = simulate_policies(build_spend_matrix({'公路客運': facts}))
+        print("\n--- [分析結果 1-1] 票價方案試算 (僅計入公路客運消費) ---")
+        print(policy_summary.to_string())
+        print("--------------------------------------------------\n")
+        policy_summary.to_csv(os.path.join(output_dir, '1_fare_policy_simulation.csv'), encoding='utf-8-sig')
         
         print("\n -> [註] 因非定期票用戶多為非電子票證，缺乏站牌資料，已跳過熱門站點與OD分析。")
 
@@ -191,9 +211,10 @@ def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_
 
     # 6. 定期票用戶最常搭乘OD
     print("\n[圖表 6] 產生定期票用戶最常搭乘OD圖...")
-    complete_trips = pass_users_df[pass_users_df['旅次是否完整'] == True].copy()
-    complete_trips['OD'] = complete_trips['上車站名'] + ' -> ' + complete_trips['下車站名']
-    top_od = complete_trips['OD'].value_counts().head(10)
+    # 完整旅次加上下車站為推估值的旅次
+    complete_trips = pass_users_df[has_alighting_stop(pass_users_df)]
+    # 以整數 OD 鍵值計數，只為前 10 名產生文字標籤
+    top_od = top_od_pairs(complete_trips['上車站名'], complete_trips['下車站名'], top_n=10)
     
     print("\n--- [分析結果 6] 定期票用戶最常搭乘的 10 個 OD ---")
     print(top_od)
@@ -226,7 +247,7 @@ def analyze_and_visualize_highway_bus_data(file_path=config.HIGHWAY_BUS_UNIFIED_
     
     # 8. Top 20 高頻率定期票用戶排行
     print("\n[圖表 8] 產生高頻率定期票用戶排行圖...")
-    top_20_users_series = pass_users_df['卡號'].value_counts().head(20)
+    top_20_users_series = card_trip_counts(values=store_values, ticket_type='定期票').nlargest(20)
     masked_card_ids = [f"...{cid[-4:]}" for cid in top_20_users_series.index]
     
     top_20_df_display = pd.DataFrame({
@@ -18,6 +18,19 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from time_bucket import add_time_of_day_columns
+from alighting_inference import infer_alighting_stops
+from heavy_hitters import save_ranking_sketches
+from quantile_sketch import save_travel_time_sketches
+from preview_sample import build_stratified_sample, save_sample, BUS_STRATA
+from row_store import build_row_store, BUS_INDEX_COLUMNS
+from clustered_store import write_clustered_store, BUS_LAYOUT
+from feature_store import write_store
+from card_sampling import sample_frame, describe_sampling
+from loader_backend import resolve_backend, load_with_polars
+
 # =============================================================================
 #  資料代碼對應 (根據 PDF 文件)
 # =============================================================================
@@ -132,11 +145,17 @@ def clean_and_enrich_data(df):
     df.loc[is_eticket_mask & is_incomplete_eticket, '旅次是否完整'] = False
     # (*** 修改區塊結束 ***)
 
+    # 3-1. 推估不完整旅次的下車站 (只補下車站名，並以「下車站來源」標記)
+    if config.INFER_ALIGHTING_STOPS:
+        print("  - 推估不完整旅次的下車站...")
+        df = infer_alighting_stops(df)
+
 
     # 4. 新增衍生欄位 (特徵工程)
     print("  - 新增分析用衍生欄位...")
     df['上車月份'] = df['上車時間'].dt.month
-    df['上車星期'] = df['上車時間'].dt.dayofweek
+    # 當日秒數 (int32) 與星期 (int8)：供通勤時間窗以整數範圍篩選 (下車欄位空值為 -1)
+    add_time_of_day_columns(df)
     df['上車小時'] = df['上車時間'].dt.hour
     df['日期類型'] = df['上車星期'].apply(lambda x: '假日' if x >= 5 else '平日')
     
@@ -147,7 +166,7 @@ def clean_and_enrich_data(df):
     # 將不完整旅次(包含非電子票證)的時長填 0
     # (備註: 非電子票證的旅次時長在此邏輯下也會是 0，因為它們的 complete_trips_mask 是 True，
     # 但 process_non_eticket_data 中設定了 下車時間 == 上車時間)
-    df['旅次時長(分)'].fillna(0, inplace=True) 
+    df['旅次時長(分)'] = df['旅次時長(分)'].fillna(0)
 
     print("資料清理與特徵工程完成。")
     return df
@@ -155,28 +174,8 @@ def clean_and_enrich_data(df):
 # =============================================================================
 #  主執行函式
 # =============================================================================
-def main():
-    """ 主函式，讀取所有公路客運檔案並進行處理與清理。 """
-    nrows_to_read = config.TEST_MODE_ROWS if config.TEST_MODE else None
-    if config.TEST_MODE:
-        print(f"--- [測試模式已啟用] ---\n所有檔案將只讀取前 {nrows_to_read} 行。\n" + "-"*26 + "\n")
-        
-    data_dir = config.HIGHWAY_BUS_RAW_DATA_DIR
-    files = glob.glob(os.path.join(data_dir, '*.csv'))
-    
-    if not files:
-        print(f"錯誤：在 '{data_dir}' 資料夾中找不到任何 .csv 檔案。")
-        return
-        
-    # *** 新增：檢查 config 中是否有篩選清單 ***
-    target_routes = config.HIGHWAY_BUS_TARGET_ROUTES
-    if target_routes:
-        print(f"--- [路線篩選已啟用] ---\n將只保留以下 {len(target_routes)} 條路線的資料：")
-        print(f"{', '.join(target_routes)}\n" + "-"*26 + "\n")
-    else:
-        print("--- [路線篩選未啟用] ---\n將處理所有偵測到的路線資料。\n" + "-"*26 + "\n")
-
-
+def load_with_pandas(files, target_routes=None):
+    """ pandas 後端：逐檔分塊讀取、檢核篩選、格式處理與路線篩選，合併後執行通用清理與特徵工程。 """
     all_data = [] # 用於收集所有檔案處理完的最終 DataFrame
     
     for file in files:
@@ -184,9 +183,8 @@ def main():
         
         # *** 核心修改：使用 chunksize 解決記憶體不足問題 ***
         try:
-            # 設定每個區塊的行數。
-            # 如果是測試模式，nrows_to_read 依然會生效。
-            # 如果不是測試模式，我們會一次處理 500,000 筆。
+            # 設定每個區塊的行數，一次處理 500,000 筆。
+            # 如果是測試模式，每個區塊只保留抽中卡號的旅次。
             chunk_size_to_use = 500000
             
             # 用於收集單一檔案中，所有已處理完畢的區塊
@@ -195,10 +193,12 @@ def main():
             # 準備 read_csv 的共用參數
             iterator_kwargs = {
                 'header': 0, 
-                'nrows': nrows_to_read, 
                 'low_memory': False, 
                 'on_bad_lines': 'skip'
             }
+            if config.TEST_MODE:
+                # 卡號以字串讀取，確保同一張卡在每個區塊得到相同的雜湊值
+                iterator_kwargs['dtype'] = {'卡號': str}
             
             # 檢查是否有 'Authority' 標頭問題
             try:
@@ -219,6 +219,12 @@ def main():
                     print(f"    - 正在處理第 {i+1} 區塊 (大小: {len(df_chunk)} 筆)...")
                     
                     try:
+                        # 0. 測試模式：只保留抽中卡號的旅次
+                        if config.TEST_MODE:
+                            df_chunk = sample_frame(df_chunk)
+                            if df_chunk.empty:
+                                continue
+
                         # --- 套用你原有的處理邏輯 ---
                         # 1. 檢核篩選
                         df_chunk = filter_by_validation_result(df_chunk)
@@ -267,18 +273,50 @@ def main():
 
     if not all_data:
         print("\n處理完成，但沒有產生任何有效資料 (可能所有資料都已被篩選掉)。")
-        return
+        return None
 
     # --- 合併與最終處理 (此處邏輯不變) ---
     print("\n開始合併所有已處理的資料...")
     final_df = pd.concat(all_data, ignore_index=True)
     final_df = clean_and_enrich_data(final_df)
+    return final_df
+
+def main():
+    """ 主函式，讀取所有公路客運檔案並進行處理與清理。 """
+    if config.TEST_MODE:
+        print(f"--- [測試模式已啟用] ---\n{describe_sampling()}\n" + "-"*26 + "\n")
+        
+    data_dir = config.HIGHWAY_BUS_RAW_DATA_DIR
+    files = glob.glob(os.path.join(data_dir, '*.csv'))
+    
+    if not files:
+        print(f"錯誤：在 '{data_dir}' 資料夾中找不到任何 .csv 檔案。")
+        return
+        
+    # *** 新增：檢查 config 中是否有篩選清單 ***
+    target_routes = config.HIGHWAY_BUS_TARGET_ROUTES
+    if target_routes:
+        print(f"--- [路線篩選已啟用] ---\n將只保留以下 {len(target_routes)} 條路線的資料：")
+        print(f"{', '.join(target_routes)}\n" + "-"*26 + "\n")
+    else:
+        print("--- [路線篩選未啟用] ---\n將處理所有偵測到的路線資料。\n" + "-"*26 + "\n")
+
+
+    backend = resolve_backend()
+    print(f"--- [資料處理後端: {backend}] ---")
+    if backend == 'polars':
+        final_df = load_with_polars(files, target_routes)
+    else:
+        final_df = load_with_pandas(files, target_routes)
+    if final_df is None:
+        return
     
     # 最終輸出的欄位 (已移除司機、車號，並新增衍生欄位)
     TARGET_COLUMNS = [
         '路線', '卡號', '持卡身分', '票種類型', '往返程', '上車時間', '上車站名',
         '下車時間', '下車站名', '消費扣款', '旅次是否完整', '上車月份',
-        '上車星期', '上車小時', '日期類型', '旅次時長(分)'
+        '上車星期', '上車小時', '日期類型', '旅次時長(分)',
+        '上車秒數', '下車秒數', '下車星期', '下車站來源'
     ]
     for col in TARGET_COLUMNS:
         if col not in final_df.columns:
@@ -298,5 +336,19 @@ def main():
     print(f"\n公路客運資料已成功整合、清理並儲存至: {output_filename}")
     print(f"最終整合資料筆數: {len(final_df)}")
 
+    # 卡號 × 月份的特徵儲存區 (逐月取代舊分割區)，分析腳本不需再掃描統一資料檔
+    write_store(final_df, config.HIGHWAY_BUS_FEATURE_STORE_DIR)
+    # 熱門 OD / 站點 / 路線排名的 sketch，分析時不需再對整份資料做 groupby
+    save_ranking_sketches(final_df, config.HIGHWAY_BUS_RANKING_SKETCH_DIR)
+    # 各路線、各 OD 的旅次時間分位數 sketch (依月份儲存，可跨月份合併)
+    save_travel_time_sketches(final_df, config.HIGHWAY_BUS_TRAVEL_TIME_SKETCH_DIR)
+    # 欄式 .npy 儲存區與卡號、站名的 CSR 列索引，單一卡號或站點的查詢不需讀入整份資料
+    build_row_store(final_df, config.HIGHWAY_BUS_ROW_STORE_DIR, BUS_INDEX_COLUMNS, TARGET_COLUMNS)
+    # 分層預覽樣本 (路線 × 月份 × 日期類型)，preview_sample.py 可由樣本快速估計各項彙總與信賴區間
+    final_df['月份'] = final_df['上車時間'].dt.strftime('%Y-%m')
+    save_sample(config.HIGHWAY_BUS_PREVIEW_SAMPLE_DIR, *build_stratified_sample(final_df, BUS_STRATA))
+    # 依月份分割、依 (路線, 上車時間) 排序的叢集化儲存，路線 / 時間區間的查詢只需讀取少數列群組
+    write_clustered_store(final_df, config.HIGHWAY_BUS_CLUSTERED_STORE_DIR, BUS_LAYOUT)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -23,6 +23,11 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from od_utils import top_od_pairs
+from card_sampling import read_csv_sampled, describe_sampling
+
 def setup_chinese_font():
     """
     設定 Matplotlib 以正確顯示中文。
@@ -42,17 +47,18 @@ def load_and_unify_data(ic_file_path, non_ic_file_path):
     讀取並整合電子票證與非電子票證的 CSV 檔案。
     """
     print("步驟 1: 開始讀取並整合公路客運資料...")
-    nrows_to_read = config.TEST_MODE_ROWS if config.TEST_MODE else None
     if config.TEST_MODE:
         print(f"--- [測試模式已啟用] ---")
-        print(f"所有 CSV 檔案將只讀取前 {nrows_to_read} 行。")
+        print(describe_sampling())
         print("--------------------------\n")
+    # 測試模式：串流讀取並只保留抽中卡號的旅次
+    read_csv = read_csv_sampled if config.TEST_MODE else pd.read_csv
 
     all_dfs = []
 
     # 讀取電子票證資料
     try:
-        df_ic = pd.read_csv(ic_file_path, skiprows=[1], header=0, nrows=nrows_to_read, low_memory=False)
+        df_ic = read_csv(ic_file_path, skiprows=[1], header=0, low_memory=False)
         # 欄位對應
         ic_cols = {
             '搭乘路線名稱': '路線',
@@ -73,7 +79,7 @@ def load_and_unify_data(ic_file_path, non_ic_file_path):
 
     # 讀取非電子票證資料
     try:
-        df_non_ic = pd.read_csv(non_ic_file_path, skiprows=[1], header=0, nrows=nrows_to_read, low_memory=False)
+        df_non_ic = read_csv(non_ic_file_path, skiprows=[1], header=0, low_memory=False)
         # 欄位對應
         non_ic_cols = {
             '搭乘路線名稱': '路線',
@@ -234,11 +240,11 @@ def plot_top_stations(df, output_dir, top_n=15):
 
 def plot_top_od_pairs(df, output_dir, top_n=10):
     print(f"正在生成圖表 6: 前 {top_n} 大旅運OD走廊分析...")
-    od_df = df.dropna(subset=['上車站名', '下車站名']).copy()
-    od_df['OD_Pair'] = od_df['上車站名'].astype(str) + ' → ' + od_df['下車站名'].astype(str)
+    od_df = df.dropna(subset=['上車站名', '下車站名'])
     # 排除 '未知' 的下車站
     od_df = od_df[od_df['下車站名'] != '未知']
-    od_counts = od_df['OD_Pair'].value_counts().head(top_n)
+    # 以整數 OD 鍵值計數，只為前 N 名產生文字標籤
+    od_counts = top_od_pairs(od_df['上車站名'].astype(str), od_df['下車站名'].astype(str), top_n=top_n, sep=' → ')
     if od_counts.empty:
         print("警告：找不到足夠的OD資料來生成圖表 6。")
         return
@@ -18,6 +18,11 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from alighting_inference import has_alighting_stop
+from quantile_sketch import duration_summary
+
 
 # --- 全域設定 ---
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
@@ -144,16 +149,26 @@ def plot_passenger_distribution(df):
 
 def plot_avg_trip_duration(df, n=15):
     print(f"正在產生圖表：前 {n} 名平均旅次時間最長路線...")
-    valid_duration_df = df[df['旅次時長(分)'] <= 180] # 篩選掉可能的異常值 (例如 > 3 小時)
-    avg_duration = valid_duration_df.groupby('路線')['旅次時長(分)'].mean().nlargest(n).sort_values(ascending=False)
+    # 平均與 p50 / p90 / p95 都由目前載入的資料、同一個有效旅次母體 (0 < 旅次時長 <= 180 分鐘) 計算；
+    # 旅次時長為 0 的是非電子票證或不完整旅次的填補值，超過 180 分鐘視為異常值
+    duration_report = duration_summary(df, ['路線'])
+    avg_duration = duration_report['平均'].nlargest(n).sort_values(ascending=False)
 
     print(f"\n--- 5. 前 {n} 名平均旅次時間最長路線結果 ---")
     print(avg_duration.round(2))
+
+    duration_report = duration_report.loc[avg_duration.index].round(2)
+    print("\n旅次時間分位數 (分鐘):")
+    print(duration_report)
+    duration_report.to_csv(os.path.join(output_folder, '5_各路線旅次時間分位數.csv'), encoding='utf-8-sig')
     print("------------------------------------------\n")
 
     plt.figure(figsize=(12, 9))
     sorted_avg_duration = avg_duration.sort_values()
     sns.barplot(y=sorted_avg_duration.index, x=sorted_avg_duration.values, orient='h', palette='coolwarm', hue=sorted_avg_duration.index, legend=False)
+    plt.scatter(duration_report.loc[sorted_avg_duration.index, 'p90'], range(len(sorted_avg_duration)),
+                marker='|', s=300, color='black', label='p90')
+    plt.legend()
     plt.title(f'公路客運 各路線平均旅次時間（前 {n} 名）', fontsize=18, fontweight='bold')
     plt.xlabel('平均旅次時間（分鐘）', fontsize=12)
     plt.ylabel('路線編號', fontsize=12)
@@ -202,7 +217,8 @@ def plot_top_stations(df, n=15):
 
 def plot_top_od_pairs(df, n=15):
     print(f"正在產生圖表：前 {n} 名主要交通廊帶...")
-    complete_trips_df = df[df['旅次是否完整'] == True]
+    # 完整旅次加上下車站為推估值的旅次
+    complete_trips_df = df[has_alighting_stop(df)]
     od_counts = complete_trips_df.groupby(['上車站名', '下車站名']).size().nlargest(n)
 
     print(f"\n--- 8. 前 {n} 名主要交通廊帶結果 ---")
@@ -5,6 +5,7 @@
 # 2. 自動掃描該路徑下所有的 .csv 檔案。
 # 3. 透過檢查檔案標頭是否包含 '卡號' 欄位，自動判斷為「電子票證」或「非電子票證」資料。
 # 4. 根據不同類型套用各自的清理邏輯，最後再全部合併。
+# 5. 固定使用 Dask 讀取 (不受 config.LOADER_BACKEND 影響)：Dask 已分區平行讀取，且後續分析都以 Dask DataFrame 進行。
 
 import pandas as pd
 import dask.dataframe as dd
@@ -21,6 +22,25 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from preview_sample import build_stratified_sample, save_sample, TRA_STRATA
+from card_sampling import read_csv_sampled, describe_sampling
+from clustered_store import write_clustered_store, TRA_LAYOUT, TRA_ARRIVAL_LAYOUT
+
+
+def save_clustered_stores(final_df):
+    """
+    由 load_and_save_data 的結果重建台鐵的叢集化儲存區：
+    依 (起點, 進站時間) 排序的 TRA_CLUSTERED_STORE_DIR 與依 (迄點, 出站時間) 排序的 TRA_ARRIVAL_CLUSTERED_STORE_DIR。
+    """
+    clustered_source = final_df.assign(
+        月份=final_df['日期'].dt.strftime('%Y-%m'),
+        進站時間=dd.to_datetime(final_df['進站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce'),
+        出站時間=dd.to_datetime(final_df['出站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce'))
+    write_clustered_store(clustered_source, config.TRA_CLUSTERED_STORE_DIR, TRA_LAYOUT)
+    write_clustered_store(clustered_source, config.TRA_ARRIVAL_CLUSTERED_STORE_DIR, TRA_ARRIVAL_LAYOUT)
+
 
 def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
     """
@@ -30,15 +50,15 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
     print("--- 開始載入並整合所有資料來源 (動態掃描模式) ---")
 
     # --- 測試模式設定 ---
-    nrows_to_read = config.TEST_MODE_ROWS if config.TEST_MODE else None
-    
     if config.TEST_MODE:
         print(f"--- [測試模式已啟用] ---")
-        print(f"所有 CSV 檔案將只讀取前 {nrows_to_read} 行。")
+        print(describe_sampling())
         print("--------------------------\n")
-        reader = pd  # 測試模式使用 Pandas
+        read_csv = read_csv_sampled  # 測試模式以 Pandas 串流讀取，只保留抽中卡號的旅次
     else:
-        reader = dd  # 正式模式使用 Dask
+        read_csv = dd.read_csv  # 正式模式使用 Dask
+        if config.LOADER_BACKEND != 'pandas':
+            print(f"提示：LOADER_BACKEND = '{config.LOADER_BACKEND}' 只適用於公車資料，台鐵維持以 Dask 讀取。")
 
     all_dfs = []
     data_dir = config.TRA_RAW_DATA_DIR
@@ -55,8 +75,6 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
         'skiprows': [1],
         'header': 0,
     }
-    if config.TEST_MODE:
-        read_csv_kwargs['nrows'] = nrows_to_read
 
     # --- 迭代處理所有掃描到的檔案 ---
     for file_path in files_to_process:
@@ -77,8 +95,8 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
             if '卡號' in columns and '刷卡進入車站名稱' in columns:
                 # --- 類型 A: 臺鐵電子票證資料(TO1A / TO2A) ---
                 print("偵測到 [電子票證] 格式...")
-                dtype_ic = {'刷卡進入車站代碼': 'object', '刷卡離開車站代碼': 'object', '票種次類型': 'object'}
-                df = reader.read_csv(file_path, dtype=dtype_ic, **read_csv_kwargs)
+                dtype_ic = {'刷卡進入車站代碼': 'object', '刷卡離開車站代碼': 'object', '票種次類型': 'object', '卡號': 'object'}
+                df = read_csv(file_path, dtype=dtype_ic, **read_csv_kwargs)
                 
                 df['人次'] = 1
                 df = df.rename(columns={
@@ -98,7 +116,7 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
                 df['票證分類'] = 'IC'
                 
                 # 確保欄位一致
-                required_cols = ['日期', '時段', '票證分類', '卡種', '身分', '起點', '迄點', '人次', '進站時間', '出站時間']
+                required_cols = ['日期', '時段', '票證分類', '卡號', '卡種', '身分', '起點', '迄點', '人次', '進站時間', '出站時間']
                 # 補上可能缺少的欄位 (例如 '票種')
                 if '票種' not in df.columns:
                     df['票種'] = 'N/A' 
@@ -110,7 +128,7 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
                 # --- 類型 B: 臺鐵非電子票證資料 ---
                 print("偵測到 [非電子票證] 格式...")
                 dtype_non_ic = {'票面起站車站代碼': 'object', '票面迄站車站代碼': 'object', '票種次類型': 'object'}
-                df = reader.read_csv(file_path, dtype=dtype_non_ic, **read_csv_kwargs)
+                df = read_csv(file_path, dtype=dtype_non_ic, **read_csv_kwargs)
                 
                 df['人次'] = 1
                 df = df.rename(columns={
@@ -125,11 +143,12 @@ def load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE):
                     
                 df['時段'] = dd.to_datetime(df['進站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce').dt.hour
                 df['票證分類'] = 'N-IC'
+                df['卡號'] = 'N/A'
                 df['卡種'] = 'N/A'
                 df['身分'] = 'N/A'
                 
                 # 確保欄位一致
-                required_cols = ['日期', '時段', '票證分類', '卡種', '身分', '起點', '迄點', '人次', '進站時間', '出站時間']
+                required_cols = ['日期', '時段', '票證分類', '卡號', '卡種', '身分', '起點', '迄點', '人次', '進站時間', '出站時間']
                 
                 all_dfs.append(df[required_cols])
                 print(f"成功載入: {file_name}")
@@ -181,4 +200,12 @@ if __name__ == '__main__':
     if final_df is not None:
         print("\n--- 資料處理完成，以下為前 5 筆資料預覽 ---")
         # 使用 Dask 的 .head()
-        print(final_df.head())
\ No newline at end of file
+        print(final_df.head())
+
+        # 分層預覽樣本 (起點 × 月份 × 日期類型)，preview_sample.py 可由樣本快速估計各項彙總與信賴區間
+        sample_source = final_df.assign(月份=final_df['日期'].dt.strftime('%Y-%m'))
+        save_sample(config.TRA_PREVIEW_SAMPLE_DIR, *build_stratified_sample(sample_source, TRA_STRATA))
+
+        # 依月份分割、依 (起點, 進站時間) 與 (迄點, 出站時間) 排序的叢集化儲存，
+        # 車站 / 時間區間的查詢 (出發與到達) 只需讀取少數列群組
+        save_clustered_stores(final_df)
\ No newline at end of file
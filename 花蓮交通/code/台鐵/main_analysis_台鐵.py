@@ -4,7 +4,7 @@ matplotlib.use('Agg')
 import pandas as pd
 import dask.dataframe as dd
 # 修正：匯入正確的函式名稱
-from data_loader import load_and_save_data
+from data_loader import load_and_save_data, save_clustered_stores
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import seaborn as sns
@@ -20,6 +20,14 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from time_bucket import (time_to_slot, label_to_day_type, dask_bucket_counts, counts_to_frame,
+                         peak_windows, slot_to_time)
+from heavy_hitters import dask_sketch, candidates
+from quantile_sketch import dask_quantile_sketch, save_quantile_sketch, quantiles
+import query_layer
+
 # ==============================================================================
 # 建立輸出資料夾
 # ==============================================================================
@@ -57,12 +65,44 @@ def setup_chinese_font():
 setup_chinese_font()
 
 
+# ==============================================================================
+# 熱門 OD 排名 (預設使用可合併的 sketch，不對所有 OD 組合做全域 groupby)
+# ==============================================================================
+def top_od(ddf, n):
+    """
+    取得人次最高的前 n 個 OD。
+    config.USE_RANKING_SKETCH 為 True 時，各分割區各自彙整成 Space-Saving sketch 後合併，
+    避免全域 groupby 讓 Dask 溢寫到磁碟；sketch 只用來挑出候選 OD，
+    再對候選 OD 精確重新計數，因此回傳的人次與 groupby().sum().nlargest(n) 相同。
+    """
+    if not config.USE_RANKING_SKETCH:
+        return ddf.groupby(['起點', '迄點'])['人次'].sum().nlargest(n).compute()
+    sketch = dask_sketch(ddf, ['起點', '迄點'], '人次')
+    pairs, complete = candidates(sketch, n)
+    if not complete:
+        print(f"警告：sketch 容量不足，前 {n} 名可能有遺漏，請調高 config.RANKING_SKETCH_CAPACITY。")
+    origins, destinations = pairs.get_level_values(0).unique(), pairs.get_level_values(1).unique()
+    subset = ddf[ddf['起點'].isin(list(origins)) & ddf['迄點'].isin(list(destinations))]
+    exact = subset.groupby(['起點', '迄點'])['人次'].sum().compute()
+    return exact[exact.index.isin(pairs)].nlargest(n).rename('人次')
+
+
 # ==============================================================================
 # 核心步驟：載入並準備所有資料
 # ==============================================================================
 # 修正：呼叫正確的函式
 all_data = load_and_save_data()
 
+# ==============================================================================
+# SQL 查詢層 (選用)：熱門 OD、縣市間流量與熱門車站改由 DuckDB 計算
+# ==============================================================================
+# 叢集化儲存區由上一次的 data_loader 產生，可能與剛載入的 all_data 不一致；
+# 先由 all_data 重建儲存區再重新登錄 view，讓 SQL 與 Dask 的結果來自同一份資料
+sql_con = query_layer.connect(['tra']) if config.USE_SQL_LAYER and all_data is not None else None
+if sql_con is not None:
+    save_clustered_stores(all_data)
+    query_layer.register_view(sql_con, 'tra')
+
 if all_data is not None:
 
     # ==============================================================================
@@ -95,7 +135,10 @@ if all_data is not None:
     # 分析一：黃金路線分析 (熱門OD)
     # ==============================================================================
     print("\n--- [分析一：黃金路線分析] ---")
-    hot_od = all_data.groupby(['起點', '迄點'])['人次'].sum().nlargest(20).compute()
+    if sql_con is not None:
+        hot_od = query_layer.top_od(sql_con, 'tra', 20, stations=target_stations).set_index(['起點', '迄點'])['人次']
+    else:
+        hot_od = top_od(all_data, 20)
     print(f"{analysis_title_region} 區間客運量最高的 Top 20 路線 (OD):")
     print(hot_od)
     output_path = os.path.join(output_csv_dir, 'analysis_hot_od.csv')
@@ -121,39 +164,50 @@ if all_data is not None:
     # ==============================================================================
     # 分析二：尖峰時段分析 (高精度 - 5分鐘間隔)
     # ==============================================================================
-    print("\n--- [分析二：尖峰時段分析 (高精度 - 5分鐘間隔)] ---")
+    bucket_minutes = config.TIME_BUCKET_MINUTES
+    slots_per_hour = 60 // bucket_minutes
+    print(f"\n--- [分析二：尖峰時段分析 (高精度 - {bucket_minutes}分鐘間隔)] ---")
     print("註：此分析僅針對有提供進站時間的電子票證與非電子票證資料。")
 
     # 1. 複製資料以便進行此項專門分析
     data_for_5min = all_data.copy()
 
-    # 2. 建立一個統一的、精確到分鐘的時間欄位
+    # 2. 建立精確到分鐘的時間欄位，並預先轉為 int16 時段代碼與 int8 日類型代碼
     data_for_5min['進站時間'] = dd.to_datetime(
         data_for_5min['進站時間'],
         format='%Y-%m-%d %H:%M:%S',
         errors='coerce'
     )
     data_for_5min = data_for_5min.dropna(subset=['進站時間'])
+    data_for_5min['進站時段'] = time_to_slot(data_for_5min['進站時間'], bucket_minutes)
+    data_for_5min['日類型代碼'] = data_for_5min['日期類型'].map_partitions(label_to_day_type, meta=('日期類型', 'int8'))
 
-    minute_of_day = data_for_5min['進站時間'].dt.hour * 60 + data_for_5min['進站時間'].dt.minute
-    data_for_5min['時段_5分'] = (minute_of_day // 5).astype(int)
+    # 3. 每個分區各做一次 bincount 後相加 (取代 pivot_table)
+    counts = dask_bucket_counts(data_for_5min[['進站時段', '日類型代碼', '人次']], '進站時段', '日類型代碼',
+                                weight_col='人次', bucket_minutes=bucket_minutes)
+    peak_5min = counts_to_frame(counts, bucket_minutes)
+    peak_5min.columns.name = '日期類型'
 
-    # 3. 進行 pivot table 計算
-    peak_5min = data_for_5min.pivot_table(index='時段_5分', columns='日期類型', values='人次', aggfunc='sum').compute()
-    peak_5min = peak_5min.fillna(0).astype(int)
-
-    print("平日 vs. 假日 各時段旅運量分佈 (每5分鐘):")
+    print(f"平日 vs. 假日 各時段旅運量分佈 (每{bucket_minutes}分鐘):")
     print(peak_5min)
-    output_path = os.path.join(output_csv_dir, 'analysis_peak_5min.csv')
+    output_path = os.path.join(output_csv_dir, f'analysis_peak_{bucket_minutes}min.csv')
     peak_5min.to_csv(output_path, encoding='utf-8-sig')
     print(f"高精度分析結果已儲存至 {output_path}")
 
+    # 連續尖峰區間 (例如最繁忙的 60 分鐘)
+    peak_window_df = peak_windows(peak_5min, config.PEAK_WINDOW_MINUTES, bucket_minutes)
+    print(f"\n平日 vs. 假日 最繁忙的連續 {config.PEAK_WINDOW_MINUTES} 分鐘:")
+    print(peak_window_df)
+    output_path = os.path.join(output_csv_dir, f'analysis_peak_window_{config.PEAK_WINDOW_MINUTES}min.csv')
+    peak_window_df.to_csv(output_path, encoding='utf-8-sig')
+    print(f"尖峰區間結果已儲存至 {output_path}")
+
     # 4. 分成多張圖表繪製
     time_chunks = {
-        "清晨 (00-06點)": (0, 6 * 12),
-        "上午 (06-12點)": (6 * 12, 12 * 12),
-        "下午 (12-18點)": (12 * 12, 18 * 12),
-        "傍晚至午夜 (18-24點)": (18 * 12, 24 * 12)
+        "清晨 (00-06點)": (0, 6 * slots_per_hour),
+        "上午 (06-12點)": (6 * slots_per_hour, 12 * slots_per_hour),
+        "下午 (12-18點)": (12 * slots_per_hour, 18 * slots_per_hour),
+        "傍晚至午夜 (18-24點)": (18 * slots_per_hour, 24 * slots_per_hour)
     }
 
     for title, (start_block, end_block) in time_chunks.items():
@@ -163,28 +217,23 @@ if all_data is not None:
             print(f"\n時間區塊 '{title}' 沒有資料，跳過繪圖。")
             continue
 
-        def block_to_time(block):
-            hour = block * 5 // 60
-            minute = block * 5 % 60
-            return f'{hour:02d}:{minute:02d}'
-
-        chunk_data.index = chunk_data.index.map(block_to_time)
+        chunk_data.index = chunk_data.index.map(lambda block: slot_to_time(block, bucket_minutes))
 
         plt.figure(figsize=(15, 7))
         ax = sns.lineplot(data=chunk_data, marker='.', dashes=False, markersize=8)
 
-        plt.title(f'尖峰時段分析 (5分鐘間隔) - {title}', fontsize=18)
+        plt.title(f'尖峰時段分析 ({bucket_minutes}分鐘間隔) - {title}', fontsize=18)
         plt.xlabel('時間', fontsize=12)
         plt.ylabel('總人次', fontsize=12)
 
-        ax.xaxis.set_major_locator(mticker.MultipleLocator(6))
+        ax.xaxis.set_major_locator(mticker.MultipleLocator(max(slots_per_hour // 2, 1)))
         plt.xticks(rotation=45)
 
         plt.grid(True, linestyle='--')
         plt.legend(title='日期類型')
         plt.tight_layout()
 
-        chart_filename = f'chart_peak_5min_{title.split(" ")[0]}.png'
+        chart_filename = f'chart_peak_{bucket_minutes}min_{title.split(" ")[0]}.png'
         chart_path = os.path.join(output_chart_dir, chart_filename)
         plt.savefig(chart_path, dpi=300)
         plt.close()
@@ -278,6 +327,18 @@ if all_data is not None:
     avg_travel_time.to_csv(output_path, encoding='utf-8-sig')
     print(f"結果已儲存至 {output_path}")
 
+    # --- 旅次時間分位數：各分割區建立「月份 × OD × 對數桶」計數表後合併，不需排序整份資料 ---
+    time_df['月份'] = time_df['進站時間'].dt.strftime('%Y-%m')
+    travel_time_sketch = dask_quantile_sketch(time_df, ['月份', '起點', '迄點'], '旅次時間(分)')
+    save_quantile_sketch(travel_time_sketch, os.path.join(output_csv_dir, 'travel_time_sketch_od.csv'))
+    od_quantiles = quantiles(travel_time_sketch, ['起點', '迄點']).reindex(avg_travel_time.index)
+    od_quantiles.insert(1, '平均', avg_travel_time)
+    print("平均旅次時間最長 Top 20 路線的旅次時間分位數 (分鐘):")
+    print(od_quantiles.round(2))
+    output_path = os.path.join(output_csv_dir, 'analysis_travel_time_percentiles.csv')
+    od_quantiles.round(2).to_csv(output_path, encoding='utf-8-sig')
+    print(f"結果已儲存至 {output_path}")
+
     # --- 繪圖 (Seaborn) ---
     plt.figure(figsize=(10, 8))
     avg_travel_time_df = avg_travel_time.reset_index()
@@ -299,11 +360,11 @@ if all_data is not None:
     print("\n--- [分析六：通勤走廊識別] ---")
     weekday_df = all_data[all_data['日期類型'] == '平日']
 
-    morning_commute = weekday_df[weekday_df['時段'].isin([7, 8])].groupby(['起點', '迄點'])['人次'].sum().nlargest(10).compute()
+    morning_commute = top_od(weekday_df[weekday_df['時段'].isin([7, 8])], 10)
     print("平日上午尖峰(7-9點) Top 10 通勤路線:")
     print(morning_commute)
 
-    evening_commute = weekday_df[weekday_df['時段'].isin([17, 18])].groupby(['起點', '迄點'])['人次'].sum().nlargest(10).compute()
+    evening_commute = top_od(weekday_df[weekday_df['時段'].isin([17, 18])], 10)
     print("\n平日傍晚尖峰(17-19點) Top 10 通勤路線:")
     print(evening_commute)
 
@@ -353,7 +414,10 @@ if all_data is not None:
     all_data['迄點縣市'] = all_data['迄點'].map(station_to_city, meta=('迄點縣市', 'object'))
 
     # 2. 計算縣市間流量
-    county_to_county = all_data.groupby(['起點縣市', '迄點縣市'])['人次'].sum().compute()
+    if sql_con is not None:
+        county_to_county = query_layer.county_flows(sql_con, 'tra', station_to_city).set_index(['起點縣市', '迄點縣市'])['人次']
+    else:
+        county_to_county = all_data.groupby(['起點縣市', '迄點縣市'])['人次'].sum().compute()
     final_summary = county_to_county[county_to_county > 0].sort_values(ascending=False)
 
     print("\n--- 特定路線流量分析結果 ---")
@@ -386,10 +450,14 @@ if all_data is not None:
     # ==============================================================================
     print("\n--- [分析八：熱門車站分析] ---")
 
-    arrivals = all_data.groupby('迄點')['人次'].sum()
-    departures = all_data.groupby('起點')['人次'].sum()
-    total_station_traffic = arrivals.add(departures, fill_value=0)
-    hot_stations = total_station_traffic.nlargest(20).compute()
+    if sql_con is not None:
+        hot_stations = query_layer.station_traffic(sql_con, 'tra', 20, stations=target_stations) \
+            .set_index('車站')['總人次'].rename_axis(None).rename(None)
+    else:
+        arrivals = all_data.groupby('迄點')['人次'].sum()
+        departures = all_data.groupby('起點')['人次'].sum()
+        total_station_traffic = arrivals.add(departures, fill_value=0)
+        hot_stations = total_station_traffic.nlargest(20).compute()
 
     print(f"{analysis_title_region} 區間客運量最高的 Top 20 車站:")
     print(hot_stations)
@@ -20,12 +20,107 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from time_bucket import (time_to_slot, label_to_day_type, bucket_counts, counts_to_frame,
+                         peak_windows, slot_to_time)
+from station_batch import resolve_stations, build_station_batch_table, station_peak_frame, station_peak_summary
+from clustered_store import read_clustered
+
+# --- 繪圖函式 ---
+def plot_peak_chunks(station_peak_df, station_name, output_chart_dir, bucket_minutes):
+    """
+    將 (時段 × 類型) 的上下車流量表依四個時段分別繪圖。
+    """
+    slots_per_hour = 60 // bucket_minutes
+    slot_col = station_peak_df.index.name
+    def block_to_time(block): return slot_to_time(block, bucket_minutes)
+
+    time_chunks = {
+        "清晨 (00-06點)": (0, 6 * slots_per_hour), "上午 (06-12點)": (6 * slots_per_hour, 12 * slots_per_hour),
+        "下午 (12-18點)": (12 * slots_per_hour, 18 * slots_per_hour), "傍晚至午夜 (18-24點)": (18 * slots_per_hour, 24 * slots_per_hour)
+    }
+
+    for title, (start_block, end_block) in time_chunks.items():
+        chunk_data = station_peak_df.loc[start_block : end_block-1]
+        if chunk_data.empty or chunk_data.sum().sum() == 0:
+            print(f"\n時間區塊 '{title}' 沒有資料，跳過繪圖。")
+            continue
+        
+        chunk_data.index = chunk_data.index.map(block_to_time)
+        plt.figure(figsize=(15, 8))
+        plot_data = chunk_data.reset_index().melt(id_vars=slot_col, var_name='類型', value_name='人次')
+        ax = sns.lineplot(data=plot_data, x=slot_col, y='人次', hue='類型', style='類型', markers=True, dashes=False, markersize=7, palette='tab10')
+        plt.title(f'{station_name} 車站尖峰時段分析 - {title}', fontsize=18, pad=20)
+        plt.xlabel('時間', fontsize=12); plt.ylabel('總人次', fontsize=12)
+        ax.xaxis.set_major_locator(mticker.MultipleLocator(max(slots_per_hour // 2, 1)))
+        plt.xticks(rotation=45, ha='right'); plt.grid(True, which='both', linestyle='--', linewidth=0.5)
+        plt.legend(title='類型', bbox_to_anchor=(1.02, 1), loc='upper left'); plt.tight_layout(rect=[0, 0, 0.9, 1])
+        
+        safe_title = title.split(" ")[0]
+        chart_filename = f'tra_transfer_{station_name}_peak_{safe_title}.png'
+        chart_path = os.path.join(output_chart_dir, chart_filename)
+        plt.savefig(chart_path, dpi=300); plt.close()
+        print(f"圖表已儲存至 {chart_path}")
+
+def run_batch_analysis(all_data, batch_setting, output_csv_dir, output_chart_dir):
+    """
+    批次模式：只計算一次所需欄位，再以一次 bincount 與 groupby 算出多個車站的
+    上下車剖面與平日通勤排名，輸出成單一長表。
+    """
+    bucket_minutes = config.TIME_BUCKET_MINUTES
+    columns = ['起點', '迄點', '進站時間', '出站時間', '日期類型', '人次']
+    trips = all_data[columns].compute()
+    trips['進站時間'] = pd.to_datetime(trips['進站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    trips['出站時間'] = pd.to_datetime(trips['出站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+
+    stations = resolve_stations(batch_setting, pd.concat([trips['起點'], trips['迄點']]).unique())
+    print(f"\n--- [批次分析：{len(stations)} 個台鐵車站的尖峰時段與通勤排名] ---")
+    tidy = build_station_batch_table(trips, '起點', '迄點', '進站時間', '出站時間', stations,
+                                     weight_col='人次', day_type_col='日期類型',
+                                     bucket_minutes=bucket_minutes, top_n=config.TRANSFER_TOP_N)
+
+    output_path = os.path.join(output_csv_dir, f'tra_transfer_all_stations_{bucket_minutes}min.csv')
+    tidy.to_csv(output_path, index=False, encoding='utf-8-sig')
+    print(f"批次分析長表 (共 {len(tidy)} 列) 已儲存至 {output_path}")
+
+    # 各車站最繁忙的連續尖峰區間 (所有車站一次計算)
+    if stations:
+        peak_summary = station_peak_summary(tidy, stations, config.PEAK_WINDOW_MINUTES, bucket_minutes,
+                                            layout='{day_type}_{direction}')
+        output_path = os.path.join(output_csv_dir, f'tra_transfer_all_stations_peak_window_{config.PEAK_WINDOW_MINUTES}min.csv')
+        peak_summary.to_csv(output_path, index=False, encoding='utf-8-sig')
+        print(f"各車站連續尖峰區間已儲存至 {output_path}")
+
+    if config.TRANSFER_RENDER_CHARTS:
+        for station in stations:
+            plot_peak_chunks(station_peak_frame(tidy, station, bucket_minutes, layout='{day_type}_{direction}'),
+                             station, output_chart_dir, bucket_minutes)
+
+def load_station_data(store_dir, station_name, arrival_store_dir=None):
+    """
+    由叢集化儲存區讀取與指定車站相關的旅次：出發的旅次讀取依起點排序的 store_dir，
+    到達的旅次讀取依迄點排序的 arrival_store_dir，兩邊都只需讀取少數列群組。
+    arrival_store_dir 不存在時改由 store_dir 讀取 (無法略過列群組，等同掃描全部資料)。
+    在該站出發又回到該站的旅次只保留一筆。儲存區不存在時回傳 None。
+    """
+    columns = ['起點', '迄點', '進站時間', '出站時間', '日期類型', '人次']
+    departures = read_clustered(store_dir, {'起點': station_name}, columns)
+    if departures is None:
+        return None
+    arrivals = read_clustered(arrival_store_dir, {'迄點': station_name}, columns) if arrival_store_dir else None
+    if arrivals is None:
+        arrivals = read_clustered(store_dir, {'迄點': station_name}, columns)
+    arrivals = arrivals[arrivals['起點'] != station_name]
+    return pd.concat([departures, arrivals], ignore_index=True)
+
 # --- 主程式執行區塊 ---
 def main():
     TARGET_STATION_NAME = config.TRA_TRANSFER_STATION
+    BATCH_STATIONS = config.TRA_TRANSFER_STATIONS
 
-    if not TARGET_STATION_NAME:
-        print("設定檔 (config.py) 中未指定台鐵轉乘分析車站 (TRA_TRANSFER_STATION)。")
+    if not TARGET_STATION_NAME and not BATCH_STATIONS:
+        print("設定檔 (config.py) 中未指定台鐵轉乘分析車站 (TRA_TRANSFER_STATION 或 TRA_TRANSFER_STATIONS)。")
         print("將跳過此分析腳本。")
         return
 
@@ -48,92 +143,75 @@ def main():
     except Exception as e:
         print(f"警告：設定字體時發生錯誤: {e}")
 
-    # 載入資料
-    all_data = load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE)
+    # 單一車站分析：有叢集化儲存區時只讀取該站相關的列群組，不需重新整合全部原始資料
+    station_data = None if BATCH_STATIONS else load_station_data(
+        config.TRA_CLUSTERED_STORE_DIR, TARGET_STATION_NAME, config.TRA_ARRIVAL_CLUSTERED_STORE_DIR)
 
-    if all_data is None:
-        print("無法載入資料，分析中止。")
-        return
+    if station_data is None:
+        # 載入資料
+        all_data = load_and_save_data(output_filename=config.TRA_UNIFIED_DATA_FILE)
+
+        if all_data is None:
+            print("無法載入資料，分析中止。")
+            return
+
+        if BATCH_STATIONS:
+            run_batch_analysis(all_data, BATCH_STATIONS, output_csv_dir, output_chart_dir)
+            print("\n\n所有分析已完成！")
+            return
+
+        data_for_peak = all_data.copy()
+        data_for_peak['進站時間'] = dd.to_datetime(data_for_peak['進站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        data_for_peak['出站時間'] = dd.to_datetime(data_for_peak['出站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+
+        station_data_dd = data_for_peak[
+            (data_for_peak['起點'] == TARGET_STATION_NAME) | (data_for_peak['迄點'] == TARGET_STATION_NAME)
+        ]
+        station_data = station_data_dd.compute()
 
     # 分析特定車站尖峰時段
     print(f"\n--- [分析：{TARGET_STATION_NAME}車站尖峰時段分析 (含平日/假日)] ---")
-    data_for_peak = all_data.copy()
-    data_for_peak['進站時間'] = dd.to_datetime(data_for_peak['進站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-    data_for_peak['出站時間'] = dd.to_datetime(data_for_peak['出站時間'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
-
-    station_data_dd = data_for_peak[
-        (data_for_peak['起點'] == TARGET_STATION_NAME) | (data_for_peak['迄點'] == TARGET_STATION_NAME)
-    ]
-    station_data = station_data_dd.compute()
     print(f"已篩選出與 {TARGET_STATION_NAME} 站相關的資料共 {len(station_data)} 筆，開始計算...")
 
+    bucket_minutes = config.TIME_BUCKET_MINUTES
+
+    # 預先建立 int16 時段代碼與 int8 日類型代碼，再以 bincount 計數 (取代 pivot_table)
     # 計算上車人次
-    departures = station_data[station_data['起點'] == TARGET_STATION_NAME].dropna(subset=['進站時間']).copy()
-    dep_pivot = pd.DataFrame()
-    if not departures.empty:
-        minute_of_day_dep = departures['進站時間'].dt.hour * 60 + departures['進站時間'].dt.minute
-        departures['時段_5分'] = (minute_of_day_dep // 5).astype(int)
-        dep_pivot = departures.pivot_table(index='時段_5分', columns='日期類型', values='人次', aggfunc='sum')
-        dep_pivot.columns = [f'{col}_上車' for col in dep_pivot.columns]
+    departures = station_data[(station_data['起點'] == TARGET_STATION_NAME) & station_data['進站時間'].notna()]
+    dep_counts = bucket_counts(time_to_slot(departures['進站時間'], bucket_minutes), label_to_day_type(departures['日期類型']),
+                               departures['人次'], bucket_minutes)
 
     # 計算下車人次
-    arrivals = station_data[station_data['迄點'] == TARGET_STATION_NAME].dropna(subset=['出站時間']).copy()
-    arr_pivot = pd.DataFrame()
-    if not arrivals.empty:
-        minute_of_day_arr = arrivals['出站時間'].dt.hour * 60 + arrivals['出站時間'].dt.minute
-        arrivals['時段_5分'] = (minute_of_day_arr // 5).astype(int)
-        arr_pivot = arrivals.pivot_table(index='時段_5分', columns='日期類型', values='人次', aggfunc='sum')
-        arr_pivot.columns = [f'{col}_下車' for col in arr_pivot.columns]
+    arrivals = station_data[(station_data['迄點'] == TARGET_STATION_NAME) & station_data['出站時間'].notna()]
+    arr_counts = bucket_counts(time_to_slot(arrivals['出站時間'], bucket_minutes), label_to_day_type(arrivals['日期類型']),
+                               arrivals['人次'], bucket_minutes)
 
     # 合併資料
-    full_day_index = pd.Index(range(24 * 12), name='時段_5分')
-    station_peak_df = pd.DataFrame(index=full_day_index).join(dep_pivot).join(arr_pivot).fillna(0).astype(int)
-    
-    expected_cols = ['平日_上車', '假日_上車', '平日_下車', '假日_下車']
-    for col in expected_cols:
-        if col not in station_peak_df.columns:
-            station_peak_df[col] = 0
-    station_peak_df = station_peak_df[expected_cols]
+    station_peak_df = counts_to_frame(dep_counts, bucket_minutes, suffix='_上車').join(
+        counts_to_frame(arr_counts, bucket_minutes, suffix='_下車'))
+    station_peak_df = station_peak_df[['平日_上車', '假日_上車', '平日_下車', '假日_下車']]
 
     # 顯示與儲存
-    print(f"\n--- [文字報表：{TARGET_STATION_NAME}站各時段上、下車旅運量 (每5分鐘)] ---")
-    def block_to_time(block): return f'{block * 5 // 60:02d}:{block * 5 % 60:02d}'
+    print(f"\n--- [文字報表：{TARGET_STATION_NAME}站各時段上、下車旅運量 (每{bucket_minutes}分鐘)] ---")
+    def block_to_time(block): return slot_to_time(block, bucket_minutes)
     display_df = station_peak_df.copy()
     display_df.index = display_df.index.map(block_to_time)
     display_df.index.name = '時間'
     print(display_df.to_string())
     
-    output_path = os.path.join(output_csv_dir, f'tra_transfer_{TARGET_STATION_NAME}_peak_5min.csv')
+    output_path = os.path.join(output_csv_dir, f'tra_transfer_{TARGET_STATION_NAME}_peak_{bucket_minutes}min.csv')
     station_peak_df.to_csv(output_path, encoding='utf-8-sig')
     print(f"\n{TARGET_STATION_NAME}站尖峰分析結果已儲存至 {output_path}")
 
-    # 繪圖
-    time_chunks = {
-        "清晨 (00-06點)": (0, 6 * 12), "上午 (06-12點)": (6 * 12, 12 * 12),
-        "下午 (12-18點)": (12 * 12, 18 * 12), "傍晚至午夜 (18-24點)": (18 * 12, 24 * 12)
-    }
+    # 連續尖峰區間
+    peak_window_df = peak_windows(station_peak_df, config.PEAK_WINDOW_MINUTES, bucket_minutes)
+    print(f"\n--- [{TARGET_STATION_NAME}站最繁忙的連續 {config.PEAK_WINDOW_MINUTES} 分鐘] ---")
+    print(peak_window_df)
+    output_path = os.path.join(output_csv_dir, f'tra_transfer_{TARGET_STATION_NAME}_peak_window_{config.PEAK_WINDOW_MINUTES}min.csv')
+    peak_window_df.to_csv(output_path, encoding='utf-8-sig')
 
-    for title, (start_block, end_block) in time_chunks.items():
-        chunk_data = station_peak_df.loc[start_block : end_block-1]
-        if chunk_data.empty or chunk_data.sum().sum() == 0:
-            print(f"\n時間區塊 '{title}' 沒有資料，跳過繪圖。")
-            continue
-        
-        chunk_data.index = chunk_data.index.map(block_to_time)
-        plt.figure(figsize=(15, 8))
-        plot_data = chunk_data.reset_index().melt(id_vars='時段_5分', var_name='類型', value_name='人次')
-        ax = sns.lineplot(data=plot_data, x='時段_5分', y='人次', hue='類型', style='類型', markers=True, dashes=False, markersize=7, palette='tab10')
-        plt.title(f'{TARGET_STATION_NAME} 車站尖峰時段分析 - {title}', fontsize=18, pad=20)
-        plt.xlabel('時間', fontsize=12); plt.ylabel('總人次', fontsize=12)
-        ax.xaxis.set_major_locator(mticker.MultipleLocator(6))
-        plt.xticks(rotation=45, ha='right'); plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-        plt.legend(title='類型', bbox_to_anchor=(1.02, 1), loc='upper left'); plt.tight_layout(rect=[0, 0, 0.9, 1])
-        
-        safe_title = title.split(" ")[0]
-        chart_filename = f'tra_transfer_{TARGET_STATION_NAME}_peak_{safe_title}.png'
-        chart_path = os.path.join(output_chart_dir, chart_filename)
-        plt.savefig(chart_path, dpi=300); plt.close()
-        print(f"圖表已儲存至 {chart_path}")
+    # 繪圖
+    plot_peak_chunks(station_peak_df, TARGET_STATION_NAME, output_chart_dir, bucket_minutes)
 
     print("\n\n所有分析已完成！")
 
@@ -1,4 +1,5 @@
 import pandas as pd
+import math
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
@@ -13,6 +14,11 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from alighting_inference import has_alighting_stop
+from quantile_sketch import duration_summary
+
 
 # --- 全域設定 ---
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
@@ -136,16 +142,26 @@ def plot_passenger_distribution(df):
 def plot_avg_trip_duration(df, n=15):
     # *** 核心修改：改用 '旅次時長(分)' ***
     print(f"正在產生圖表：前 {n} 名平均旅次時間最長路線...")
-    valid_duration_df = df[df['旅次時長(分)'] <= 180] # 篩選掉可能的異常值
-    avg_duration = valid_duration_df.groupby('路線')['旅次時長(分)'].mean().nlargest(n).sort_values(ascending=False)
+    # 平均與 p50 / p90 / p95 都由目前載入的資料、同一個有效旅次母體 (0 < 旅次時長 <= 180 分鐘) 計算；
+    # 旅次時長為 0 的是非電子票證或不完整旅次的填補值，超過 180 分鐘視為異常值
+    duration_report = duration_summary(df, ['路線'])
+    avg_duration = duration_report['平均'].nlargest(n).sort_values(ascending=False)
 
     print(f"\n--- 5. 前 {n} 名平均旅次時間最長路線結果 ---")
     print(avg_duration.round(2))
+
+    duration_report = duration_report.loc[avg_duration.index].round(2)
+    print("\n旅次時間分位數 (分鐘):")
+    print(duration_report)
+    duration_report.to_csv(os.path.join(output_folder, '5_各路線旅次時間分位數.csv'), encoding='utf-8-sig')
     print("------------------------------------------\n")
 
     plt.figure(figsize=(12, 9))
     sorted_avg_duration = avg_duration.sort_values()
     sns.barplot(y=sorted_avg_duration.index, x=sorted_avg_duration.values, orient='h', palette='coolwarm', hue=sorted_avg_duration.index, legend=False)
+    plt.scatter(duration_report.loc[sorted_avg_duration.index, 'p90'], range(len(sorted_avg_duration)),
+                marker='|', s=300, color='black', label='p90')
+    plt.legend()
     plt.title(f'各路線平均旅次時間（前 {n} 名）', fontsize=18, fontweight='bold')
     plt.xlabel('平均旅次時間（分鐘）', fontsize=12)
     plt.ylabel('路線編號', fontsize=12)
@@ -195,8 +211,8 @@ def plot_top_stations(df, n=15):
 
 def plot_top_od_pairs(df, n=15):
     print(f"正在產生圖表：前 {n} 名主要交通廊帶...")
-    # 篩選掉不完整的旅次，確保OD分析的準確性
-    complete_trips_df = df[df['旅次是否完整'] == True]
+    # 篩選掉沒有下車站的旅次 (完整旅次加上下車站為推估值的旅次)，確保OD分析的準確性
+    complete_trips_df = df[has_alighting_stop(df)]
     od_counts = complete_trips_df.groupby(['上車站名', '下車站名']).size().nlargest(n)
 
     print(f"\n--- 8. 前 {n} 名主要交通廊帶結果 ---")
@@ -213,7 +229,7 @@ def plot_top_od_pairs(df, n=15):
     plt.savefig(os.path.join(output_folder, '8_主要交通廊帶分析.png'))
     plt.close()
 
-def plot_student_pattern_per_route(df, min_records=20):
+def plot_student_pattern_per_route(df, min_records=20, routes_per_page=12, n_cols=3):
     # *** 核心修改：改用 '持卡身分' 和 '日期類型' ***
     print("正在為各路線產生學生平日通勤模式圖...")
     
@@ -222,39 +238,49 @@ def plot_student_pattern_per_route(df, min_records=20):
         os.makedirs(per_route_folder)
         
     student_df = df[(df['持卡身分'] == '學生') & (df['日期類型'] == '平日')]
-    unique_routes = student_df['路線'].unique()
-    
-    print(f"偵測到 {len(unique_routes)} 條路線有學生搭乘記錄，將開始逐一製圖...")
-    
-    print("\n--- 9. 各路線學生平日通勤模式分析結果 ---")
+
+    # 以一次 groupby 建立「路線 × 上車小時」矩陣，取代逐條路線重新篩選整份學生資料
+    route_hour = (student_df.groupby(['路線', '上車小時']).size()
+                  .unstack(fill_value=0)
+                  .reindex(columns=range(24), fill_value=0))
+    route_hour.columns.name = '上車小時'
+    route_totals = route_hour.sum(axis=1)
     
-    for route in unique_routes:
-        route_df = student_df[student_df['路線'] == route]
-        
-        if len(route_df) < min_records:
-            print(f"-> 路線 {route} 的學生搭乘資料量過少 ({len(route_df)} 筆)，已跳過。")
-            continue
-            
-        print(f"-> 正在產生路線 {route} 的圖表...")
-        
-        student_hourly = route_df.groupby('上車小時').size().reindex(range(24), fill_value=0)
+    print(f"偵測到 {len(route_hour)} 條路線有學生搭乘記錄，將以分頁小圖方式製圖...")
+    for route, total in route_totals[route_totals < min_records].items():
+        print(f"-> 路線 {route} 的學生搭乘資料量過少 ({total} 筆)，已跳過。")
+    route_hour = route_hour[route_totals >= min_records]
 
-        print(f"\n===== 路線 {route} 學生搭乘時段分佈 =====")
-        print(student_hourly)
-        print("=" * 40)
-        
-        plt.figure(figsize=(15, 8))
-        sns.lineplot(x=student_hourly.index, y=student_hourly.values, marker='o', color='dodgerblue')
-        plt.title(f'路線 {route} - 學生平日搭乘時段分佈', fontsize=18, fontweight='bold')
-        plt.xlabel('上車小時', fontsize=12)
-        plt.ylabel('總搭乘人次', fontsize=12)
-        plt.xticks(ticks=range(24))
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.tight_layout()
-        
-        safe_route_name = str(route).replace('/', '_')
-        plt.savefig(os.path.join(per_route_folder, f'學生通勤模式_路線_{safe_route_name}.png'))
-        plt.close()
+    print("\n--- 9. 各路線學生平日通勤模式分析結果 ---")
+    summary = pd.DataFrame({'總搭乘人次': route_hour.sum(axis=1), '尖峰小時': route_hour.idxmax(axis=1)})
+    print(summary.to_string())
+    table_path = os.path.join(per_route_folder, '學生通勤模式_路線x小時.csv')
+    route_hour.to_csv(table_path, encoding='utf-8-sig')
+    print(f"完整的路線 × 小時矩陣已儲存至: {table_path}")
+
+    # 分頁小圖 (small multiples)：每頁 routes_per_page 條路線，取代每條路線一張 15x8 的大圖
+    routes = list(route_hour.index)
+    n_pages = math.ceil(len(routes) / routes_per_page)
+    for page in range(n_pages):
+        page_routes = routes[page * routes_per_page:(page + 1) * routes_per_page]
+        n_rows = math.ceil(len(page_routes) / n_cols)
+        print(f"-> 正在產生第 {page + 1}/{n_pages} 頁 (共 {len(page_routes)} 條路線)...")
+
+        fig, axes = plt.subplots(n_rows, n_cols, figsize=(6 * n_cols, 4 * n_rows), sharex=True, squeeze=False)
+        for ax, route in zip(axes.flat, page_routes):
+            ax.plot(route_hour.columns, route_hour.loc[route].values, marker='o', markersize=3, color='dodgerblue')
+            ax.set_title(f'路線 {route}', fontsize=12, fontweight='bold')
+            ax.set_xticks(range(0, 24, 3))
+            ax.grid(True, linestyle='--', alpha=0.7)
+        for ax in axes.flat[len(page_routes):]:
+            ax.set_visible(False)
+
+        fig.suptitle(f'各路線學生平日搭乘時段分佈 (第 {page + 1}/{n_pages} 頁)', fontsize=18, fontweight='bold')
+        fig.supxlabel('上車小時', fontsize=12)
+        fig.supylabel('總搭乘人次', fontsize=12)
+        fig.tight_layout()
+        fig.savefig(os.path.join(per_route_folder, f'學生通勤模式_第{page + 1:02d}頁.png'))
+        plt.close(fig)
 
     print("-------------------------------------------\n")
     print("所有路線的學生通勤模式圖表已產生完畢。")
@@ -15,6 +15,14 @@ except ImportError:
     print("錯誤：無法找到 config.py。請確認您的專案結構。")
     sys.exit(1)
 
+# --- 載入 code/ 底下的共用模組 ---
+sys.path.append(config.CODE_BASE_DIR)
+from time_bucket import (add_bucket_columns, add_time_of_day_columns, bucket_counts, clock_to_seconds,
+                         counts_to_frame, peak_windows, slot_to_time)
+from station_batch import resolve_stations, build_station_batch_table, station_peak_frame, station_ranking, \
+    station_peak_summary
+from row_store import open_row_store, lookup
+
 # --- 全域設定 ---
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
 plt.rcParams['axes.unicode_minus'] = False
@@ -30,59 +38,64 @@ def load_data(filepath):
         print(f"錯誤：找不到檔案 '{filepath}'。請檢查 config.py 中的 BUS_UNIFIED_DATA_FILE 設定。")
         return None
     try:
-        df = pd.read_csv(filepath, dtype={'路線': str, '司機': str})
-        df['上車時間'] = pd.to_datetime(df['上車時間'], errors='coerce')
-        df['下車時間'] = pd.to_datetime(df['下車時間'], errors='coerce')
-        df.dropna(subset=['上車時間', '下車時間'], inplace=True)
+        df = pd.read_csv(filepath, dtype={'路線': str, '司機': str, '上車秒數': 'int32', '下車秒數': 'int32',
+                                          '上車星期': 'int8', '下車星期': 'int8'})
+        df = preprocess_data(df)
         print("資料讀取與基礎預處理完成。")
         return df
     except Exception as e:
         print(f"讀取或處理檔案時發生錯誤：{e}")
         return None
 
-def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder):
+def preprocess_data(df):
     """
-    分析指定車站於「平日」及「假日」在四個不同時段的上、下車尖峰。
+    時間欄位轉換與時段代碼等基礎預處理 (load_data 與 load_station_data 共用)。
     """
-    print(f"\n開始分析車站：'{station_name}' 的時段流量...")
-    os.makedirs(output_folder, exist_ok=True)
-    print(f"圖表將儲存於：'{output_folder}'")
-
-    station_boardings_df = df[df['上車站名'] == station_name].copy()
-    station_alightings_df = df[df['下車站名'] == station_name].copy()
-
-    if station_boardings_df.empty and station_alightings_df.empty:
-        print(f"警告：在資料中找不到任何與車站 '{station_name}' 相關的紀錄。")
-        return
-
-    station_boardings_df['day_type'] = station_boardings_df['上車時間'].dt.dayofweek.apply(lambda x: '平日' if x < 5 else '假日')
-    station_alightings_df['day_type'] = station_alightings_df['下車時間'].dt.dayofweek.apply(lambda x: '平日' if x < 5 else '假日')
-    station_boardings_df['time_interval'] = (station_boardings_df['上車時間'].dt.hour * 12) + (station_boardings_df['上車時間'].dt.minute // 5)
-    station_alightings_df['time_interval'] = (station_alightings_df['下車時間'].dt.hour * 12) + (station_alightings_df['下車時間'].dt.minute // 5)
-
-    boarding_counts = station_boardings_df.groupby(['day_type', 'time_interval']).size().unstack(level=0, fill_value=0)
-    alighting_counts = station_alightings_df.groupby(['day_type', 'time_interval']).size().unstack(level=0, fill_value=0)
-
-    peak_df = pd.DataFrame(index=range(288))
-    peak_df['平日上車'] = peak_df.index.map(boarding_counts.get('平日', {})).fillna(0)
-    peak_df['假日上車'] = peak_df.index.map(boarding_counts.get('假日', {})).fillna(0)
-    peak_df['平日下車'] = peak_df.index.map(alighting_counts.get('平日', {})).fillna(0)
-    peak_df['假日下車'] = peak_df.index.map(alighting_counts.get('假日', {})).fillna(0)
-    
-    time_chunks = {
-        "清晨 (00:00-05:55)": (0, 6 * 12), "上午 (06:00-11:55)": (6 * 12, 12 * 12),
-        "下午 (12:00-17:55)": (12 * 12, 18 * 12), "傍晚至午夜 (18:00-23:55)": (18 * 12, 24 * 12)
+    df['上車時間'] = pd.to_datetime(df['上車時間'], errors='coerce')
+    df['下車時間'] = pd.to_datetime(df['下車時間'], errors='coerce')
+    df.dropna(subset=['上車時間', '下車時間'], inplace=True)
+    # 舊版整合檔沒有當日秒數與星期欄位時，在此補建
+    if not {'上車秒數', '下車秒數', '上車星期', '下車星期'}.issubset(df.columns):
+        add_time_of_day_columns(df)
+    # 預先建立 int16 時段代碼與 int8 日類型代碼，供尖峰時段直方圖使用
+    add_bucket_columns(df, '上車時間', '上車', config.TIME_BUCKET_MINUTES)
+    add_bucket_columns(df, '下車時間', '下車', config.TIME_BUCKET_MINUTES)
+    return df
+
+def load_station_data(store_dir, station_name):
+    """
+    由 data_loader 建立的欄式儲存區，以站名的 CSR 索引只讀取在該站上車或下車的旅次。
+    儲存區不存在時回傳 None (由呼叫端改為讀取整份統一資料檔)。
+    """
+    store = open_row_store(store_dir)
+    if store is None:
+        return None
+    df = lookup(store, ['上車站名', '下車站名'], station_name)
+    print(f"已由列索引讀取 '{station_name}' 的 {len(df)} 筆旅次 (統一資料共 {store['rows']} 筆)。")
+    return preprocess_data(df)
+
+def get_time_chunks(bucket_minutes):
+    """ 依時段寬度產生四個繪圖時段的 (起始時段, 結束時段)。 """
+    slots_per_hour = 60 // bucket_minutes
+    return {
+        "清晨 (00:00-05:55)": (0, 6 * slots_per_hour), "上午 (06:00-11:55)": (6 * slots_per_hour, 12 * slots_per_hour),
+        "下午 (12:00-17:55)": (12 * slots_per_hour, 18 * slots_per_hour), "傍晚至午夜 (18:00-23:55)": (18 * slots_per_hour, 24 * slots_per_hour)
     }
 
+def plot_peak_chunks(peak_df, station_name, output_folder, bucket_minutes):
+    """
+    將 (時段 × 類型) 的上下車流量表依四個時段分別繪圖。
+    """
+    slots_per_hour = 60 // bucket_minutes
     print("開始產生各時段的平假日流量圖...")
-    for chunk_name, (start_interval, end_interval) in time_chunks.items():
+    for chunk_name, (start_interval, end_interval) in get_time_chunks(bucket_minutes).items():
         print(f"-> 正在繪製 '{chunk_name}' 時段圖表...")
         chunk_data = peak_df.loc[start_interval : end_interval - 1]
         plt.figure(figsize=(15, 8)); sns.lineplot(data=chunk_data, dashes=False, marker='o', markersize=5)
-        plt.title(f'{station_name} - {chunk_name} 平日與假日上下車流量分析 (每5分鐘)', fontsize=18, fontweight='bold')
+        plt.title(f'{station_name} - {chunk_name} 平日與假日上下車流量分析 (每{bucket_minutes}分鐘)', fontsize=18, fontweight='bold')
         plt.xlabel('時間', fontsize=12); plt.ylabel('總人次', fontsize=12)
-        start_hour, end_hour = start_interval // 12, end_interval // 12
-        ticks = [h * 12 for h in range(start_hour, end_hour)]
+        start_hour, end_hour = start_interval // slots_per_hour, end_interval // slots_per_hour
+        ticks = [h * slots_per_hour for h in range(start_hour, end_hour)]
         labels = [f'{h:02d}:00' for h in range(start_hour, end_hour)]
         plt.xticks(ticks=ticks, labels=labels, rotation=45, ha="right")
         plt.xlim(start_interval, end_interval - 1)
@@ -91,6 +104,34 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder):
         output_filename = os.path.join(output_folder, f'bus_transfer_{station_name}_{safe_chunk_name}.png')
         plt.savefig(output_filename); plt.close()
 
+def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder):
+    """
+    分析指定車站於「平日」及「假日」在四個不同時段的上、下車尖峰。
+    """
+    print(f"\n開始分析車站：'{station_name}' 的時段流量...")
+    os.makedirs(output_folder, exist_ok=True)
+    print(f"圖表將儲存於：'{output_folder}'")
+
+    bucket_minutes = config.TIME_BUCKET_MINUTES
+
+    station_boardings_df = df[df['上車站名'] == station_name]
+    station_alightings_df = df[df['下車站名'] == station_name]
+
+    if station_boardings_df.empty and station_alightings_df.empty:
+        print(f"警告：在資料中找不到任何與車站 '{station_name}' 相關的紀錄。")
+        return
+
+    # 以預先建立的時段與日類型代碼做一次 bincount (取代 groupby().unstack() 與 reindex)
+    boarding_counts = bucket_counts(station_boardings_df['上車時段'], station_boardings_df['上車日類型'], bucket_minutes=bucket_minutes)
+    alighting_counts = bucket_counts(station_alightings_df['下車時段'], station_alightings_df['下車日類型'], bucket_minutes=bucket_minutes)
+
+    peak_df = counts_to_frame(boarding_counts, bucket_minutes, suffix='上車').join(
+        counts_to_frame(alighting_counts, bucket_minutes, suffix='下車'))
+    peak_df = peak_df[['平日上車', '假日上車', '平日下車', '假日下車']]
+    
+    time_chunks = get_time_chunks(bucket_minutes)
+    plot_peak_chunks(peak_df, station_name, output_folder, bucket_minutes)
+
     print(f"\n所有時段流量圖已成功產生並儲存於 '{output_folder}' 資料夾中。")
 
     print(f"\n\n===== 市區公車在 {station_name} 的人流時段分析報告 =====")
@@ -102,21 +143,27 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder):
             print("  此時段無搭乘紀錄。")
             continue
         for idx, row in active_times.iterrows():
-            hour = idx // 12
-            minute = (idx % 12) * 5
-            time_str = f'{hour:02d}:{minute:02d}'
+            time_str = slot_to_time(idx, bucket_minutes)
             print(f"  時間: {time_str} -> 平日(上車:{int(row['平日上車'])}, 下車:{int(row['平日下車'])}), 假日(上車:{int(row['假日上車'])}, 下車:{int(row['假日下車'])})")
+
+    # 連續尖峰區間
+    print(f"\n最繁忙的連續 {config.PEAK_WINDOW_MINUTES} 分鐘:")
+    print(peak_windows(peak_df, config.PEAK_WINDOW_MINUTES, bucket_minutes))
     print("\n================= 分析結束 =================\n")
     
 def plot_morning_destinations(df, station_name, output_folder, top_n=15):
     print(f"開始分析 '{station_name}' 的平日早上通勤目的地...")
-    df_weekday = df[df['上車時間'].dt.dayofweek < 5].copy()
-    start_time, end_time = pd.to_datetime('06:30').time(), pd.to_datetime('09:00').time()
-    df_morning_rush = df_weekday[(df_weekday['上車站名'] == station_name) & (df_weekday['上車時間'].dt.time >= start_time) & (df_weekday['上車時間'].dt.time < end_time)]
+    # 以預先建立的星期 (int8) 與當日秒數 (int32) 做整數範圍篩選
+    start_sec, end_sec = clock_to_seconds('06:30'), clock_to_seconds('09:00')
+    seconds = df['上車秒數']
+    df_morning_rush = df[(df['上車星期'] < 5) & (df['上車站名'] == station_name) & (seconds >= start_sec) & (seconds < end_sec)]
     if df_morning_rush.empty:
         print(f"在平日早上 06:30-09:00 找不到從 '{station_name}' 上車的紀錄。")
         return
     destination_counts = df_morning_rush['下車站名'].value_counts().nlargest(top_n)
+    plot_morning_destination_chart(destination_counts, station_name, output_folder, top_n)
+
+def plot_morning_destination_chart(destination_counts, station_name, output_folder, top_n=15):
     plt.figure(figsize=(12, 8)); sns.barplot(x=destination_counts.values, y=destination_counts.index, hue=destination_counts.index, palette='viridis', orient='h', legend=False)
     plt.title(f'平日早上 (06:30-09:00) 從 {station_name} 上車之主要目的地 (前{top_n}名)', fontsize=16, fontweight='bold')
     plt.xlabel('旅次數', fontsize=12); plt.ylabel('目的地車站', fontsize=12); plt.tight_layout()
@@ -126,13 +173,16 @@ def plot_morning_destinations(df, station_name, output_folder, top_n=15):
 
 def plot_evening_origins(df, station_name, output_folder, top_n=15):
     print(f"\n開始分析 '{station_name}' 的平日傍晚通勤起始站...")
-    df_weekday = df[df['下車時間'].dt.dayofweek < 5].copy()
-    start_time, end_time = pd.to_datetime('16:00').time(), pd.to_datetime('18:30').time()
-    df_evening_rush = df_weekday[(df_weekday['下車站名'] == station_name) & (df_weekday['下車時間'].dt.time >= start_time) & (df_weekday['下車時間'].dt.time < end_time)]
+    start_sec, end_sec = clock_to_seconds('16:00'), clock_to_seconds('18:30')
+    seconds = df['下車秒數']
+    df_evening_rush = df[(df['下車星期'] < 5) & (df['下車站名'] == station_name) & (seconds >= start_sec) & (seconds < end_sec)]
     if df_evening_rush.empty:
         print(f"在平日傍晚 16:00-18:30 找不到抵達 '{station_name}' 的紀錄。")
         return
     origin_counts = df_evening_rush['上車站名'].value_counts().nlargest(top_n)
+    plot_evening_origin_chart(origin_counts, station_name, output_folder, top_n)
+
+def plot_evening_origin_chart(origin_counts, station_name, output_folder, top_n=15):
     plt.figure(figsize=(12, 8)); sns.barplot(x=origin_counts.values, y=origin_counts.index, hue=origin_counts.index, palette='plasma', orient='h', legend=False)
     plt.title(f'平日傍晚 (16:00-18:30) 抵達 {station_name} 之主要起始站 (前{top_n}名)', fontsize=16, fontweight='bold')
     plt.xlabel('旅次數', fontsize=12); plt.ylabel('起始車站', fontsize=12); plt.tight_layout()
@@ -140,18 +190,54 @@ def plot_evening_origins(df, station_name, output_folder, top_n=15):
     plt.savefig(output_filename); plt.close()
     print(f"傍晚通勤起始站圖表已儲存至: {output_filename}")
 
+def run_batch_analysis(df, stations, output_folder, render_charts=False, top_n=15):
+    """
+    批次模式：以一次 bincount 與 groupby 計算多個車站的上下車剖面與通勤排名，
+    輸出成單一長表；render_charts 為 True 時才從長表為每個車站繪圖。
+    """
+    bucket_minutes = config.TIME_BUCKET_MINUTES
+    print(f"\n開始批次分析 {len(stations)} 個車站的轉乘人流...")
+    tidy = build_station_batch_table(df, '上車站名', '下車站名', '上車時間', '下車時間', stations,
+                                     bucket_minutes=bucket_minutes, top_n=top_n)
+
+    output_path = os.path.join(output_folder, f'bus_transfer_all_stations_{bucket_minutes}min.csv')
+    tidy.to_csv(output_path, index=False, encoding='utf-8-sig')
+    print(f"批次分析長表 (共 {len(tidy)} 列) 已儲存至: {output_path}")
+
+    # 各車站最繁忙的連續尖峰區間 (所有車站一次計算)
+    if stations:
+        peak_summary = station_peak_summary(tidy, stations, config.PEAK_WINDOW_MINUTES, bucket_minutes)
+        output_path = os.path.join(output_folder, f'bus_transfer_all_stations_peak_window_{config.PEAK_WINDOW_MINUTES}min.csv')
+        peak_summary.to_csv(output_path, index=False, encoding='utf-8-sig')
+        print(f"各車站連續尖峰區間已儲存至: {output_path}")
+
+    if render_charts:
+        for station in stations:
+            print(f"\n繪製車站 '{station}' 的圖表...")
+            plot_peak_chunks(station_peak_frame(tidy, station, bucket_minutes), station, output_folder, bucket_minutes)
+            morning = station_ranking(tidy, station, '早上目的地')
+            if not morning.empty:
+                plot_morning_destination_chart(morning, station, output_folder, top_n)
+            evening = station_ranking(tidy, station, '傍晚起始站')
+            if not evening.empty:
+                plot_evening_origin_chart(evening, station, output_folder, top_n)
+
 
 # --- 主程式執行區塊 ---
 if __name__ == '__main__':
     TARGET_STATION = config.BUS_TRANSFER_STATION
+    BATCH_STATIONS = config.BUS_TRANSFER_STATIONS
 
-    if not TARGET_STATION:
-        print("設定檔 (config.py) 中未指定市區公車轉乘分析車站 (BUS_TRANSFER_STATION)。")
+    if not TARGET_STATION and not BATCH_STATIONS:
+        print("設定檔 (config.py) 中未指定市區公車轉乘分析車站 (BUS_TRANSFER_STATION 或 BUS_TRANSFER_STATIONS)。")
         print("將跳過此分析腳本。")
         sys.exit(0)
 
     data_file = config.BUS_UNIFIED_DATA_FILE
-    bus_data = load_data(filepath=data_file)
+    # 單一車站分析只需要該站的旅次，有列索引時不讀入整份資料
+    bus_data = None if BATCH_STATIONS else load_station_data(config.BUS_ROW_STORE_DIR, TARGET_STATION)
+    if bus_data is None:
+        bus_data = load_data(filepath=data_file)
 
     if bus_data is not None:
         # 從 code/市區公車/ 需要往上兩層才能到專案根目錄
@@ -159,6 +245,11 @@ if __name__ == '__main__':
         
         os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-        analyze_and_plot_by_time_and_day_type(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
-        plot_morning_destinations(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
-        plot_evening_origins(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
\ No newline at end of file
+        if BATCH_STATIONS:
+            stations = resolve_stations(BATCH_STATIONS, pd.concat([bus_data['上車站名'], bus_data['下車站名']]).unique())
+            run_batch_analysis(bus_data, stations, OUTPUT_FOLDER,
+                               render_charts=config.TRANSFER_RENDER_CHARTS, top_n=config.TRANSFER_TOP_N)
+        else:
+            analyze_and_plot_by_time_and_day_type(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
+            plot_morning_destinations(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
+            plot_evening_origins(bus_data, station_name=TARGET_STATION, output_folder=OUTPUT_FOLDER)
\ No newline at end of file
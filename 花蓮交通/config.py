@@ -21,7 +21,38 @@ DATA_BASE_DIR = os.path.join(PROJECT_ROOT, 'data')
 
 # --- [測試模式設定] ---
 TEST_MODE = False         # 是否啟用測試模式
-TEST_MODE_ROWS = 50000  # 測試模式下讀取的資料筆數
+TEST_MODE_CARD_FRACTION = 0.01  # 測試模式下保留的卡號比例 (保留這些卡號的所有旅次，見 code/card_sampling.py)
+TEST_MODE_SEED = 42       # 卡號雜湊的種子；相同種子在所有檔案、所有運具都會選到同一批卡號
+
+# --- [時段分析設定] ---
+# 尖峰時段直方圖的時段寬度 (分鐘)，可設為 1/5/15/30/60
+TIME_BUCKET_MINUTES = 5
+# 計算「連續尖峰區間」時的視窗長度 (分鐘)
+PEAK_WINDOW_MINUTES = 60
+
+# --- [票價級距設定] ---
+# 月消費級距的邊界 (元)，例如 TPASS 的 199 / 399 / 1200 元方案。
+# 由 code/fare_tiers.py 對「卡號 × 月份」事實表分級，調整方案時只需修改此處。
+FARE_TIER_BOUNDARIES = [199, 399, 1200]
+
+# *** 【新增】 ***
+# 票價方案試算 (code/fare_simulator.py) 的候選定期票產品：牌價與涵蓋的運具。
+# 事實表中沒有的運具 (例如台鐵) 不影響試算。
+FARE_PRODUCTS = {
+    '199': {'price': 199, 'modes': ['市區公車']},
+    '399': {'price': 399, 'modes': ['市區公車', '公路客運']},
+    '區域票': {'price': 1200, 'modes': ['市區公車', '公路客運', '台鐵']},
+}
+
+# 要一次試算的方案：{方案名稱: [產品名稱, ...]} 表示以 FARE_PRODUCTS 的牌價提供這些產品；
+# 要試算調價時改寫為 {產品名稱: 售價}。未列出的產品表示該方案不提供。
+FARE_POLICIES = {
+    '無定期票': [],
+    '現行 199/399': ['199', '399'],
+    '僅 399': ['399'],
+    '199/399 + 區域票': ['199', '399', '區域票'],
+    '調漲 299/499': {'199': 299, '399': 499},
+}
 
 
 # --- [市區公車分析設定] ---
@@ -38,12 +69,20 @@ BUS_UNIFIED_DATA_FILE = os.path.join(BUS_CODE_DIR, 'unified_bus_data.csv')
 # 市區公車分析的輸出子資料夾
 BUS_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '1_市區公車')
 
+# *** 【新增】 ***
+# 市區公車的卡號特徵儲存區 (依月份分割，由 code/feature_store.py 維護)
+BUS_FEATURE_STORE_DIR = os.path.join(BUS_CODE_DIR, 'feature_store')
+
 
 # --- [乘客分群分析設定] ---
 
 # 乘客分群分析的輸入檔案路徑 (直接使用上面定義的變數)
 CLUSTER_INPUT_FILE = BUS_UNIFIED_DATA_FILE
 
+# *** 【新增】 ***
+# 乘客分群使用的卡號特徵儲存區 (與市區公車共用同一個儲存區)
+CLUSTER_FEATURE_STORE_DIR = BUS_FEATURE_STORE_DIR
+
 # 乘客分群分析的輸出子資料夾
 CLUSTER_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '2_乘客分群')
 
@@ -107,6 +146,10 @@ HIGHWAY_BUS_CODE_DIR = os.path.join(CODE_BASE_DIR, '公路客運')
 # 統一後的公路客運資料檔名 (輸出到 code/公路客運/ 底下)
 HIGHWAY_BUS_UNIFIED_DATA_FILE = os.path.join(HIGHWAY_BUS_CODE_DIR, 'unified_highway_bus_data.csv')
 
+# *** 【新增】 ***
+# 公路客運的卡號特徵儲存區 (依月份分割，由 code/feature_store.py 維護)
+HIGHWAY_BUS_FEATURE_STORE_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'feature_store')
+
 # *** 【*** 新增區塊 ***】 ***
 # 公路客運要篩選的特定路線清單
 # 如果此清單為空 (即 [])，則 data_loader 將會處理所有路線。
@@ -127,4 +170,146 @@ TRANSFER_ANALYSIS_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '5_轉乘行為分
 BUS_TRANSFER_STATION = None  # 例如: '斗六火車站'
 
 # 設定要進行轉乘分析的「台鐵車站名稱」。
-TRA_TRANSFER_STATION = None    # 例如: '斗六'
\ No newline at end of file
+TRA_TRANSFER_STATION = None    # 例如: '斗六'
+
+# *** 【新增】 ***
+# 批次模式：一次分析多個車站並輸出單一長表。None = 關閉 (改用上方的單站設定)，
+# 'ALL' = 資料中的全部車站，或填入車站名稱的 list。
+BUS_TRANSFER_STATIONS = None  # 例如: ['花蓮火車站', '東大門夜市']
+TRA_TRANSFER_STATIONS = None  # 例如: 'ALL'
+
+# 批次模式下是否為每個車站繪製圖表 (車站數多時建議關閉，只輸出長表)。
+TRANSFER_RENDER_CHARTS = False
+
+# 批次模式下，平日早上目的地 / 傍晚起始站排名保留的筆數。
+TRANSFER_TOP_N = 15
+
+# *** 【新增】 ***
+# 跨運具轉乘判定 (code/transfer_engine.py)：同一卡號在公車下車後 (或台鐵出站後)
+# 於多少分鐘內刷卡進入另一運具，才視為一次轉乘。
+TRANSFER_WINDOW_MINUTES = 30
+
+# 公車站牌與台鐵車站的鄰近對照表 {公車站牌名稱 (清理後): [步行可達的台鐵車站]}。
+# 只有落在此表中的站點組合才會被判定為轉乘；台鐵→公車方向自動使用反向對照。
+TRANSFER_STATION_PAIRS = {
+    '花蓮火車站': ['花蓮'],
+    '花蓮轉運站': ['花蓮'],
+    '吉安火車站': ['吉安'],
+    '新城火車站': ['新城'],
+}
+
+# --- [旅程重建設定] ---
+
+# 旅程重建 (code/trip_chaining.py) 的輸出子資料夾
+JOURNEY_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '7_旅程重建')
+
+# 同一卡號「下車到下一次上車」的間隔在此分鐘數內，視為同一旅程中的轉乘。
+JOURNEY_TRANSFER_MINUTES = 30
+
+# *** 【新增】 ***
+# data_loader 是否為不完整旅次推估下車站 (code/alighting_inference.py)。
+# 推估值會寫入「下車站名」，並以「下車站來源」欄位標記 (刷卡 / 推估:... / 無法推估)。
+INFER_ALIGHTING_STOPS = True
+
+# --- [車上人數剖面設定] ---
+
+# 車上人數重建 (code/load_profile.py) 的輸出子資料夾
+LOAD_PROFILE_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '8_車上人數剖面')
+
+# --- [熱門排名 sketch 設定] ---
+
+# 熱門 OD / 車站 / 路線排名的 Space-Saving sketch 保留項目數 (code/heavy_hitters.py)。
+# 數值越大越精確；遠大於報表的前 N 名時，前 N 名幾乎都是精確值。
+RANKING_SKETCH_CAPACITY = 5000
+
+# 台鐵主分析的熱門 OD 排名是否改用 sketch (False = 使用完整 groupby)。
+USE_RANKING_SKETCH = True
+
+# 公車 data_loader 輸出的排名 sketch 資料夾
+BUS_RANKING_SKETCH_DIR = os.path.join(BUS_CODE_DIR, 'ranking_sketches')
+HIGHWAY_BUS_RANKING_SKETCH_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'ranking_sketches')
+
+# --- [相異卡號 HLL 設定] ---
+
+# feature_store 建立的 HyperLogLog 暫存器數為 2^HLL_PRECISION (code/distinct_counters.py)。
+# 12 → 每個切片 4 KB、相對誤差約 ±1.6%；每加 1 記憶體加倍、誤差降為 1/√2。
+HLL_PRECISION = 12
+
+# --- [旅次時間分位數 sketch 設定] ---
+
+# 旅次時間 p50 / p90 / p95 的相對誤差上限 (code/quantile_sketch.py 的對數分桶精度)
+TRAVEL_TIME_SKETCH_ACCURACY = 0.01
+
+# 公車 data_loader 輸出的旅次時間 sketch 資料夾 (各路線、各 OD，依月份儲存)
+BUS_TRAVEL_TIME_SKETCH_DIR = os.path.join(BUS_CODE_DIR, 'travel_time_sketches')
+HIGHWAY_BUS_TRAVEL_TIME_SKETCH_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'travel_time_sketches')
+
+# --- [預覽模式 (分層抽樣) 設定] ---
+
+# data_loader 在整合資料時建立分層樣本 (code/preview_sample.py)：每層 (路線 × 月份 × 日期類型) 最多保留的筆數
+PREVIEW_SAMPLE_PER_STRATUM = 1000
+# 抽樣的亂數種子 (固定種子讓每次重建的樣本相同)
+PREVIEW_SAMPLE_SEED = 42
+
+# 各運具的預覽樣本資料夾
+BUS_PREVIEW_SAMPLE_DIR = os.path.join(BUS_CODE_DIR, 'preview_sample')
+HIGHWAY_BUS_PREVIEW_SAMPLE_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'preview_sample')
+TRA_PREVIEW_SAMPLE_DIR = os.path.join(TRA_CODE_DIR, 'preview_sample')
+
+# 預覽報表 (估計值與信賴區間) 的輸出子資料夾
+PREVIEW_OUTPUT_DIR = os.path.join(OUTPUT_BASE_DIR, '9_快速預覽')
+
+# --- [列索引 (CSR) 設定] ---
+
+# 公車 data_loader 輸出的欄式儲存區 (code/row_store.py)：每個欄位一個 .npy，並以卡號、上/下車站名建立 CSR 列索引，
+# 查詢單一卡號或單一站點時以 mmap 只讀取相關的列
+BUS_ROW_STORE_DIR = os.path.join(BUS_CODE_DIR, 'row_store')
+HIGHWAY_BUS_ROW_STORE_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'row_store')
+
+# --- [叢集化儲存 (排序 + 列群組統計) 設定] ---
+
+# data_loader 另外輸出依月份分割、分割內依叢集鍵排序的儲存區 (code/clustered_store.py)，
+# 公車依 (路線, 上車時間)、台鐵依 (起點, 進站時間) 排序；查詢時以各列群組的最小/最大值略過不需要的資料。
+# 台鐵另外輸出一份依 (迄點, 出站時間) 排序的儲存區，供「到達某站」的查詢略過列群組。
+# 有安裝 pyarrow 時存成 Parquet，否則存成 CSV 列群組檔案。
+CLUSTERED_ROW_GROUP_SIZE = 50000
+
+BUS_CLUSTERED_STORE_DIR = os.path.join(BUS_CODE_DIR, 'clustered_store')
+HIGHWAY_BUS_CLUSTERED_STORE_DIR = os.path.join(HIGHWAY_BUS_CODE_DIR, 'clustered_store')
+TRA_CLUSTERED_STORE_DIR = os.path.join(TRA_CODE_DIR, 'clustered_store')
+TRA_ARRIVAL_CLUSTERED_STORE_DIR = os.path.join(TRA_CODE_DIR, 'clustered_store_arrivals')
+
+# --- [SQL 查詢層 (DuckDB) 設定] ---
+
+# 是否由 code/query_layer.py 的嵌入式 DuckDB 計算部分彙總 (需 pip install duckdb；未安裝時自動改用 Dask)。
+# view 讀取 data_loader 輸出的叢集化儲存區或統一資料檔，因此需先以正式模式執行 data_loader。
+USE_SQL_LAYER = False
+# DuckDB 的執行緒數與記憶體上限 (None = DuckDB 預設：全部核心、約 80% 實體記憶體)
+SQL_THREADS = None
+SQL_MEMORY_LIMIT = None  # 例如: '8GB'
+# 超過記憶體上限時的溢寫資料夾
+SQL_TEMP_DIR = os.path.join(CODE_BASE_DIR, 'duckdb_tmp')
+
+# --- [data_loader 資料處理後端設定] ---
+
+# 公車 data_loader 的讀取、清理與特徵工程後端 (code/loader_backend.py)：
+# 'pandas' = 原本的逐檔 pandas 流程；'polars' = Polars LazyFrame (多執行緒讀檔、篩選與欄位下推，需 pip install polars)。
+# 兩者輸出相同的統一資料；執行 code/loader_backend.py 可比較兩者在實際資料上的耗時。
+# 只適用於市區公車與公路客運；台鐵的 data_loader 固定使用 Dask (原因見 code/loader_backend.py 的說明)。
+LOADER_BACKEND = 'pandas'
+# Polars 後端是否使用串流引擎分批執行 (資料大於記憶體時建議開啟)
+POLARS_STREAMING = True
+
+# --- [儀表板查詢服務設定] ---
+
+# code/query_service.py 的本機 HTTP 服務：以 JSON 提供熱門 OD、車站概況、各小時人次與縣市間流量。
+# 預設只接受本機連線 (127.0.0.1)；要開放給區網內的儀表板時改為 '0.0.0.0'。
+QUERY_SERVICE_HOST = '127.0.0.1'
+QUERY_SERVICE_PORT = 8765
+# 查詢結果 (JSON) 快取的容量上限 (位元組)；超過時淘汰最久未使用的結果。
+# 資料來源 (叢集化儲存區或統一資料檔) 的修改時間改變時，該資料集的快取會自動清除。
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 排名類查詢未指定 n 時回傳的筆數
+QUERY_SERVICE_DEFAULT_N = 20
+# 啟動時先計算各資料集的預設查詢 (熱門 OD、車站排名、各小時人次、縣市間流量) 放入快取，儀表板第一次開啟即可直接取得結果
+QUERY_SERVICE_WARMUP = True
@@ -24,6 +24,7 @@ from sklearn.metrics import silhouette_score
 from sklearn.decomposition import PCA
 from scipy.stats import entropy
 import os
+from od_utils import encode_od
 
 # --- 步驟 0: 全域設定 ---
 
@@ -174,7 +175,9 @@ def create_user_features(df):
     
     # --- 空間相關特徵 ---
     # 建立 OD (起終點) 對，用於計算熵
-    df['OD對'] = df['上車站名'] + ' -> ' + df['下車站名']
+    # 以站名的整數代碼合併成 int64 鍵值 (起站代碼 × 站數 + 迄站代碼)，避免逐筆串接字串；
+    # 任一端為空值的旅次設為 -1，計算熵時排除
+    df['OD對'], _ = encode_od(df['上車站名'], df['下車站名'])
     
     # --- 以卡號進行分組，計算各項特徵 ---
     # 建立一個 lambda 函式來安全地取眾數
@@ -183,7 +186,7 @@ def create_user_features(df):
     # 計算熵的函式
     def calculate_entropy(series):
         # 計算每個 OD 對的出現機率
-        counts = series.value_counts()
+        counts = series[series >= 0].value_counts()
         probabilities = counts / counts.sum()
         return entropy(probabilities, base=2)
 
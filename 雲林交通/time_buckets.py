@@ -0,0 +1,74 @@
+# 檔名: time_buckets.py
+# 功能: 以固定分鐘數切分一天的時段直方圖共用工具。
+# 說明: 市區公車與台鐵的斗六站尖峰分析原本各自實作「日期類型 × 時段」的計數，
+#       台鐵版本還把 288 個時段與 60 分鐘視窗 (12 個時段) 寫死。
+#       這裡統一由 bucket_minutes 推算時段數、每小時時段數與滑動視窗長度，
+#       改變時段粒度 (1/5/15/60 分鐘等) 時不必再修改各腳本中的常數。
+import numpy as np
+
+
+def slots_per_day(bucket_minutes):
+    """ 一天切成的時段數 (bucket_minutes 須能整除 1440)。 """
+    if (24 * 60) % bucket_minutes != 0:
+        raise ValueError(f"bucket_minutes={bucket_minutes} 無法整除一天的 1440 分鐘。")
+    return 24 * 60 // bucket_minutes
+
+
+def slots_per_hour(bucket_minutes):
+    """ 每小時的時段數；時段大於一小時時回傳 1。 """
+    return max(60 // bucket_minutes, 1)
+
+
+def slot_to_time(slot, bucket_minutes):
+    """ 將時段代碼轉為 'HH:MM' 起始時間字串。 """
+    minutes = int(slot) * bucket_minutes
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def count_by_day_type_and_slot(times, bucket_minutes=5, day_type_labels=None, weights=None):
+    """
+    以單次 np.bincount 計算「日期類型 × 時間區間」的人次。
+    時間先轉為 int16 的時段代碼與 int8 的日期類型代碼 (0 = 平日, 1 = 假日)，
+    不需要 groupby().unstack() 或 pivot_table 之後再補齊所有時段。
+
+    Args:
+        times (pd.Series): 不含空值的 datetime 欄位。
+        bucket_minutes (int): 每個時間區間的分鐘數 (1/5/15/60 等)。
+        day_type_labels (pd.Series, optional): 日期類型欄位 ('平日'/'假日')；
+            未提供時以星期判斷 (週六、週日為假日)。
+        weights (pd.Series, optional): 每筆紀錄的人次；未提供時每筆計為 1。
+
+    Returns:
+        np.ndarray: 形狀為 (2, 時段數) 的陣列，第 0 列為平日、第 1 列為假日。
+                    未提供 weights 時為整數，否則為浮點數。
+    """
+    n_slots = slots_per_day(bucket_minutes)
+    slots = ((times.dt.hour * 60 + times.dt.minute) // bucket_minutes).to_numpy(dtype=np.int16)
+    if day_type_labels is None:
+        day_types = (times.dt.dayofweek >= 5).to_numpy(dtype=np.int8)
+    else:
+        day_types = (day_type_labels.astype(object) == '假日').to_numpy(dtype=np.int8)
+    if weights is not None:
+        weights = weights.to_numpy(dtype=np.float64)
+    counts = np.bincount(day_types.astype(np.int64) * n_slots + slots,
+                         weights=weights, minlength=2 * n_slots)
+    return counts.reshape(2, n_slots)
+
+
+def busiest_window(counts, bucket_minutes, window_minutes=60):
+    """
+    以累積和單次掃描，找出人次最多的連續 window_minutes 分鐘。
+
+    Args:
+        counts (array-like): 單一日期類型的各時段人次 (長度為一天的時段數)。
+        bucket_minutes (int): 每個時間區間的分鐘數。
+        window_minutes (int): 視窗長度 (分鐘)，不足一個時段時以一個時段計。
+
+    Returns:
+        tuple: (起始時段代碼, 視窗內總人次)。
+    """
+    window = max(window_minutes // bucket_minutes, 1)
+    cumulative = np.concatenate([[0], np.cumsum(np.asarray(counts))])
+    window_sums = cumulative[window:] - cumulative[:-window]
+    start = int(np.argmax(window_sums))
+    return start, window_sums[start]
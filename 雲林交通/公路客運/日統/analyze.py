@@ -16,6 +16,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+# OD 整數編碼的共用工具 (雲林交通/od_utils.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from od_utils import top_od_pairs
 from matplotlib.font_manager import fontManager
 
 def setup_chinese_font():
@@ -198,8 +203,8 @@ def plot_top_stations(df, top_n=15):
 
 def plot_top_od_pairs(df, top_n=10):
     print(f"正在生成圖表 6: 前 {top_n} 大旅運OD走廊分析...")
-    df['OD_Pair'] = df['上車站名'].astype(str) + ' → ' + df['下車站名'].astype(str)
-    od_counts = df['OD_Pair'].value_counts().head(top_n)
+    # 以整數 OD 鍵值計數，只為前 N 名產生文字標籤 (空值視為獨立站名，與原本 astype(str) 的 'nan' 行為一致)
+    od_counts = top_od_pairs(df['上車站名'], df['下車站名'], top_n=top_n, sep=' → ', dropna=False)
     plt.figure(figsize=(12, 8))
     sns.barplot(x=od_counts.values, y=od_counts.index, palette='rocket', orient='h', hue=od_counts.index, legend=False)
     plt.title(f'圖6：年度前 {top_n} 大旅運OD走廊', fontsize=16)
@@ -10,6 +10,11 @@ import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import seaborn as sns 
 import os 
+import sys
+
+# 時段直方圖的共用工具 (雲林交通/time_buckets.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from time_buckets import count_by_day_type_and_slot, slots_per_day, slots_per_hour, slot_to_time, busiest_window
 
 # ==============================================================================
 # 建立輸出資料夾
@@ -47,6 +52,12 @@ def setup_chinese_font():
 setup_chinese_font()
 
 
+# ==============================================================================
+# 時段直方圖的時間區間長度 (分鐘)，時段數、尖峰視窗與圖表刻度皆由此推算
+# ==============================================================================
+BUCKET_MINUTES = 5
+
+
 # ==============================================================================
 # 核心步驟：載入並準備所有資料
 # ==============================================================================
@@ -103,46 +114,31 @@ if all_data is not None:
     douliu_data = douliu_data_dd.compute()
     print(f"已篩選出與斗六站相關的資料共 {len(douliu_data)} 筆，開始計算...")
 
-    # 3. 計算上車人次 (Departures)，並按平日/假日分類
-    douliu_departures = douliu_data[douliu_data['起點'] == '斗六'].dropna(subset=['進站時間']).copy()
-    if not douliu_departures.empty:
-        minute_of_day_dep = douliu_departures['進站時間'].dt.hour * 60 + douliu_departures['進站時間'].dt.minute
-        douliu_departures['時段_5分'] = (minute_of_day_dep // 5).astype(int)
-        dep_pivot = douliu_departures.pivot_table(index='時段_5分', columns='日期類型', values='人次', aggfunc='sum')
-        dep_pivot.columns = [f'{col}_上車' for col in dep_pivot.columns] # 重新命名欄位以便區分
-    else:
-        dep_pivot = pd.DataFrame()
-
-    # 4. 計算下車人次 (Arrivals)，並按平日/假日分類
-    douliu_arrivals = douliu_data[douliu_data['迄點'] == '斗六'].dropna(subset=['出站時間']).copy()
-    if not douliu_arrivals.empty:
-        minute_of_day_arr = douliu_arrivals['出站時間'].dt.hour * 60 + douliu_arrivals['出站時間'].dt.minute
-        douliu_arrivals['時段_5分'] = (minute_of_day_arr // 5).astype(int)
-        arr_pivot = douliu_arrivals.pivot_table(index='時段_5分', columns='日期類型', values='人次', aggfunc='sum')
-        arr_pivot.columns = [f'{col}_下車' for col in arr_pivot.columns] # 重新命名欄位以便區分
-    else:
-        arr_pivot = pd.DataFrame()
-
-    # 5. 合併所有資料
-    full_day_index = pd.Index(range(24 * 12), name='時段_5分')
-    douliu_peak_df = pd.DataFrame(index=full_day_index)
-    douliu_peak_df = douliu_peak_df.join(dep_pivot).join(arr_pivot).fillna(0).astype(int)
-    
-    # 確保所有可能的欄位都存在，避免因資料缺失而出錯
-    expected_cols = ['平日_上車', '假日_上車', '平日_下車', '假日_下車']
-    for col in expected_cols:
-        if col not in douliu_peak_df.columns:
-            douliu_peak_df[col] = 0
-
-    # 重新排序欄位，方便閱讀
-    douliu_peak_df = douliu_peak_df[expected_cols]
+    # 3. 計算上車人次 (Departures) 與下車人次 (Arrivals)，並按平日/假日分類
+    douliu_departures = douliu_data[douliu_data['起點'] == '斗六'].dropna(subset=['進站時間'])
+    douliu_arrivals = douliu_data[douliu_data['迄點'] == '斗六'].dropna(subset=['出站時間'])
+    dep_counts = count_by_day_type_and_slot(douliu_departures['進站時間'], BUCKET_MINUTES,
+                                            douliu_departures['日期類型'], douliu_departures['人次'])
+    arr_counts = count_by_day_type_and_slot(douliu_arrivals['出站時間'], BUCKET_MINUTES,
+                                            douliu_arrivals['日期類型'], douliu_arrivals['人次'])
+
+    # 4. 合併為包含一天全部時段的表格
+    slot_column = f'時段_{BUCKET_MINUTES}分'
+    full_day_index = pd.Index(range(slots_per_day(BUCKET_MINUTES)), name=slot_column)
+    douliu_peak_df = pd.DataFrame({
+        '平日_上車': dep_counts[0], '假日_上車': dep_counts[1],
+        '平日_下車': arr_counts[0], '假日_下車': arr_counts[1]
+    }, index=full_day_index).round().astype(int)
+
+    # 5. 最繁忙的連續 60 分鐘 (以累積和做單次掃描)
+    for col in douliu_peak_df.columns:
+        start, total = busiest_window(douliu_peak_df[col].to_numpy(), BUCKET_MINUTES, window_minutes=60)
+        print(f"  {col} 最繁忙的 60 分鐘: {slot_to_time(start, BUCKET_MINUTES)} 起，共 {int(total)} 人次")
 
     # 6. 顯示文字報表
-    print("\n--- [文字報表：斗六站各時段上、下車旅運量完整結果 (每5分鐘)] ---")
+    print(f"\n--- [文字報表：斗六站各時段上、下車旅運量完整結果 (每{BUCKET_MINUTES}分鐘)] ---")
     def block_to_time(block):
-        hour = block * 5 // 60
-        minute = block * 5 % 60
-        return f'{hour:02d}:{minute:02d}'
+        return slot_to_time(block, BUCKET_MINUTES)
     
     display_df = douliu_peak_df.copy()
     display_df.index = display_df.index.map(block_to_time)
@@ -150,16 +146,17 @@ if all_data is not None:
     print(display_df.to_string())
 
     # 7. 儲存CSV檔案
-    output_path = os.path.join(output_csv_dir, 'analysis_douliu_peak_5min.csv')
+    output_path = os.path.join(output_csv_dir, f'analysis_douliu_peak_{BUCKET_MINUTES}min.csv')
     douliu_peak_df.to_csv(output_path, encoding='utf-8-sig')
     print(f"\n斗六站尖峰分析結果已儲存至 {output_path}")
 
     # 8. 繪製圖表
+    per_hour = slots_per_hour(BUCKET_MINUTES)
     time_chunks = {
-        "清晨 (00-06點)": (0, 6 * 12),
-        "上午 (06-12點)": (6 * 12, 12 * 12),
-        "下午 (12-18點)": (12 * 12, 18 * 12),
-        "傍晚至午夜 (18-24點)": (18 * 12, 24 * 12)
+        "清晨 (00-06點)": (0, 6 * per_hour),
+        "上午 (06-12點)": (6 * per_hour, 12 * per_hour),
+        "下午 (12-18點)": (12 * per_hour, 18 * per_hour),
+        "傍晚至午夜 (18-24點)": (18 * per_hour, 24 * per_hour)
     }
 
     for title, (start_block, end_block) in time_chunks.items():
@@ -174,17 +171,17 @@ if all_data is not None:
         plt.figure(figsize=(15, 8))
         
         # 使用 melt 將寬數據轉換為長數據，以便 Seaborn 繪圖
-        plot_data = chunk_data.reset_index().melt(id_vars='時段_5分', var_name='類型', value_name='人次')
+        plot_data = chunk_data.reset_index().melt(id_vars=slot_column, var_name='類型', value_name='人次')
         
-        ax = sns.lineplot(data=plot_data, x='時段_5分', y='人次', hue='類型', style='類型',
+        ax = sns.lineplot(data=plot_data, x=slot_column, y='人次', hue='類型', style='類型',
                           markers=True, dashes=False, markersize=7, palette='tab10')
         
         plt.title(f'斗六車站尖峰時段分析 - {title}', fontsize=18, pad=20)
         plt.xlabel('時間', fontsize=12)
         plt.ylabel('總人次', fontsize=12)
         
-        # 設定 x 軸刻度，每 30 分鐘一個刻度 (6個5分鐘)
-        ax.xaxis.set_major_locator(mticker.MultipleLocator(6)) 
+        # 設定 x 軸刻度，每 30 分鐘一個刻度
+        ax.xaxis.set_major_locator(mticker.MultipleLocator(max(30 // BUCKET_MINUTES, 1)))
         plt.xticks(rotation=45, ha='right')
         
         plt.grid(True, which='both', linestyle='--', linewidth=0.5)
@@ -3,6 +3,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+# OD 整數編碼的共用工具 (雲林交通/od_utils.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from od_utils import encode_od, decode_od, top_od_pairs
+# 票價方案試算的陣列運算核心，與花蓮的 fare_simulator 共用 (花蓮交通/code/fare_matrix.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '花蓮交通', 'code')))
+from fare_matrix import simulate_policies
 
 def setup_visualization():
     """
@@ -115,9 +123,122 @@ def unify_ticket_type(ticket_name):
     else:
         return '其他'
 
-def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
+# --- 高頻率用戶剖析函式 ---
+# 先將目標卡號的資料依卡號排序成一個小表，所有剖析統計都以 groupby 一次算完，
+# 之後每位用戶只需在已排序的索引上取出自己的那一段，不必再對整份月票資料逐一篩選。
+
+def build_user_profiles(pass_df, card_ids, od_keys, od_stations):
+    """
+    一次計算多位用戶的剖析統計。
+
+    Args:
+        pass_df (pd.DataFrame): 月票用戶的搭乘紀錄。
+        card_ids (list): 要剖析的卡號 (依搭乘次數排序)。
+        od_keys (np.ndarray): 與 pass_df 逐列對應的 OD 鍵值 (由 encode_od 產生)。
+        od_stations (pd.Index): OD 鍵值對應的站名。
+
+    Returns:
+        tuple: (summary, routes, hours)。
+               summary 以卡號為索引，其餘為 (卡號, 項目) 雙層索引的 Series。
+               單日超額搭乘的檢查已移至 detect_daily_over_riding (涵蓋全體月票用戶)，
+               呼叫端再由其結果補上 '高頻率搭乘日數' 欄位。
+    """
+    mask = pass_df['卡號'].isin(card_ids).to_numpy()
+    user_df = pd.DataFrame({
+        '卡號': pass_df['卡號'].to_numpy()[mask],
+        'OD鍵值': np.asarray(od_keys)[mask],
+        '路線': pass_df['路線'].to_numpy()[mask],
+        '上車時段': pass_df['上車時段'].to_numpy()[mask],
+    }).sort_values('卡號', kind='stable')
+
+    # 各用戶的常用路線 (依次數由多到少) 與各時段搭乘分佈
+    routes = user_df.groupby(['卡號', '路線']).size().rename('次數')
+    routes = routes.sort_values(ascending=False, kind='stable').sort_index(level=0, sort_remaining=False)
+    hours = user_df.groupby(['卡號', '上車時段']).size().rename('次數')
+
+    # 最常搭乘 OD：每位用戶次數最多的 OD 鍵值，只為這些鍵值產生文字標籤
+    od_counts = user_df[user_df['OD鍵值'] >= 0].groupby(['卡號', 'OD鍵值']).size()
+    top_od = od_counts.sort_values(ascending=False, kind='stable').groupby(level=0).head(1)
+    top_od = pd.Series(decode_od(top_od.index.get_level_values(1), od_stations),
+                       index=top_od.index.get_level_values(0))
+
+    summary = pd.DataFrame(index=pd.Index(card_ids, name='卡號'))
+    summary['總搭乘次數'] = user_df.groupby('卡號').size()
+    summary['最常搭乘OD'] = top_od
+    summary['最常搭乘路線'] = routes.groupby(level=0).head(1).reset_index(level=1)['路線']
+    summary['常用路線數'] = routes.groupby(level=0).size()
+    summary['尖峰時段'] = hours.groupby(level=0).idxmax().map(lambda key: key[1])
+    summary = summary.fillna({'最常搭乘OD': '無'})
+    return summary, routes, hours
+
+# --- 單日超額搭乘偵測函式 ---
+# 以一次 groupby([卡號, 日期]) 計算全體卡號的每日搭乘次數，再以各卡號自身的歷史
+# (平均與標準差) 判斷離群日，取代只在前 20 名用戶迴圈內逐一檢查的做法。
+
+def detect_daily_over_riding(pass_df, threshold=5, z_threshold=3.0, min_active_days=5, min_outlier_rides=4):
+    """
+    偵測單日搭乘次數異常的卡號 (可能為一卡多人共用)。
+
+    一天符合下列任一條件即列為異常日：
+      1. 當日搭乘次數超過固定門檻 threshold。
+      2. 卡號活躍日數達 min_active_days、當日至少 min_outlier_rides 次，
+         且當日次數高於該卡號自身平均 z_threshold 個標準差。
+
+    Returns:
+        tuple: (cards, flagged_days)
+            cards        : 每張有異常日的卡號一列，依超過門檻日數、異常日數與最高單日次數排序。
+            flagged_days : 所有異常日的明細 (卡號, 上車日期, 搭乘次數, z分數, 判定原因)。
+    """
+    daily = (pass_df.assign(上車日期=pass_df['上車時間'].dt.normalize())
+             .groupby(['卡號', '上車日期']).size().rename('搭乘次數').reset_index())
+
+    by_card = daily.groupby('卡號')['搭乘次數']
+    daily['平均每日次數'] = by_card.transform('mean')
+    daily['活躍日數'] = by_card.transform('size')
+    std = by_card.transform('std')
+    daily['z分數'] = ((daily['搭乘次數'] - daily['平均每日次數']) / std.where(std > 0)).fillna(0)
+
+    over_threshold = daily['搭乘次數'] > threshold
+    outlier = ((daily['活躍日數'] >= min_active_days) & (daily['搭乘次數'] >= min_outlier_rides)
+               & (daily['z分數'] > z_threshold))
+    daily['超過門檻'] = over_threshold.astype(int)
+    daily['判定原因'] = np.select([over_threshold & outlier, over_threshold, outlier],
+                              [f'超過{threshold}次且離群', f'超過{threshold}次', '離群'], default='')
+    flagged_days = daily[over_threshold | outlier].sort_values(['卡號', '上車日期'])
+
+    cards = flagged_days.groupby('卡號').agg(
+        異常日數=('上車日期', 'size'),
+        超過門檻日數=('超過門檻', 'sum'),
+        最高單日次數=('搭乘次數', 'max'),
+        最高z分數=('z分數', 'max'),
+    )
+    cards = cards.join(daily.groupby('卡號').agg(活躍日數=('活躍日數', 'first'), 平均每日次數=('平均每日次數', 'first')))
+    cards = cards.sort_values(['超過門檻日數', '異常日數', '最高單日次數'], ascending=False)
+    cards.insert(0, '排名', np.arange(1, len(cards) + 1))
+    return cards, flagged_days[['卡號', '上車日期', '搭乘次數', 'z分數', '判定原因']]
+
+# --- 月票方案試算設定 ---
+# 此資料只有市區公車，199 與 399 月票皆涵蓋全部消費。
+# 產品與方案的格式與花蓮 config.FARE_PRODUCTS / FARE_POLICIES 相同，試算由 fare_matrix.simulate_policies 完成。
+FARE_PRODUCTS = {
+    '199月票': {'price': 199, 'modes': ['市區公車']},
+    '399月票': {'price': 399, 'modes': ['市區公車']},
+}
+FARE_POLICIES = {
+    '無月票': [],
+    '現行 199/399': ['199月票', '399月票'],
+    '僅 399': ['399月票'],
+    '調漲 299/499': {'199月票': 299, '399月票': 499},
+}
+
+def analyze_and_visualize_bus_data(file_path='unified_data.csv', profile_top_n=20, profile_chart_top_n=20):
     """
     分析雲林市區公車資料，對月票與非月票用戶進行視覺化分析並儲存圖表。
+
+    Args:
+        file_path (str): 統一化資料檔路徑。
+        profile_top_n (int): 區塊 13 要剖析的高頻率用戶數 (可調高至數千位)。
+        profile_chart_top_n (int): 其中要逐一輸出文字報告與個人化圖表的用戶數。
     """
     setup_visualization()
     output_dir = '199_399_charts'
@@ -187,15 +308,20 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
         
         # 1. 非月票用戶高額消費分析
         print("\n[圖表 1] 產生非月票用戶高額消費人數圖...")
-        monthly_spending = non_monthly_pass_users_df.groupby(['月份', '卡號'])['消費扣款'].sum().reset_index()
-        chart_data = []
-        for month in sorted(monthly_spending['月份'].unique()):
-            month_data = monthly_spending[monthly_spending['月份'] == month]
-            spent_between_199_399 = month_data[(month_data['消費扣款'] > 199) & (month_data['消費扣款'] < 399)]['卡號'].nunique()
-            spent_over_399 = month_data[month_data['消費扣款'] > 399]['卡號'].nunique()
-            chart_data.append({'月份': month, '消費門檻': '199-399 元', '人數': spent_between_199_399})
-            chart_data.append({'月份': month, '消費門檻': '> 399 元', '人數': spent_over_399})
-        chart_df = pd.DataFrame(chart_data)
+        # 建立「卡號 × 月份」事實表 (消費、旅次數、活躍日數) 並存檔，供票價方案試算重複使用
+        card_month_facts = non_monthly_pass_users_df.assign(上車日期=non_monthly_pass_users_df['上車時間'].dt.normalize()).groupby(['月份', '卡號']).agg(
+            消費扣款=('消費扣款', 'sum'),
+            旅次數=('消費扣款', 'size'),
+            活躍日數=('上車日期', 'nunique')
+        ).reset_index()
+        card_month_facts.to_csv(os.path.join(output_dir, '1_non_pass_card_month_facts.csv'), index=False, encoding='utf-8-sig')
+
+        # 以一次 pd.cut + crosstab 完成「月份 × 消費級距」的人數統計 (取代逐月篩選)
+        # 級距為 (-inf, 199]、(199, 399]、(399, inf)；圖表 5、6 的卡號清單也使用同一個欄位，確保邊界一致
+        card_month_facts['消費級距'] = pd.cut(card_month_facts['消費扣款'], bins=[-np.inf, 199, 399, np.inf],
+                                          labels=['<= 199 元', '199-399 元', '> 399 元'], right=True)
+        tier_table = pd.crosstab(card_month_facts['月份'], card_month_facts['消費級距'].rename('消費門檻'), dropna=False)
+        chart_df = tier_table[['199-399 元', '> 399 元']].reset_index().melt(id_vars='月份', var_name='消費門檻', value_name='人數')
         
         # 【新增】印出分析結果
         print("\n--- [分析結果 1] 各月份非月票用戶高額消費人數 ---")
@@ -209,6 +335,14 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
         plt.savefig(os.path.join(output_dir, '1_non_pass_high_spending_counts.png'))
         plt.close(); print(" -> 圖表 1 已儲存。")
 
+        # 1-1. 月票方案試算：各卡號月份在不同方案下最划算的選擇與收入變化
+        spend_matrix = card_month_facts.set_index(['月份', '卡號'])[['消費扣款']].rename(columns={'消費扣款': '市區公車'})
+        policy_summary, _, _ = simulate_policies(spend_matrix, FARE_PRODUCTS, FARE_POLICIES)
+        print("\n--- [分析結果 1-1] 月票方案試算 (非月票用戶) ---")
+        print(policy_summary.to_string())
+        print("--------------------------------------------------\n")
+        policy_summary.to_csv(os.path.join(output_dir, '1_fare_policy_simulation.csv'), encoding='utf-8-sig')
+
         # 2. 非月票用戶最常上車站點
         print("\n[圖表 2] 產生非月票用戶最常上車站點圖...")
         top_boarding = non_monthly_pass_users_df['上車站名'].value_counts().head(10)
@@ -263,12 +397,11 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
 
         # 5. 消費介於 199-399 元用戶的熱門 OD
         print("\n[圖表 5] 產生非月票高額消費(199-399元)用戶熱門OD圖...")
-        cards_between_199_399 = monthly_spending[(monthly_spending['消費扣款'] > 199) & (monthly_spending['消費扣款'] < 399)]['卡號'].unique()
+        cards_between_199_399 = card_month_facts.loc[card_month_facts['消費級距'] == '199-399 元', '卡號'].unique()
         high_spenders_199_df = non_monthly_pass_users_df[non_monthly_pass_users_df['卡號'].isin(cards_between_199_399)]
         if not high_spenders_199_df.empty:
-            complete_trips_high_199 = high_spenders_199_df[high_spenders_199_df['旅次是否完整'] == True].copy()
-            complete_trips_high_199['OD'] = complete_trips_high_199['上車站名'] + ' -> ' + complete_trips_high_199['下車站名']
-            top_od_high_199 = complete_trips_high_199['OD'].value_counts().head(10)
+            complete_trips_high_199 = high_spenders_199_df[high_spenders_199_df['旅次是否完整'] == True]
+            top_od_high_199 = top_od_pairs(complete_trips_high_199['上車站名'], complete_trips_high_199['下車站名'], top_n=10)
             
             # 【新增】印出分析結果
             print("\n--- [分析結果 5] 非月票用戶(月消費 199-399元)最常搭乘的 10 個 OD ---")
@@ -287,12 +420,11 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
 
         # 6. 消費 > 399 元用戶的熱門 OD
         print("\n[圖表 6] 產生非月票高額消費(>399)用戶熱門OD圖...")
-        cards_over_399 = monthly_spending[monthly_spending['消費扣款'] > 399]['卡號'].unique()
+        cards_over_399 = card_month_facts.loc[card_month_facts['消費級距'] == '> 399 元', '卡號'].unique()
         high_spenders_399_df = non_monthly_pass_users_df[non_monthly_pass_users_df['卡號'].isin(cards_over_399)]
         if not high_spenders_399_df.empty:
-            complete_trips_high_399 = high_spenders_399_df[high_spenders_399_df['旅次是否完整'] == True].copy()
-            complete_trips_high_399['OD'] = complete_trips_high_399['上車站名'] + ' -> ' + complete_trips_high_399['下車站名']
-            top_od_high_399 = complete_trips_high_399['OD'].value_counts().head(10)
+            complete_trips_high_399 = high_spenders_399_df[high_spenders_399_df['旅次是否完整'] == True]
+            top_od_high_399 = top_od_pairs(complete_trips_high_399['上車站名'], complete_trips_high_399['下車站名'], top_n=10)
             
             # 【新增】印出分析結果
             print("\n--- [分析結果 6] 非月票用戶(月消費 > 399元)最常搭乘的 10 個 OD ---")
@@ -377,9 +509,8 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
 
     # 10. 月票用戶最常搭乘OD
     print("\n[圖表 10] 產生月票用戶最常搭乘OD圖...")
-    complete_trips = monthly_pass_users_df[monthly_pass_users_df['旅次是否完整'] == True].copy()
-    complete_trips['OD'] = complete_trips['上車站名'] + ' -> ' + complete_trips['下車站名']
-    top_od = complete_trips['OD'].value_counts().head(10)
+    complete_trips = monthly_pass_users_df[monthly_pass_users_df['旅次是否完整'] == True]
+    top_od = top_od_pairs(complete_trips['上車站名'], complete_trips['下車站名'], top_n=10)
     
     # 【新增】印出分析結果
     print("\n--- [分析結果 10] 月票用戶最常搭乘的 10 個 OD ---")
@@ -437,26 +568,49 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
     # 13. 高頻率月票用戶深度分析
     print("\n--- [區塊 13] 高頻率月票用戶深度分析 ---")
     
-    top_20_users_df = top_20_users_series.reset_index()
-    top_20_users_df.columns = ['卡號', '總搭乘次數']
+    top_users_series = monthly_pass_users_df['卡號'].value_counts().head(profile_top_n)
     
     user_charts_dir = os.path.join(output_dir, 'top_20_user_profiles')
     os.makedirs(user_charts_dir, exist_ok=True)
     print(f"個人化用戶圖表將儲存於: {user_charts_dir}")
 
-    for index, user in top_20_users_df.iterrows():
-        card_id = user['卡號']
+    # OD 鍵值只需編碼一次，所有用戶的剖析統計以 groupby 一次算完
+    pass_od_keys, pass_od_stations = encode_od(monthly_pass_users_df['上車站名'], monthly_pass_users_df['下車站名'])
+    profiles, user_routes, user_hours_all = build_user_profiles(
+        monthly_pass_users_df, list(top_users_series.index), pass_od_keys, pass_od_stations)
+
+    # 全體月票用戶的單日超額搭乘偵測 (一次 groupby，不限於前 N 名用戶)
+    over_riding_cards, over_riding_days = detect_daily_over_riding(monthly_pass_users_df)
+    over_riding_cards.to_csv(os.path.join(output_dir, '13_daily_over_riding_cards.csv'), encoding='utf-8-sig')
+    over_riding_days.to_csv(os.path.join(output_dir, '13_daily_over_riding_days.csv'), index=False, encoding='utf-8-sig')
+    over_riding_days = over_riding_days.set_index('卡號')
+    print(f"\n--- [分析結果 13] 單日搭乘異常的月票卡號共 {len(over_riding_cards)} 張 (前 20 名) ---")
+    over_riding_display = over_riding_cards.head(20).copy()
+    over_riding_display.index = [f"...{cid[-4:]}" for cid in over_riding_display.index]
+    over_riding_display.index.name = '卡號 (末四碼)'
+    print(over_riding_display)
+    print("------------------------------------------------------\n")
+
+    # 剖析總表保留「高頻率搭乘日數」(單日搭乘超過門檻的日數)，取自上方的全體月票用戶偵測
+    profiles['高頻率搭乘日數'] = over_riding_cards['超過門檻日數'].reindex(profiles.index, fill_value=0).astype(int)
+
+    profile_path = os.path.join(output_dir, '13_monthly_pass_user_profiles.csv')
+    profiles_display = profiles.copy()
+    profiles_display.index = [f"...{cid[-4:]}" for cid in profiles.index]
+    profiles_display.index.name = '卡號 (末四碼)'
+    profiles_display.to_csv(profile_path, encoding='utf-8-sig')
+    print(f"前 {len(profiles)} 名月票用戶的剖析總表已儲存至: {profile_path}")
+
+    for card_id in profiles.index[:profile_chart_top_n]:
+        profile = profiles.loc[card_id]
         masked_card_id = f"...{card_id[-4:]}"
-        user_data = monthly_pass_users_df[monthly_pass_users_df['卡號'] == card_id].copy()
-        
-        user_data['OD'] = user_data['上車站名'] + ' -> ' + user_data['下車站名']
-        most_common_od = user_data['OD'].mode()[0] if not user_data['OD'].mode().empty else "無"
-        routes_summary = user_data['路線'].value_counts()
-        user_hours = user_data['上車時段'].value_counts().sort_index()
+        most_common_od = profile['最常搭乘OD']
+        routes_summary = user_routes.loc[card_id]
+        user_hours = user_hours_all.loc[card_id]
 
         # 【新增】印出該用戶的詳細分析結果
         print(f"\n--- [用戶分析] {masked_card_id} ---")
-        print(f"總搭乘次數: {user['總搭乘次數']}")
+        print(f"總搭乘次數: {profile['總搭乘次數']}")
         print(f"最常搭乘 OD: {most_common_od}")
         print("\n常用路線及次數:")
         print(routes_summary)
@@ -488,16 +642,12 @@ def analyze_and_visualize_bus_data(file_path='unified_data.csv'):
         
         print(f"  -> 已儲存用戶 {masked_card_id} 的個人化合併分析圖表。")
         
-        # 檢查單日搭乘是否超過5次
-        user_data['上車日期'] = user_data['上車時間'].dt.date
-        daily_rides = user_data.groupby('上車日期').size()
-        high_freq_days = daily_rides[daily_rides > 5]
-        
-        if not high_freq_days.empty:
+        # 單日超額搭乘 (結果取自上方的全體月票用戶偵測)
+        if card_id in over_riding_cards.index:
             # 使用 ANSI escape code 顯示黃色警告
-            print(f"\033[93m  -> [注意] 用戶 {masked_card_id} 有單日搭乘超過5次的情況：\033[0m")
-            for ride_date, count in high_freq_days.items():
-                print(f"\03f[93m     - 日期: {ride_date}, 搭乘次數: {count}\033[0m")
+            print(f"\033[93m  -> [注意] 用戶 {masked_card_id} 有單日搭乘異常的情況：\033[0m")
+            for row in over_riding_days.loc[[card_id]].itertuples():
+                print(f"\033[93m     - 日期: {row.上車日期.date()}, 搭乘次數: {row.搭乘次數} ({row.判定原因})\033[0m")
 
 
     print("\n所有分析與圖表產生完畢！")
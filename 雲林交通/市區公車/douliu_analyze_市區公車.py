@@ -1,13 +1,21 @@
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+
+# 時段直方圖的共用工具 (雲林交通/time_buckets.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from time_buckets import count_by_day_type_and_slot, slots_per_day, slots_per_hour, slot_to_time
 
 # --- 全域設定 ---
 # 設定 Matplotlib 使用支援中文的字體，以避免圖表中的中文顯示為亂碼
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
 # 解決 Matplotlib 圖表中負號顯示問題
 plt.rcParams['axes.unicode_minus'] = False
+# 時段直方圖的時間區間長度 (分鐘)，時段數與圖表刻度皆由此推算
+BUCKET_MINUTES = 5
 
 # --- 函式定義 ---
 
@@ -36,6 +44,13 @@ def load_data(filepath='unified_data.csv'):
         
         # 移除時間欄位為 NaT 的無效資料
         df.dropna(subset=['上車時間', '下車時間'], inplace=True)
+
+        # 預先建立當日秒數 (int32) 與星期 (int8) 欄位，
+        # 讓通勤時段的篩選改用整數範圍比較，不必逐列產生 datetime.time 物件
+        for prefix in ['上車', '下車']:
+            times = df[f'{prefix}時間']
+            df[f'{prefix}秒數'] = (times.dt.hour * 3600 + times.dt.minute * 60 + times.dt.second).astype(np.int32)
+            df[f'{prefix}星期'] = times.dt.dayofweek.astype(np.int8)
         
         print("資料讀取與基礎預處理完成。")
         return df
@@ -61,42 +76,35 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder='douli
         print(f"已建立資料夾：'{output_folder}'")
 
     # 1. 篩選與指定車站相關的紀錄
-    station_boardings_df = df[df['上車站名'] == station_name].copy()
-    station_alightings_df = df[df['下車站名'] == station_name].copy()
+    station_boardings_df = df[df['上車站名'] == station_name]
+    station_alightings_df = df[df['下車站名'] == station_name]
 
     if station_boardings_df.empty and station_alightings_df.empty:
         print(f"警告：在資料中找不到任何與車站 '{station_name}' 相關的紀錄。")
         return
 
-    # 2. 標記平日與假日 (星期一=0, 星期日=6)
-    station_boardings_df['day_type'] = station_boardings_df['上車時間'].dt.dayofweek.apply(lambda x: '平日' if x < 5 else '假日')
-    station_alightings_df['day_type'] = station_alightings_df['下車時間'].dt.dayofweek.apply(lambda x: '平日' if x < 5 else '假日')
-
-    # 3. 計算每5分鐘一個時間區間的索引
-    station_boardings_df['time_interval'] = (station_boardings_df['上車時間'].dt.hour * 12) + (station_boardings_df['上車時間'].dt.minute // 5)
-    station_alightings_df['time_interval'] = (station_alightings_df['下車時間'].dt.hour * 12) + (station_alightings_df['下車時間'].dt.minute // 5)
+    # 2. 以 bincount 一次計算「平日/假日 × 每個時間區間」的人次
+    boarding_counts = count_by_day_type_and_slot(station_boardings_df['上車時間'], BUCKET_MINUTES)
+    alighting_counts = count_by_day_type_and_slot(station_alightings_df['下車時間'], BUCKET_MINUTES)
 
-    # 4. 按「日期類型」和「時間區間」分組，並統計人次
-    boarding_counts = station_boardings_df.groupby(['day_type', 'time_interval']).size().unstack(level=0, fill_value=0)
-    alighting_counts = station_alightings_df.groupby(['day_type', 'time_interval']).size().unstack(level=0, fill_value=0)
-
-    # 5. 建立一個包含所有時間區間的 DataFrame 以便合併與繪圖
-    peak_df = pd.DataFrame(index=range(288))
-    peak_df['平日上車'] = peak_df.index.map(boarding_counts.get('平日', {})).fillna(0)
-    peak_df['假日上車'] = peak_df.index.map(boarding_counts.get('假日', {})).fillna(0)
-    peak_df['平日下車'] = peak_df.index.map(alighting_counts.get('平日', {})).fillna(0)
-    peak_df['假日下車'] = peak_df.index.map(alighting_counts.get('假日', {})).fillna(0)
+    # 3. 整理成包含一天所有時間區間的 DataFrame 以便繪圖
+    peak_df = pd.DataFrame({
+        '平日上車': boarding_counts[0], '假日上車': boarding_counts[1],
+        '平日下車': alighting_counts[0], '假日下車': alighting_counts[1]
+    }, index=range(slots_per_day(BUCKET_MINUTES)))
     
-    # 6. 定義要繪製的四個時段
+    # 4. 定義要繪製的四個時段 (以時段代碼表示的起訖範圍)
+    per_hour = slots_per_hour(BUCKET_MINUTES)
+    last_slot = slot_to_time(6 * per_hour - 1, BUCKET_MINUTES)[2:]
     time_chunks = {
-        "清晨 (00:00-05:55)": (0, 6 * 12),
-        "上午 (06:00-11:55)": (6 * 12, 12 * 12),
-        "下午 (12:00-17:55)": (12 * 12, 18 * 12),
-        "傍晚至午夜 (18:00-23:55)": (18 * 12, 24 * 12)
+        f"清晨 (00:00-05{last_slot})": (0, 6 * per_hour),
+        f"上午 (06:00-11{last_slot})": (6 * per_hour, 12 * per_hour),
+        f"下午 (12:00-17{last_slot})": (12 * per_hour, 18 * per_hour),
+        f"傍晚至午夜 (18:00-23{last_slot})": (18 * per_hour, 24 * per_hour)
     }
 
     print("開始產生各時段的平假日流量圖...")
-    # 7. 遍歷四個時段並分別繪圖
+    # 5. 遍歷四個時段並分別繪圖
     for chunk_name, (start_interval, end_interval) in time_chunks.items():
         print(f"-> 正在繪製 '{chunk_name}' 時段圖表...")
         
@@ -105,13 +113,13 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder='douli
         plt.figure(figsize=(15, 8))
         sns.lineplot(data=chunk_data, dashes=False, marker='o', markersize=5)
         
-        plt.title(f'{station_name} - {chunk_name} 平日與假日上下車流量分析 (每5分鐘)', fontsize=18, fontweight='bold')
+        plt.title(f'{station_name} - {chunk_name} 平日與假日上下車流量分析 (每{BUCKET_MINUTES}分鐘)', fontsize=18, fontweight='bold')
         plt.xlabel('時間', fontsize=12)
         plt.ylabel('總人次', fontsize=12)
 
-        start_hour = start_interval // 12
-        end_hour = end_interval // 12
-        ticks = [h * 12 for h in range(start_hour, end_hour)]
+        start_hour = start_interval // per_hour
+        end_hour = end_interval // per_hour
+        ticks = [h * per_hour for h in range(start_hour, end_hour)]
         labels = [f'{h:02d}:00' for h in range(start_hour, end_hour)]
         plt.xticks(ticks=ticks, labels=labels, rotation=45, ha="right")
         plt.xlim(start_interval, end_interval - 1)
@@ -127,9 +135,9 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder='douli
 
     print(f"\n所有時段流量圖已成功產生並儲存於 '{output_folder}' 資料夾中。")
 
-    # 8. 產生文字報告
+    # 6. 產生文字報告
     print(f"\n\n===== 市區公車在{station_name}的人流時段分析 =====")
-    print("\n--- 各時段每5分鐘詳細流量 ---")
+    print(f"\n--- 各時段每{BUCKET_MINUTES}分鐘詳細流量 ---")
 
     for chunk_name, (start_interval, end_interval) in time_chunks.items():
         print(f"\n時段: {chunk_name}")
@@ -142,9 +150,7 @@ def analyze_and_plot_by_time_and_day_type(df, station_name, output_folder='douli
             continue
 
         for idx, row in active_times.iterrows():
-            hour = idx // 12
-            minute = (idx % 12) * 5
-            time_str = f'{hour:02d}:{minute:02d}'
+            time_str = slot_to_time(idx, BUCKET_MINUTES)
             weekday_on = int(row['平日上車'])
             weekday_off = int(row['平日下車'])
             weekend_on = int(row['假日上車'])
@@ -165,16 +171,15 @@ def plot_morning_destinations(df, station_name, output_folder='douliu_charts', t
     """
     print(f"開始分析 '{station_name}' 的平日早上通勤目的地...")
     
-    # 1. 篩選平日 (週一至週五)
-    df_weekday = df[df['上車時間'].dt.dayofweek < 5].copy()
-    
-    # 2. 篩選早上 06:30 到 09:00 之間，且從指定車站上車的紀錄
-    start_time = pd.to_datetime('06:30').time()
-    end_time = pd.to_datetime('09:00').time()
-    df_morning_rush = df_weekday[
-        (df_weekday['上車站名'] == station_name) &
-        (df_weekday['上車時間'].dt.time >= start_time) &
-        (df_weekday['上車時間'].dt.time < end_time)
+    # 1~2. 篩選平日 (週一至週五) 早上 06:30 到 09:00 之間，且從指定車站上車的紀錄
+    #      (以 load_data 預先建立的星期與當日秒數欄位做整數比較)
+    start_sec = 6 * 3600 + 30 * 60
+    end_sec = 9 * 3600
+    df_morning_rush = df[
+        (df['上車星期'] < 5) &
+        (df['上車站名'] == station_name) &
+        (df['上車秒數'] >= start_sec) &
+        (df['上車秒數'] < end_sec)
     ]
     
     if df_morning_rush.empty:
@@ -211,16 +216,14 @@ def plot_evening_origins(df, station_name, output_folder='douliu_charts', top_n=
     """
     print(f"\n開始分析 '{station_name}' 的平日傍晚通勤起始站...")
     
-    # 1. 篩選平日 (週一至週五)
-    df_weekday = df[df['下車時間'].dt.dayofweek < 5].copy()
-    
-    # 2. 篩選傍晚 16:00 到 18:30 之間，且在指定車站下車的紀錄
-    start_time = pd.to_datetime('16:00').time()
-    end_time = pd.to_datetime('18:30').time()
-    df_evening_rush = df_weekday[
-        (df_weekday['下車站名'] == station_name) &
-        (df_weekday['下車時間'].dt.time >= start_time) &
-        (df_weekday['下車時間'].dt.time < end_time)
+    # 1~2. 篩選平日 (週一至週五) 傍晚 16:00 到 18:30 之間，且在指定車站下車的紀錄
+    start_sec = 16 * 3600
+    end_sec = 18 * 3600 + 30 * 60
+    df_evening_rush = df[
+        (df['下車星期'] < 5) &
+        (df['下車站名'] == station_name) &
+        (df['下車秒數'] >= start_sec) &
+        (df['下車秒數'] < end_sec)
     ]
     
     if df_evening_rush.empty:
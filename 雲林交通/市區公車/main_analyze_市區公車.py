@@ -1,4 +1,5 @@
 import pandas as pd
+import math
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
@@ -294,7 +295,7 @@ def plot_top_od_pairs(df, n=15):
     plt.savefig(os.path.join(output_folder, '8_主要交通廊帶分析.png'))
     plt.close()
 
-def plot_student_pattern_per_route(df, min_records=20):
+def plot_student_pattern_per_route(df, min_records=20, routes_per_page=12, n_cols=3):
     print("正在為各路線產生學生平日通勤模式圖...")
     
     per_route_folder = os.path.join(output_folder, '各路線學生通勤模式')
@@ -302,42 +303,49 @@ def plot_student_pattern_per_route(df, min_records=20):
         os.makedirs(per_route_folder)
         
     student_df = df[(df['票種分類'] == '學生') & (df['平日/週末'] == '平日')]
-    unique_routes = student_df['路線'].unique()
-    
-    print(f"偵測到 {len(unique_routes)} 條路線有學生搭乘記錄，將開始逐一製圖...")
-    
-    # 【新增】印出分析結果的標題
-    print("\n--- 9. 各路線學生平日通勤模式分析結果 ---")
+
+    # 以一次 groupby 建立「路線 × 上車小時」矩陣，取代逐條路線重新篩選整份學生資料
+    route_hour = (student_df.groupby(['路線', '上車小時']).size()
+                  .unstack(fill_value=0)
+                  .reindex(columns=range(24), fill_value=0))
+    route_hour.columns.name = '上車小時'
+    route_totals = route_hour.sum(axis=1)
     
-    for route in unique_routes:
-        route_df = student_df[student_df['路線'] == route]
-        
-        if len(route_df) < min_records:
-            print(f"-> 路線 {route} 的學生搭乘資料量過少 ({len(route_df)} 筆)，已跳過。")
-            continue
-            
-        print(f"-> 正在產生路線 {route} 的圖表...")
-        
-        student_hourly = route_df.groupby('上車小時').size()
-        student_hourly = student_hourly.reindex(range(24), fill_value=0)
+    print(f"偵測到 {len(route_hour)} 條路線有學生搭乘記錄，將以分頁小圖方式製圖...")
+    for route, total in route_totals[route_totals < min_records].items():
+        print(f"-> 路線 {route} 的學生搭乘資料量過少 ({total} 筆)，已跳過。")
+    route_hour = route_hour[route_totals >= min_records]
 
-        # 【新增】印出該路線的分析數據
-        print(f"\n===== 路線 {route} 學生搭乘時段分佈 =====")
-        print(student_hourly)
-        print("=" * 40)
-        
-        plt.figure(figsize=(15, 8))
-        sns.lineplot(x=student_hourly.index, y=student_hourly.values, marker='o', color='dodgerblue')
-        plt.title(f'路線 {route} - 學生平日搭乘時段分佈', fontsize=18, fontweight='bold')
-        plt.xlabel('上車小時', fontsize=12)
-        plt.ylabel('總搭乘人次', fontsize=12)
-        plt.xticks(ticks=range(24))
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.tight_layout()
-        
-        safe_route_name = str(route).replace('/', '_')
-        plt.savefig(os.path.join(per_route_folder, f'學生通勤模式_路線_{safe_route_name}.png'))
-        plt.close()
+    print("\n--- 9. 各路線學生平日通勤模式分析結果 ---")
+    summary = pd.DataFrame({'總搭乘人次': route_hour.sum(axis=1), '尖峰小時': route_hour.idxmax(axis=1)})
+    print(summary.to_string())
+    table_path = os.path.join(per_route_folder, '學生通勤模式_路線x小時.csv')
+    route_hour.to_csv(table_path, encoding='utf-8-sig')
+    print(f"完整的路線 × 小時矩陣已儲存至: {table_path}")
+
+    # 分頁小圖 (small multiples)：每頁 routes_per_page 條路線，取代每條路線一張 15x8 的大圖
+    routes = list(route_hour.index)
+    n_pages = math.ceil(len(routes) / routes_per_page)
+    for page in range(n_pages):
+        page_routes = routes[page * routes_per_page:(page + 1) * routes_per_page]
+        n_rows = math.ceil(len(page_routes) / n_cols)
+        print(f"-> 正在產生第 {page + 1}/{n_pages} 頁 (共 {len(page_routes)} 條路線)...")
+
+        fig, axes = plt.subplots(n_rows, n_cols, figsize=(6 * n_cols, 4 * n_rows), sharex=True, squeeze=False)
+        for ax, route in zip(axes.flat, page_routes):
+            ax.plot(route_hour.columns, route_hour.loc[route].values, marker='o', markersize=3, color='dodgerblue')
+            ax.set_title(f'路線 {route}', fontsize=12, fontweight='bold')
+            ax.set_xticks(range(0, 24, 3))
+            ax.grid(True, linestyle='--', alpha=0.7)
+        for ax in axes.flat[len(page_routes):]:
+            ax.set_visible(False)
+
+        fig.suptitle(f'各路線學生平日搭乘時段分佈 (第 {page + 1}/{n_pages} 頁)', fontsize=18, fontweight='bold')
+        fig.supxlabel('上車小時', fontsize=12)
+        fig.supylabel('總搭乘人次', fontsize=12)
+        fig.tight_layout()
+        fig.savefig(os.path.join(per_route_folder, f'學生通勤模式_第{page + 1:02d}頁.png'))
+        plt.close(fig)
 
     print("-------------------------------------------\n")
     print("所有路線的學生通勤模式圖表已產生完畢。")
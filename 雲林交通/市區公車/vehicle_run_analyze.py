@@ -0,0 +1,172 @@
+# 檔名: vehicle_run_analyze.py
+# 功能: 由 unified_data.csv 的「車號」與「司機」欄位重建車輛班次 (run)，計算每一班次的載客量與生產力。
+# 說明: 同一車號的刷卡紀錄依上車時間排序後，以向量化的方式偵測班次切點：
+#       車號改變、與前一筆刷卡間隔超過 RUN_GAP_MINUTES 分鐘、路線或往返程改變時，視為新的班次。
+#       每一班次計算上車人次、收入 (消費扣款合計) 與尖峰車上人數 (上車 +1 / 下車 −1 的累積和)，
+#       再彙整成各路線的班次生產力表。
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import seaborn as sns
+import os
+
+# --- 全域設定 ---
+plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+output_folder = 'vehicle_run_results'
+if not os.path.exists(output_folder):
+    os.makedirs(output_folder)
+
+# 同一車號兩筆刷卡間隔超過此分鐘數，視為不同班次
+RUN_GAP_MINUTES = 20
+
+# --- 1. 資料讀取 ---
+def load_data(filepath='unified_data.csv'):
+    """
+    讀取 unify_data.py 產生的統一資料，只保留有車號與有效上車時間的紀錄。
+
+    Returns:
+        pd.DataFrame or None: 讀取失敗時回傳 None。
+    """
+    print(f"開始讀取資料：'{filepath}'...")
+    try:
+        df = pd.read_csv(filepath, dtype={'路線': str, '司機': str, '車號': str, '卡號': str})
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案 '{filepath}'。請確保已先執行 unify_data.py。")
+        return None
+
+    df['上車時間'] = pd.to_datetime(df['上車時間'], errors='coerce')
+    df['下車時間'] = pd.to_datetime(df['下車時間'], errors='coerce')
+    df['消費扣款'] = pd.to_numeric(df['消費扣款'], errors='coerce').fillna(0)
+    df['往返程'] = df['往返程'].fillna('未提供').astype(str)
+    df['車號'] = df['車號'].astype(str).str.strip()
+    df = df[df['上車時間'].notna() & ~df['車號'].isin(['', 'nan', '0'])]
+    print(f"資料讀取完成，共 {len(df)} 筆有車號的刷卡紀錄。")
+    return df
+
+# --- 2. 班次切分 ---
+def segment_runs(df, gap_minutes=RUN_GAP_MINUTES):
+    """
+    依 (車號, 上車時間) 排序後，以向量化比較前後兩筆找出班次切點。
+
+    Returns:
+        tuple: (排序後的資料 (含 '班次編號' 欄位), 每個班次第一筆的位置陣列)
+    """
+    df = df.sort_values(['車號', '上車時間'], kind='stable', ignore_index=True)
+    vehicle = pd.factorize(df['車號'])[0]
+    route = pd.factorize(df['路線'])[0]
+    direction = pd.factorize(df['往返程'])[0]
+    board = df['上車時間'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+    new_run = np.ones(len(df), dtype=bool)
+    new_run[1:] = ((vehicle[1:] != vehicle[:-1]) | (board[1:] - board[:-1] > gap_minutes * 60)
+                   | (route[1:] != route[:-1]) | (direction[1:] != direction[:-1]))
+    df['班次編號'] = np.cumsum(new_run) - 1
+    return df, np.flatnonzero(new_run)
+
+
+def run_peak_load(df, n_runs):
+    """
+    以 +1/−1 事件的累積和計算每個班次的尖峰車上人數 (只使用下車時間晚於上車時間的完整旅次)。
+    同一時刻先處理下車再處理上車，且只取每個時刻處理完所有事件後的人數。
+    """
+    trips = df[df['旅次是否完整'].astype(str) == 'True']
+    trips = trips[trips['下車時間'] > trips['上車時間']]
+    peak = np.zeros(n_runs, dtype=np.int64)
+    if trips.empty:
+        return peak
+
+    n = len(trips)
+    run = np.concatenate([trips['班次編號'].to_numpy(), trips['班次編號'].to_numpy()])
+    times = np.concatenate([trips['上車時間'].to_numpy(dtype='datetime64[s]'),
+                            trips['下車時間'].to_numpy(dtype='datetime64[s]')]).astype(np.int64)
+    delta = np.concatenate([np.ones(n, dtype=np.int64), -np.ones(n, dtype=np.int64)])
+
+    order = np.lexsort((delta, times, run))
+    run, times, load = run[order], times[order], np.cumsum(delta[order])
+    is_final = np.r_[(run[1:] != run[:-1]) | (times[1:] != times[:-1]), True]
+    starts = np.flatnonzero(np.r_[True, run[1:] != run[:-1]])
+    peak[run[starts]] = np.maximum.reduceat(np.where(is_final, load, 0), starts)
+    return peak
+
+
+def summarize_runs(df, starts):
+    """
+    彙整每個班次的起訖時間、上車人次、收入與尖峰車上人數。
+
+    Returns:
+        pd.DataFrame: 每列一個班次。
+    """
+    ends = np.r_[starts[1:], len(df)] - 1
+    board = df['上車時間'].to_numpy(dtype='datetime64[s]')
+    alight = df['下車時間'].fillna(df['上車時間']).to_numpy(dtype='datetime64[s]')
+    end_time = np.maximum.reduceat(np.maximum(board, alight).astype(np.int64), starts).astype('datetime64[s]')
+
+    runs = pd.DataFrame({
+        '車號': df['車號'].to_numpy()[starts],
+        '司機': df['司機'].to_numpy()[starts],
+        '路線': df['路線'].to_numpy()[starts],
+        '往返程': df['往返程'].to_numpy()[starts],
+        '開始時間': board[starts],
+        '結束時間': end_time,
+        '上車人次': ends - starts + 1,
+        '收入': np.add.reduceat(df['消費扣款'].to_numpy(dtype=np.float64), starts),
+        '尖峰車上人數': run_peak_load(df, len(starts)),
+    })
+    runs['營運時間(分)'] = ((runs['結束時間'] - runs['開始時間']).dt.total_seconds() / 60).round(1)
+    hours = (runs['營運時間(分)'] / 60).where(runs['營運時間(分)'] > 0)
+    runs['每小時上車人次'] = (runs['上車人次'] / hours).round(2)
+    runs['每小時收入'] = (runs['收入'] / hours).round(1)
+    return runs
+
+
+def summarize_by_route(runs):
+    """ 各路線、方向的班次生產力 (班次數、平均上車人次、平均收入、平均與最高的尖峰車上人數)。 """
+    summary = runs.groupby(['路線', '往返程']).agg(
+        班次數=('上車人次', 'size'),
+        平均上車人次=('上車人次', 'mean'),
+        平均收入=('收入', 'mean'),
+        平均尖峰車上人數=('尖峰車上人數', 'mean'),
+        最高尖峰車上人數=('尖峰車上人數', 'max'),
+        每小時上車人次中位數=('每小時上車人次', 'median'),
+    ).round(2)
+    return summary.sort_values('平均上車人次', ascending=False)
+
+# --- 3. 視覺化 ---
+def plot_route_productivity(route_summary, top_n=20):
+    print("正在產生圖表：各路線平均每班次上車人次與尖峰車上人數...")
+    data = route_summary.head(top_n).reset_index()
+    data['路線方向'] = data['路線'].astype(str) + ' ' + data['往返程'].astype(str)
+    plot_data = data.melt(id_vars='路線方向', value_vars=['平均上車人次', '平均尖峰車上人數'],
+                          var_name='指標', value_name='人次')
+
+    plt.figure(figsize=(12, max(6, len(data) * 0.45)))
+    sns.barplot(data=plot_data, y='路線方向', x='人次', hue='指標', orient='h', palette='crest')
+    plt.title(f'各路線每班次載客量 (前 {top_n} 名)', fontsize=18, fontweight='bold')
+    plt.xlabel('人次', fontsize=12)
+    plt.ylabel('路線 / 方向', fontsize=12)
+    plt.tight_layout()
+    output_filename = os.path.join(output_folder, 'route_run_productivity.png')
+    plt.savefig(output_filename)
+    plt.close()
+    print(f"圖表已儲存至: {output_filename}")
+
+
+# --- 主程式執行區塊 ---
+if __name__ == '__main__':
+    bus_data = load_data(filepath='unified_data.csv')
+
+    if bus_data is not None and not bus_data.empty:
+        sorted_data, run_starts = segment_runs(bus_data)
+        runs = summarize_runs(sorted_data, run_starts)
+        route_summary = summarize_by_route(runs)
+
+        print(f"\n--- 共重建 {len(runs)} 個班次 (間隔門檻 {RUN_GAP_MINUTES} 分鐘) ---")
+        print(route_summary.to_string())
+
+        runs.to_csv(os.path.join(output_folder, 'vehicle_runs.csv'), index=False, encoding='utf-8-sig')
+        route_summary.to_csv(os.path.join(output_folder, 'run_productivity_by_route.csv'), encoding='utf-8-sig')
+        print(f"\n班次明細與各路線生產力已儲存至 '{output_folder}/' 資料夾。")
+
+        plot_route_productivity(route_summary)